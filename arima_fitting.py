@@ -0,0 +1,132 @@
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from statsmodels.tsa.arima.model import ARIMA
+
+DEFAULT_PARAMS_PATH = "./cache/arima_params.json"
+
+
+class FitBudgetExceeded(Exception):
+    pass
+
+
+def fit_model(train_ts, order, start_params=None, maxiter=800, budget_s=None):
+    # Fits one ARIMA model. When the time budget runs out the optimizer is
+    # stopped and the model is filtered with the last parameters it reached.
+    warnings.filterwarnings("ignore")
+    start = time.perf_counter()
+    model = ARIMA(train_ts, order=order)
+    last = {}
+
+    def callback(params):
+        last['params'] = params
+        if budget_s and time.perf_counter() - start > budget_s:
+            raise FitBudgetExceeded()
+
+    try:
+        model_fit = model.fit(start_params=start_params, method_kwargs={'maxiter': maxiter, 'callback': callback})
+        status = 'converged' if model_fit.mle_retvals.get('converged') else 'not converged'
+    except FitBudgetExceeded:
+        model_fit = model.filter(model.transform_params(last['params']))
+        status = 'time budget'
+    return model, model_fit, status, time.perf_counter() - start
+
+
+def fit_arima(train_ts, order, steps, start_params=None, maxiter=800, budget_s=None):
+    # Fits one ARIMA model and forecasts `steps` values
+    model, model_fit, status, seconds = fit_model(train_ts, order, start_params, maxiter, budget_s)
+    forecast = model_fit.forecast(steps=steps)
+    return {
+        'params': np.asarray(model_fit.params).tolist(),
+        'param_names': model.param_names,
+        'forecast': forecast,
+        'aic': model_fit.aic,
+        'status': status,
+        'seconds': seconds,
+        'warm_start': start_params is not None,
+        'model_fit': model_fit,
+    }
+
+
+def fit_arima_job(job):
+    result = fit_arima(**job)
+    # Results objects hold the whole model, only the summary crosses processes
+    del result['model_fit']
+    return result
+
+
+def load_params(path=DEFAULT_PARAMS_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_params(solutions, path=DEFAULT_PARAMS_PATH):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(solutions, f)
+
+
+def params_key(interval, order):
+    return f"{interval}|{order[0]},{order[1]},{order[2]}"
+
+
+def warm_start(solutions, interval, order, train_ts, intervals):
+    # Start parameters for this interval: its own previous solution, otherwise
+    # the solution of the nearest other interval with the AR/MA coefficients
+    # kept and the constant and variance rescaled to this series
+    own = solutions.get(params_key(interval, order))
+    if own is not None:
+        return np.array(own['params'])
+    position = intervals.index(interval)
+    for other in sorted(intervals, key=lambda i: abs(intervals.index(i) - position)):
+        seed = solutions.get(params_key(other, order))
+        if seed is None:
+            continue
+        names = seed['param_names']
+        params = np.array(seed['params'], dtype=float)
+        ar = [i for i, name in enumerate(names) if name.startswith('ar.')]
+        if 'const' in names:
+            params[names.index('const')] = train_ts.mean() * (1 - params[ar].sum())
+        if 'sigma2' in names:
+            params[names.index('sigma2')] = max(train_ts.var(), 1e-6)
+        return params
+    return None
+
+
+def fit_intervals(series_by_interval, order, train_fraction=0.8, maxiter=800, budget_s=None, workers=None,
+                  params_path=DEFAULT_PARAMS_PATH):
+    # Fits every sampling interval in its own process, seeded with warm starts.
+    # order is one (p, d, q) for all intervals or a dict of them by interval
+    intervals = list(series_by_interval)
+    orders = order if isinstance(order, dict) else dict.fromkeys(intervals, order)
+    solutions = load_params(params_path)
+    jobs = []
+    for interval in intervals:
+        ts = series_by_interval[interval]
+        train_size = int(len(ts) * train_fraction)
+        train_ts = ts[:train_size].dropna()
+        jobs.append({
+            'train_ts': train_ts,
+            'order': orders[interval],
+            'steps': len(ts) - train_size,
+            'start_params': warm_start(solutions, interval, orders[interval], train_ts, intervals),
+            'maxiter': maxiter,
+            'budget_s': budget_s,
+        })
+
+    with ProcessPoolExecutor(max_workers=workers or len(jobs)) as executor:
+        results = dict(zip(intervals, executor.map(fit_arima_job, jobs)))
+
+    for interval, result in results.items():
+        solutions[params_key(interval, orders[interval])] = {'params': result['params'], 'param_names': result['param_names']}
+        print(f"ARIMA{orders[interval]} {interval}: {result['status']} in {result['seconds']:.1f} s"
+              f"{' (warm start)' if result['warm_start'] else ''}, AIC {result['aic']:.1f}")
+    save_params(solutions, params_path)
+    return results
@@ -0,0 +1,134 @@
+import hashlib
+import itertools
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from statsmodels.tsa.stattools import adfuller
+from statsmodels.tsa.arima.estimators.hannan_rissanen import hannan_rissanen
+from statsmodels.tsa.arima.estimators.yule_walker import yule_walker
+from arima_fitting import fit_model, load_params, save_params, params_key, DEFAULT_PARAMS_PATH
+
+DEFAULT_MEMO_PATH = "./cache/arima_orders.json"
+DEFAULT_MAX_P = 6
+DEFAULT_MAX_Q = 6
+DEFAULT_MAX_D = 2
+# Candidates kept for a full maximum likelihood fit after the pre-fit ranking
+DEFAULT_KEEP = 6
+
+
+def series_hash(ts):
+    return hashlib.blake2b(np.ascontiguousarray(ts.values, dtype=np.float64).tobytes(), digest_size=16).hexdigest()
+
+
+def memo_key(digest, order):
+    return f"{digest}|{order[0]},{order[1]},{order[2]}"
+
+
+def differencing_order(ts, max_d=DEFAULT_MAX_D, alpha=0.05):
+    # Smallest d for which the Dickey-Fuller test rejects the unit root
+    values = np.asarray(ts, dtype=np.float64)
+    for d in range(max_d + 1):
+        if len(values) < 10 or np.ptp(values) == 0:
+            return d
+        if adfuller(values)[1] < alpha:
+            return d
+        values = np.diff(values)
+    return max_d
+
+
+def information_criterion(sigma2, nobs, k, criterion):
+    penalty = np.log(nobs) if criterion == 'bic' else 2
+    return nobs * np.log(sigma2) + penalty * k
+
+
+def prefit_score(values, p, q, criterion):
+    # Approximate criterion from the innovation variance of a cheap estimate:
+    # Yule-Walker for pure AR, Hannan-Rissanen when there is an MA part
+    warnings.filterwarnings("ignore")
+    try:
+        if q == 0:
+            params, _ = yule_walker(values, ar_order=p, demean=True)
+        else:
+            params, _ = hannan_rissanen(values, ar_order=p, ma_order=q, demean=True)
+    except (ValueError, np.linalg.LinAlgError):
+        return float('inf')
+    if not np.isfinite(params.sigma2) or params.sigma2 <= 0:
+        return float('inf')
+    return information_criterion(params.sigma2, len(values), p + q + 2, criterion)
+
+
+def candidate_orders(ts, d, max_p, max_q, criterion, keep):
+    # Ranks every (p, d, q) by its pre-fit score and keeps the `keep` best
+    values = np.asarray(ts, dtype=np.float64)
+    values = np.diff(values, n=d) if d else values
+    scores = []
+    for p, q in itertools.product(range(max_p + 1), range(max_q + 1)):
+        # Leave enough observations per parameter for the estimators
+        if p + q + 1 > len(values) // 4:
+            continue
+        scores.append((prefit_score(values, p, q, criterion), (p, d, q)))
+    scores.sort()
+    return [order for score, order in scores[:keep] if np.isfinite(score)] or [(0, d, 0)]
+
+
+def fit_candidate(job):
+    model, model_fit, status, seconds = fit_model(job['train_ts'], job['order'], maxiter=job['maxiter'],
+                                                  budget_s=job['budget_s'])
+    return {
+        'params': np.asarray(model_fit.params).tolist(),
+        'param_names': model.param_names,
+        'aic': float(model_fit.aic),
+        'bic': float(model_fit.bic),
+        'status': status,
+        'seconds': seconds,
+    }
+
+
+def load_memo(path=DEFAULT_MEMO_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def select_orders(train_by_interval, criterion='aic', max_p=DEFAULT_MAX_P, max_q=DEFAULT_MAX_Q, max_d=DEFAULT_MAX_D,
+                  keep=DEFAULT_KEEP, maxiter=200, budget_s=None, workers=None, memo_path=DEFAULT_MEMO_PATH,
+                  params_path=DEFAULT_PARAMS_PATH):
+    # Order search for every training series: d from the Dickey-Fuller test,
+    # (p, q) pruned by the pre-fits, the remaining candidates of all intervals
+    # fitted in parallel and memoized by (series hash, order). The parameters
+    # of each winner are stored as the warm start of the final fit.
+    start = time.perf_counter()
+    memo = load_memo(memo_path)
+    candidates = {}
+    jobs = {}
+    for interval, train_ts in train_by_interval.items():
+        digest = series_hash(train_ts)
+        d = differencing_order(train_ts, max_d)
+        candidates[interval] = [(order, memo_key(digest, order))
+                                for order in candidate_orders(train_ts, d, max_p, max_q, criterion, keep)]
+        for order, key in candidates[interval]:
+            if key not in memo and key not in jobs:
+                jobs[key] = {'train_ts': train_ts, 'order': order, 'maxiter': maxiter, 'budget_s': budget_s}
+        print(f"ARIMA order search {interval}: d={d}, {len(candidates[interval])} candidates after pre-fit")
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            memo.update(zip(jobs, executor.map(fit_candidate, jobs.values())))
+        save_params(memo, memo_path)
+
+    solutions = load_params(params_path)
+    orders = {}
+    for interval, interval_candidates in candidates.items():
+        order, key = min(interval_candidates, key=lambda candidate: memo[candidate[1]][criterion])
+        orders[interval] = order
+        best = memo[key]
+        solutions[params_key(interval, order)] = {'params': best['params'], 'param_names': best['param_names']}
+        print(f"ARIMA order search {interval}: selected {order}, {criterion.upper()} {best[criterion]:.1f}")
+    save_params(solutions, params_path)
+    print(f"ARIMA order search: {len(jobs)} candidates fitted ({sum(len(c) for c in candidates.values()) - len(jobs)} "
+          f"memoized) in {time.perf_counter() - start:.1f} s.")
+    return orders
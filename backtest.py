@@ -0,0 +1,123 @@
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from arima_fitting import fit_model
+from lag_regression import forecast_buckets, REGRESSOR_NAMES
+
+DEFAULT_FOLDS = 5
+# Share of the series always used for training, the folds cover the rest
+DEFAULT_MIN_TRAIN = 0.5
+# Inputs of the per-packet Random Forest, as trained by prediction.py
+PACKET_FEATURES = ['Source MAC', 'Destination MAC', 'Source Port', 'Destination Port', 'Elapsed time', 'Protocol']
+
+
+def rolling_origins(length, folds=DEFAULT_FOLDS, min_train=DEFAULT_MIN_TRAIN):
+    # (origin, end) of every fold: train on [0, origin), test on [origin, end)
+    first = int(length * min_train)
+    horizon = (length - first) // folds
+    if horizon < 1:
+        return []
+    return [(first + fold * horizon, first + (fold + 1) * horizon) for fold in range(folds)]
+
+
+def accuracy(actual, predicted):
+    actual = np.asarray(actual, dtype=np.float64)
+    errors = np.asarray(predicted, dtype=np.float64) - actual
+    variance = ((actual - actual.mean()) ** 2).sum()
+    # MAPE is only defined on buckets with traffic
+    nonzero = actual != 0
+    return {
+        'MSE': (errors ** 2).mean(),
+        'MAE': np.abs(errors).mean(),
+        'R2': 1 - (errors ** 2).sum() / variance if variance else float('nan'),
+        'MAPE': np.abs(errors[nonzero] / actual[nonzero]).mean() * 100 if nonzero.any() else float('nan'),
+    }
+
+
+def backtest_arima(job):
+    # One maximum likelihood fit on the first training window, every later fold
+    # only extends the fitted state through the new observations and reads the
+    # one-step-ahead predictions, no refit
+    warnings.filterwarnings("ignore")
+    series, origins = job['series'], job['origins']
+    start = time.perf_counter()
+    model, results, status, seconds = fit_model(series[:origins[0][0]], job['order'], job['start_params'],
+                                                job['maxiter'], job['budget_s'])
+    folds = []
+    for fold, (origin, end) in enumerate(origins):
+        fold_start = time.perf_counter()
+        results = results.extend(series[origin:end])
+        folds.append({'fold': fold, 'train': origin, 'test': end - origin,
+                      **accuracy(series[origin:end].values, np.clip(results.predict(), 0, None)),
+                      'seconds': time.perf_counter() - fold_start})
+    folds[0]['seconds'] += seconds
+    return folds
+
+
+def backtest_lags_fold(job):
+    # Tree ensembles cannot be extended, every fold is a refit in its own process
+    start = time.perf_counter()
+    series, (origin, end) = job['series'], job['origin']
+    predicted, model = forecast_buckets(series[:end], series.index[origin], job['kind'], workers=1, report=False)
+    return {'fold': job['fold'], 'train': origin, 'test': end - origin,
+            **accuracy(series[origin:end].values, predicted.values), 'seconds': time.perf_counter() - start}
+
+
+def backtest_packets_fold(job):
+    # Per-packet Random Forest refitted on the flow bucket rows before the fold
+    # origin; its predictions of the fold rows are summed per bucket, as in the main run
+    start = time.perf_counter()
+    frame, series, (origin, end) = job['frame'], job['series'], job['origin']
+    timestamps = frame['Timestamp'].values
+    train = timestamps < series.index[origin].to_datetime64()
+    test = ~train if end == len(series) else ~train & (timestamps < series.index[end].to_datetime64())
+    regressor = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=1)
+    regressor.fit(frame.loc[train, PACKET_FEATURES], frame.loc[train, 'Packet Count'])
+    buckets = series.index.searchsorted(timestamps[test], side='right') - 1 - origin
+    predicted = np.bincount(buckets, weights=regressor.predict(frame.loc[test, PACKET_FEATURES]), minlength=end - origin)
+    return {'fold': job['fold'], 'train': origin, 'test': end - origin,
+            **accuracy(series[origin:end].values, predicted), 'seconds': time.perf_counter() - start}
+
+
+def run_backtest(series_by_interval, orders, regressor='hgb', folds=DEFAULT_FOLDS, start_params=None, maxiter=800,
+                 budget_s=None, workers=None, packets_frame=None):
+    # Rolling-origin backtest of ARIMA and of the lag regressor on every
+    # interval, all jobs in one process pool. With packets_frame (flow bucket
+    # rows with their PACKET_FEATURES and Packet Count) the per-packet Random
+    # Forest is backtested instead of the lag regressor, with regressor None
+    # neither is. Returns one row per model, interval and fold.
+    start = time.perf_counter()
+    start_params = start_params or {}
+    jobs = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for interval, series in series_by_interval.items():
+            origins = rolling_origins(len(series), folds)
+            if not origins:
+                continue
+            order = orders[interval] if isinstance(orders, dict) else orders
+            jobs.append((f'ARIMA{order}', interval, executor.submit(backtest_arima, {
+                'series': series, 'origins': origins, 'order': order, 'start_params': start_params.get(interval),
+                'maxiter': maxiter, 'budget_s': budget_s})))
+            for fold, origin in enumerate(origins):
+                if packets_frame is not None:
+                    jobs.append(('Random Forest (packets)', interval, executor.submit(backtest_packets_fold, {
+                        'frame': packets_frame, 'series': series, 'origin': origin, 'fold': fold})))
+                elif regressor:
+                    jobs.append((REGRESSOR_NAMES[regressor], interval, executor.submit(backtest_lags_fold, {
+                        'series': series, 'origin': origin, 'fold': fold, 'kind': regressor})))
+        rows = []
+        for model, interval, future in jobs:
+            result = future.result()
+            for fold in (result if isinstance(result, list) else [result]):
+                rows.append({'model': model, 'interval': interval, **fold})
+    table = pd.DataFrame(rows)
+    print(f"[INFO] Backtested {len(table)} folds in {time.perf_counter() - start:.1f} s.")
+    return table
+
+
+def summarize_backtest(table):
+    # Mean of every metric by model and interval
+    return table.groupby(['model', 'interval'], sort=False)[['MSE', 'MAE', 'R2', 'MAPE', 'seconds']].mean()
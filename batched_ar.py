@@ -0,0 +1,87 @@
+import time
+import numpy as np
+import pandas as pd
+
+DEFAULT_AR_ORDER = 8
+DEFAULT_RIDGE = 1e-9
+
+
+def bucket_matrix(keys, timestamps, width_ns, weights=None):
+    # Counts of many series in one bincount: a (series x buckets) matrix over
+    # the common time range, one row per distinct key (or key row of a 2-D array)
+    timestamps = np.asarray(timestamps).astype('datetime64[ns]').view(np.int64)
+    keys = np.asarray(keys)
+    labels, series_ids = np.unique(keys, axis=0 if keys.ndim == 2 else None, return_inverse=True)
+    series_ids = series_ids.ravel()
+    first = timestamps.min() // width_ns
+    buckets = timestamps // width_ns - first
+    columns = int(buckets.max()) + 1
+    counts = np.bincount(series_ids * columns + buckets, weights=weights, minlength=len(labels) * columns)
+    index = pd.date_range(start=pd.Timestamp(first * width_ns), periods=columns,
+                          freq=pd.Timedelta(width_ns, unit='ns'), name='Timestamp')
+    return labels, index, counts.reshape(len(labels), columns).astype(np.float64)
+
+
+def lagged_views(matrix, order):
+    # Regressors of every bucket from `order` on: a constant and the previous
+    # `order` counts, as views on the matrix (no (series x buckets x lags) copy)
+    columns = matrix.shape[1]
+    return [np.ones((matrix.shape[0], columns - order))] + \
+           [matrix[:, order - lag:columns - lag] for lag in range(1, order + 1)]
+
+
+def fit_ar_batch(matrix, order=DEFAULT_AR_ORDER, ridge=DEFAULT_RIDGE):
+    # Least squares AR(order) with intercept of every row at once: the normal
+    # equations of all series are accumulated as (series x k x k) stacks and
+    # solved in one batched call. Returns (series x order+1) coefficients.
+    regressors = lagged_views(matrix, order)
+    target = matrix[:, order:]
+    k = order + 1
+    gram = np.empty((matrix.shape[0], k, k))
+    moments = np.empty((matrix.shape[0], k))
+    for i in range(k):
+        moments[:, i] = np.einsum('st,st->s', regressors[i], target)
+        for j in range(i, k):
+            gram[:, i, j] = gram[:, j, i] = np.einsum('st,st->s', regressors[i], regressors[j])
+    # A small ridge keeps idle series (all zeros) solvable
+    gram += ridge * np.maximum(gram.trace(axis1=1, axis2=2), 1.0)[:, None, None] * np.eye(k)
+    return np.linalg.solve(gram, moments[:, :, None])[:, :, 0]
+
+
+def predict_ar_batch(coefficients, matrix):
+    # One-step-ahead predictions of every bucket from `order` on
+    regressors = lagged_views(matrix, coefficients.shape[1] - 1)
+    return np.clip(sum(coefficients[:, i:i + 1] * regressor for i, regressor in enumerate(regressors)), 0, None)
+
+
+def forecast_ar_batch(coefficients, matrix, steps):
+    # Recursive forecast of `steps` buckets after the end of every row
+    order = coefficients.shape[1] - 1
+    window = matrix[:, matrix.shape[1] - order:].copy()
+    forecasts = np.empty((matrix.shape[0], steps))
+    for step in range(steps):
+        forecasts[:, step] = np.clip(coefficients[:, 0] + np.einsum('sl,sl->s', coefficients[:, 1:], window[:, ::-1]), 0, None)
+        window = np.column_stack([window[:, 1:], forecasts[:, step]])
+    return forecasts
+
+
+def evaluate_series(name, labels, index, matrix, split_time, order=DEFAULT_AR_ORDER):
+    # Fits on the buckets before split_time, predicts the following ones one
+    # step ahead and reports the throughput and the errors
+    split = int(np.searchsorted(index.values, np.datetime64(split_time)))
+    if split <= order + 1 or split >= matrix.shape[1]:
+        print(f"Batched AR({order}) {name}: not enough buckets.")
+        return None
+    start = time.perf_counter()
+    coefficients = fit_ar_batch(matrix[:, :split], order)
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    predicted = predict_ar_batch(coefficients, matrix[:, split - order:])
+    predict_seconds = time.perf_counter() - start
+    errors = predicted - matrix[:, split:]
+    rmse = np.sqrt((errors ** 2).mean(axis=1))
+    worst = np.argsort(rmse)[::-1][:3]
+    print(f"Batched AR({order}) {name}: {len(labels)} series x {matrix.shape[1]} buckets, "
+          f"fitted {len(labels) / max(fit_seconds, 1e-9):.0f} series/s, predicted {len(labels) / max(predict_seconds, 1e-9):.0f} series/s, "
+          f"median RMSE {np.median(rmse):.2f}, worst {', '.join(f'{labels[i]} ({rmse[i]:.2f})' for i in worst)}.")
+    return pd.DataFrame({'Series': labels, 'RMSE': rmse, 'MAE': np.abs(errors).mean(axis=1)})
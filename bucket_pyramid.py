@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+DAY_NS = 86400 * 1000000000
+BASE_INTERVAL = '100ms'
+
+
+def interval_ns(interval):
+    return to_offset(interval).nanos
+
+
+class BucketPyramid:
+    # Packet counts bucketed once at the base interval; every coarser interval
+    # that is a multiple of the base is derived by summing groups of base
+    # buckets, other intervals are bucketed directly. Buckets are aligned to
+    # midnight of the first day like DataFrame.resample, and each interval is
+    # computed once and then shared by all consumers.
+
+    def __init__(self, timestamps, weights=None, base_interval=BASE_INTERVAL, name='Packet Count'):
+        self.timestamps = np.asarray(timestamps).astype('datetime64[ns]').view(np.int64)
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+        self.weighted = weights is not None
+        self.base_ns = interval_ns(base_interval)
+        self.name = name
+        self.origin = self.timestamps.min() // DAY_NS * DAY_NS if len(self.timestamps) else 0
+        self.first_base, self.base_counts = self.bucketize(self.base_ns)
+        self.cache = {}
+
+    @classmethod
+    def from_base_counts(cls, first_base, base_counts, weighted=False, base_interval=BASE_INTERVAL, name='Packet Count'):
+        # Pyramid over base buckets counted elsewhere (first_base is the epoch index of the
+        # first one), without the timestamps only multiples of the base interval are available
+        pyramid = cls(np.zeros(0, dtype=np.int64), base_interval=base_interval, name=name)
+        pyramid.timestamps = None
+        pyramid.weighted = weighted
+        if len(base_counts):
+            pyramid.origin = first_base * pyramid.base_ns // DAY_NS * DAY_NS
+            pyramid.first_base = first_base - pyramid.origin // pyramid.base_ns
+            pyramid.base_counts = np.asarray(base_counts, dtype=np.float64)
+        return pyramid
+
+    def bucketize(self, width_ns):
+        # One pass over the timestamps: index of the first bucket and the counts from there on
+        if not len(self.timestamps):
+            return 0, np.zeros(0)
+        buckets = (self.timestamps - self.origin) // width_ns
+        first = buckets.min()
+        return first, np.bincount(buckets - first, weights=self.weights)
+
+    def reduce(self, factor):
+        # Sums groups of `factor` base buckets, aligned on multiples of the coarse width
+        first = self.first_base // factor
+        counts = self.base_counts
+        head = self.first_base - first * factor
+        tail = -(head + len(counts)) % factor
+        padded = np.concatenate([np.zeros(head), counts, np.zeros(tail)])
+        return first, padded.reshape(-1, factor).sum(axis=1)
+
+    def series(self, interval):
+        if interval in self.cache:
+            return self.cache[interval]
+        width_ns = interval_ns(interval)
+        if width_ns % self.base_ns == 0:
+            first, counts = self.reduce(width_ns // self.base_ns)
+        elif self.timestamps is None:
+            raise ValueError(f"{interval} is not a multiple of the base interval of the bucket counts")
+        else:
+            first, counts = self.bucketize(width_ns)
+        if not self.weighted:
+            counts = counts.astype(np.int64)
+        index = pd.date_range(start=pd.Timestamp(self.origin + first * width_ns), periods=len(counts),
+                              freq=pd.Timedelta(width_ns, unit='ns'), name='Timestamp')
+        self.cache[interval] = pd.Series(counts, index=index, name=self.name)
+        return self.cache[interval]
+
+
+class BucketAccumulator:
+    # Base bucket counts built incrementally from blocks of timestamps, so the
+    # captures never have to be in memory at once. Memory grows with the time
+    # span covered (8 bytes per base bucket), not with the number of packets.
+
+    def __init__(self, base_interval=BASE_INTERVAL):
+        self.base_interval = base_interval
+        self.base_ns = interval_ns(base_interval)
+        self.first_base = None
+        self.counts = np.zeros(0)
+        self.length = 0
+        self.weighted = False
+        self.rows = 0
+        self.min_timestamp = None
+        self.max_timestamp = None
+
+    def add(self, timestamps, weights=None):
+        if not len(timestamps):
+            return
+        buckets = timestamps // self.base_ns
+        low, high = buckets.min(), buckets.max()
+        if self.first_base is None:
+            self.first_base = low
+            self.min_timestamp, self.max_timestamp = timestamps.min(), timestamps.max()
+        else:
+            self.min_timestamp = min(self.min_timestamp, timestamps.min())
+            self.max_timestamp = max(self.max_timestamp, timestamps.max())
+        # Grow the counts to cover [low, high], with spare room at the end since
+        # blocks mostly arrive in time order
+        if low < self.first_base:
+            self.counts = np.concatenate([np.zeros(self.first_base - low), self.counts])
+            self.length += self.first_base - low
+            self.first_base = low
+        length = high - self.first_base + 1
+        if length > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(length - len(self.counts) + len(self.counts) // 2)])
+        self.length = max(self.length, length)
+        offset = low - self.first_base
+        block = np.bincount(buckets - low, weights=weights)
+        self.counts[offset:offset + len(block)] += block
+        self.weighted = self.weighted or weights is not None
+        self.rows += len(timestamps)
+
+    def pyramid(self, name='Packet Count'):
+        return BucketPyramid.from_base_counts(self.first_base, self.counts[:self.length], self.weighted, self.base_interval, name)
\ No newline at end of file
@@ -0,0 +1,100 @@
+import glob
+import time
+from os import makedirs, path
+import numpy as np
+from capture_writer import FLUSH_INTERVAL_S, SEGMENT_SUFFIX, write_segment
+
+# Column layout of a flow bucket segment (name, dtype)
+BUCKET_COLUMNS = [
+    ('bucket', np.int64),      # bucket start, epoch nanoseconds
+    ('src_mac', np.uint64),
+    ('dst_mac', np.uint64),
+    ('src_port', np.uint16),
+    ('dst_port', np.uint16),
+    ('protocol', np.uint8),
+    ('packets', np.uint32),
+    ('bytes', np.uint64),
+]
+
+BUCKET_ROWS = 1 << 14
+DEFAULT_BUCKET_MS = 100
+
+
+def bucket_segment_path(captures_dir, iface, index):
+    return path.join(captures_dir, f"{iface}_flow_buckets.{index:05d}{SEGMENT_SUFFIX}")
+
+
+def list_bucket_segments(captures_dir, iface="*"):
+    return sorted(glob.glob(path.join(captures_dir, f"{iface}_flow_buckets.*{SEGMENT_SUFFIX}")))
+
+
+class AggregateWriter:
+    # Same append interface as CaptureWriter, but keeps packet and byte
+    # counters per (bucket, flow) and only writes buckets once they closed.
+    # A bucket closes when traffic (or the clock passed to tick) is one full
+    # bucket past its end, which leaves room for slightly late packets.
+
+    def __init__(self, iface, captures_dir="captures", bucket_ns=DEFAULT_BUCKET_MS * 1000000,
+                 segment_rows=BUCKET_ROWS, flush_interval_s=FLUSH_INTERVAL_S):
+        self.iface = iface
+        self.captures_dir = captures_dir
+        self.bucket_ns = bucket_ns
+        self.segment_rows = segment_rows
+        self.flush_interval_s = flush_interval_s
+        self.last_flush = time.monotonic()
+        self.segment_index = 0
+        self.written = 0
+        self.packets = 0
+        # bucket start -> {(src_mac, dst_mac, src_port, dst_port, protocol): [packets, bytes]}
+        self.open_buckets = {}
+        self.closed_rows = []
+        self.newest_bucket = None
+        if not path.exists(captures_dir):
+            makedirs(captures_dir)
+
+    def append(self, timestamp, src_mac, dst_mac, src_port, dst_port, length, protocol, ip_id=0):
+        bucket = timestamp - timestamp % self.bucket_ns
+        flows = self.open_buckets.get(bucket)
+        if flows is None:
+            flows = self.open_buckets[bucket] = {}
+            if self.newest_bucket is None or bucket > self.newest_bucket:
+                self.newest_bucket = bucket
+                self.close_buckets(bucket - self.bucket_ns)
+        counters = flows.get((src_mac, dst_mac, src_port, dst_port, protocol))
+        if counters is None:
+            flows[(src_mac, dst_mac, src_port, dst_port, protocol)] = [1, length]
+        else:
+            counters[0] += 1
+            counters[1] += length
+        self.packets += 1
+
+    def tick(self, now_ns):
+        # Close idle buckets even when no packet arrives, and write the closed ones at least every flush_interval_s
+        self.close_buckets(now_ns - now_ns % self.bucket_ns - self.bucket_ns)
+        if self.closed_rows and time.monotonic() - self.last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def close_buckets(self, before):
+        for bucket in sorted(b for b in self.open_buckets if b < before):
+            for (src_mac, dst_mac, src_port, dst_port, protocol), (packets, nbytes) in self.open_buckets.pop(bucket).items():
+                self.closed_rows.append((bucket, src_mac, dst_mac, src_port, dst_port, protocol, packets, nbytes))
+        if len(self.closed_rows) >= self.segment_rows:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.closed_rows:
+            return None
+        rows = list(zip(*self.closed_rows))
+        columns = {name: np.array(rows[i], dtype=dtype) for i, (name, dtype) in enumerate(BUCKET_COLUMNS)}
+        filepath = bucket_segment_path(self.captures_dir, self.iface, self.segment_index)
+        write_segment(filepath, columns)
+        self.written += len(self.closed_rows)
+        self.segment_index += 1
+        self.closed_rows = []
+        return filepath
+
+    def close(self):
+        # At shutdown every bucket is written, including the last partial one
+        self.close_buckets(float('inf'))
+        return self.flush()
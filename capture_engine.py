@@ -0,0 +1,299 @@
+import argparse
+import ctypes
+import multiprocessing
+import os
+import queue
+import select
+import signal
+import socket
+import struct
+import time
+from capture_writer import CaptureWriter, PROTOCOL_CODES
+from capture_stats import InterfaceStats
+from capture_aggregation import AggregateWriter
+from packet_dedup import PacketDeduplicator
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26
+SO_TIMESTAMPNS = 35
+SOL_PACKET = 263
+PACKET_AUXDATA = 8
+PACKET_STATISTICS = 6
+RCVBUF_SIZE = 4 << 20
+
+# Ethernet (14) + IPv4 header with options (60) + L4 ports (4), rounded up
+SNAPLEN = 96
+
+# IP protocol number -> protocol code
+IP_PROTOCOLS = {6: PROTOCOL_CODES['TCP'], 17: PROTOCOL_CODES['UDP'], 1: PROTOCOL_CODES['ICMP']}
+OTHER_PROTOCOL = PROTOCOL_CODES['Other']
+
+TIMESPEC = struct.Struct("qq")
+# struct tpacket_auxdata, carries the wire length of frames truncated by the filter
+AUXDATA = struct.Struct("IIIHHHH")
+ANCILLARY_SIZE = socket.CMSG_SPACE(TIMESPEC.size) + socket.CMSG_SPACE(AUXDATA.size)
+# struct tpacket_stats, both counters are reset by the kernel on every read
+TPACKET_STATS = struct.Struct("II")
+BATCH_SIZE = 256
+STATS_INTERVAL = 1.0
+
+
+def ip_filter(snaplen=SNAPLEN):
+    # Classic BPF program: keep IPv4 frames truncated to snaplen, drop the rest
+    return [
+        (0x28, 0, 0, 12),          # ldh [12]
+        (0x15, 0, 1, ETH_P_IP),    # jeq #0x800, jt 0, jf 1
+        (0x06, 0, 0, snaplen),     # ret #snaplen
+        (0x06, 0, 0, 0),           # ret #0
+    ]
+
+
+def attach_filter(sock, program):
+    instructions = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *ins) for ins in program))
+    # struct sock_fprog, the kernel copies the program during setsockopt
+    fprog = struct.pack("HL", len(program), ctypes.addressof(instructions))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def open_socket(iface, snaplen=SNAPLEN):
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    # Filter before binding so no unfiltered frame gets queued
+    attach_filter(sock, ip_filter(snaplen))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    sock.setsockopt(SOL_PACKET, PACKET_AUXDATA, 1)
+    sock.bind((iface, ETH_P_ALL))
+    sock.setblocking(False)
+    return sock
+
+
+# Ethernet header and the IPv4 fields up to the protocol number: dst MAC (hi, lo),
+# src MAC (hi, lo), ethertype, version/IHL, identification, flags/fragment offset, protocol
+HEADERS = struct.Struct("!HIHIHB3xHHxB")
+PORTS = struct.Struct("!HH")
+
+
+def decode_frame(frame, wire_len):
+    # Fixed-offset Ethernet/IPv4/L4 decoder, returns None for non-IPv4 frames
+    if len(frame) < 34:
+        return None
+    dst_hi, dst_lo, src_hi, src_lo, ethertype, version_ihl, ip_id, fragment, ip_proto = HEADERS.unpack_from(frame)
+    if ethertype != ETH_P_IP:
+        return None
+    protocol = IP_PROTOCOLS.get(ip_proto, OTHER_PROTOCOL)
+
+    src_port, dst_port = 0, 0
+    if ip_proto == 6 or ip_proto == 17:
+        l4 = 14 + (version_ihl & 0x0f) * 4
+        # Ports are only present in the first fragment
+        if fragment & 0x1fff == 0 and len(frame) >= l4 + 4:
+            src_port, dst_port = PORTS.unpack_from(frame, l4)
+        else:
+            protocol = OTHER_PROTOCOL
+
+    return (src_hi << 32) | src_lo, (dst_hi << 32) | dst_lo, src_port, dst_port, wire_len, protocol, ip_id
+
+
+def read_kernel_stats(sock):
+    return TPACKET_STATS.unpack(sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS.size))
+
+
+def receive_batch(sock, writer, buf, stats, dedup=None):
+    # Drain up to BATCH_SIZE frames from a non-blocking socket
+    received = 0
+    view = memoryview(buf)
+    for _ in range(BATCH_SIZE):
+        try:
+            nbytes, ancdata, _, _ = sock.recvmsg_into([buf], ANCILLARY_SIZE)
+        except BlockingIOError:
+            break
+        timestamp = None
+        wire_len = nbytes
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                seconds, nanoseconds = TIMESPEC.unpack(data[:TIMESPEC.size])
+                timestamp = seconds * 1000000000 + nanoseconds
+            elif level == SOL_PACKET and kind == PACKET_AUXDATA:
+                wire_len = AUXDATA.unpack(data[:AUXDATA.size])[1]
+        if timestamp is None:
+            timestamp = time.time_ns()
+        start = time.perf_counter_ns()
+        decoded = decode_frame(view[:nbytes], wire_len)
+        if decoded is None:
+            outcome = 'undecoded'
+        elif dedup is not None and dedup.is_duplicate(writer.iface, timestamp, decoded):
+            outcome = 'duplicates'
+        else:
+            writer.append(timestamp, *decoded)
+            outcome = 'written'
+        stats.record(wire_len, outcome, time.perf_counter_ns() - start)
+        received += 1
+    return received
+
+
+def publish_stats(sockets, stats_queue, final=False):
+    snapshots = []
+    for sock, _, stats in sockets.values():
+        stats.record_kernel(*read_kernel_stats(sock))
+        snapshots.append(stats.snapshot())
+    stats_queue.put((final, snapshots))
+
+
+def capture_worker(ifaces, captures_dir, stop_event, stats_queue, snaplen=SNAPLEN, aggregate_ns=None,
+                   dedup_window_ms=None):
+    # The parent process decides when capture stops
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    sockets = {}
+    poller = select.poll()
+    for iface in ifaces:
+        sock = open_socket(iface, snaplen)
+        if aggregate_ns:
+            writer = AggregateWriter(iface, captures_dir, aggregate_ns)
+        else:
+            writer = CaptureWriter(iface, captures_dir)
+        sockets[sock.fileno()] = (sock, writer, InterfaceStats(iface))
+        poller.register(sock.fileno(), select.POLLIN)
+
+    # Duplicates are only detected among the interfaces of this worker (all of them when deduplicating)
+    dedup = PacketDeduplicator(dedup_window_ms) if dedup_window_ms else None
+
+    buf = bytearray(snaplen)
+    next_stats = time.time() + STATS_INTERVAL
+    while not stop_event.is_set():
+        for fd, _ in poller.poll(100):
+            sock, writer, stats = sockets[fd]
+            receive_batch(sock, writer, buf, stats, dedup)
+        if time.time() >= next_stats:
+            publish_stats(sockets, stats_queue)
+            next_stats += STATS_INTERVAL
+            now = time.time_ns()
+            for _, writer, _ in sockets.values():
+                writer.tick(now)
+
+    # Drain what is still queued in the kernel before closing
+    for sock, writer, stats in sockets.values():
+        while receive_batch(sock, writer, buf, stats, dedup):
+            pass
+        writer.close()
+    publish_stats(sockets, stats_queue, final=True)
+    for sock, _, _ in sockets.values():
+        sock.close()
+
+
+def shard_interfaces(ifaces, workers):
+    workers = max(1, min(workers, len(ifaces)))
+    return [ifaces[i::workers] for i in range(workers)]
+
+
+class CaptureEngine:
+
+    def __init__(self, ifaces, captures_dir="captures", workers=None, snaplen=SNAPLEN, aggregate_ns=None,
+                 dedup_window_ms=None):
+        self.ifaces = list(ifaces)
+        self.captures_dir = captures_dir
+        self.workers = workers or os.cpu_count() or 1
+        if dedup_window_ms and self.workers > 1:
+            # A packet crosses interfaces of any shard, the copies are only matched by one shared deduplicator
+            print(f"[INFO] Deduplicating at capture time: one capture process instead of {self.workers}.")
+            self.workers = 1
+        self.snaplen = snaplen
+        # Bucket width of the flow counters, None writes every packet
+        self.aggregate_ns = aggregate_ns
+        # Tolerance window of the capture-time deduplication, None disables it
+        self.dedup_window_ms = dedup_window_ms
+        self.stop_event = multiprocessing.Event()
+        self.stats_queue = multiprocessing.Queue()
+        self.processes = []
+        # Latest statistics snapshot of every interface
+        self.stats = {}
+
+    def start(self):
+        for shard in shard_interfaces(self.ifaces, self.workers):
+            process = multiprocessing.Process(target=capture_worker,
+                                              args=(shard, self.captures_dir, self.stop_event,
+                                                    self.stats_queue, self.snaplen, self.aggregate_ns,
+                                                    self.dedup_window_ms),
+                                              daemon=True)
+            process.start()
+            self.processes.append(process)
+        return self.processes
+
+    def poll_stats(self, timeout=None):
+        # Collects the snapshots published by the workers, returns the final ones received
+        finished = 0
+        while True:
+            try:
+                final, snapshots = self.stats_queue.get(timeout=timeout) if timeout else self.stats_queue.get_nowait()
+            except queue.Empty:
+                break
+            for snapshot in snapshots:
+                self.stats[snapshot['iface']] = snapshot
+            finished += final
+            if timeout and finished == len(self.processes):
+                break
+        return finished
+
+    def stop(self):
+        self.stop_event.set()
+        # Drain the queue before joining so workers can flush their last snapshot
+        finished = 0
+        while finished < len(self.processes) and any(p.is_alive() for p in self.processes):
+            finished += self.poll_stats(timeout=1.0)
+        for process in self.processes:
+            process.join()
+        self.poll_stats()
+        self.processes = []
+        return self.stats
+
+
+def read_pcap(filepath):
+    # Minimal pcap reader yielding (timestamp_ns, frame, wire_len)
+    with open(filepath, 'rb') as f:
+        header = f.read(24)
+        magic = header[:4]
+        if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+            endian = "<"
+        elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+            endian = ">"
+        else:
+            raise ValueError(f"{filepath} is not a pcap file")
+        nanoseconds = magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d")
+        record = struct.Struct(endian + "IIII")
+        while True:
+            raw = f.read(record.size)
+            if len(raw) < record.size:
+                break
+            seconds, fraction, incl_len, orig_len = record.unpack(raw)
+            frame = f.read(incl_len)
+            timestamp = seconds * 1000000000 + (fraction if nanoseconds else fraction * 1000)
+            yield timestamp, frame, orig_len
+
+
+def replay_pcap(filepath, writer=None, snaplen=SNAPLEN):
+    # Runs a pcap through the same truncation and decoder used on live sockets
+    rows = []
+    for timestamp, frame, wire_len in read_pcap(filepath):
+        decoded = decode_frame(frame[:snaplen], wire_len)
+        if decoded is None:
+            continue
+        if writer is not None:
+            writer.append(timestamp, *decoded)
+        else:
+            rows.append((timestamp,) + decoded)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay pcap files through the capture decoder")
+    parser.add_argument("pcaps", nargs="+", help="pcap files to replay")
+    parser.add_argument("--out", default="captures", help="Folder for the capture segments (default captures)")
+    args = parser.parse_args()
+
+    for pcap in args.pcaps:
+        iface = os.path.splitext(os.path.basename(pcap))[0]
+        writer = CaptureWriter(iface, args.out)
+        replay_pcap(pcap, writer)
+        writer.close()
+        print(f"{pcap}: {writer.written} packets decoded into {args.out}")
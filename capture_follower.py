@@ -0,0 +1,136 @@
+import glob
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+from capture_writer import list_segments, read_segment, SEGMENT_COLUMNS
+from capture_aggregation import BUCKET_COLUMNS, list_bucket_segments
+from bucket_pyramid import BucketAccumulator
+
+DEFAULT_STATE_DIR = "./cache"
+# Largest slice of a growing csv file parsed at once
+READ_CHUNK = 8 << 20
+
+
+class CaptureFollower:
+    # Follows the captures while they are still being written and adds only
+    # what was appended since the last poll to the bucketed counts. Segments
+    # are written atomically, so each one is read once; csv files are read
+    # from the byte offset reached last time, up to their last complete row.
+    # Offsets and counts are persisted, so a restart resumes where it stopped.
+
+    def __init__(self, folder_path, state_dir=DEFAULT_STATE_DIR):
+        self.folder_path = folder_path
+        self.state_path = os.path.join(state_dir, "follow_state.json")
+        self.counts_path = os.path.join(state_dir, "follow_counts.npy")
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.accumulator = BucketAccumulator()
+        # filepath -> [inode, byte offset], segments are done once their offset is their size
+        self.offsets = {}
+
+    def load(self):
+        if not os.path.exists(self.state_path) or not os.path.exists(self.counts_path):
+            return
+        with open(self.state_path) as f:
+            state = json.load(f)
+        if os.path.abspath(self.folder_path) != state['folder']:
+            return
+        accumulator = self.accumulator
+        accumulator.counts = np.load(self.counts_path)
+        accumulator.length = len(accumulator.counts)
+        accumulator.first_base = state['first_base']
+        accumulator.weighted = state['weighted']
+        accumulator.rows = state['rows']
+        accumulator.min_timestamp = state['min_timestamp']
+        accumulator.max_timestamp = state['max_timestamp']
+        self.offsets = state['offsets']
+
+    def save(self):
+        accumulator = self.accumulator
+        with open(self.counts_path + ".tmp", 'wb') as f:
+            np.save(f, accumulator.counts[:accumulator.length])
+        os.replace(self.counts_path + ".tmp", self.counts_path)
+        state = {
+            'folder': os.path.abspath(self.folder_path),
+            'first_base': None if accumulator.first_base is None else int(accumulator.first_base),
+            'weighted': accumulator.weighted,
+            'rows': int(accumulator.rows),
+            'min_timestamp': None if accumulator.min_timestamp is None else int(accumulator.min_timestamp),
+            'max_timestamp': None if accumulator.max_timestamp is None else int(accumulator.max_timestamp),
+            'offsets': self.offsets,
+        }
+        with open(self.state_path + ".tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def stale(self, files):
+        # Files replaced or truncated since they were read (a new capture run):
+        # the counts no longer match them and everything is read again
+        for filepath, (inode, offset) in self.offsets.items():
+            if filepath not in files:
+                return True
+            stat = files[filepath]
+            if stat.st_ino != inode or stat.st_size < offset:
+                return True
+        return False
+
+    def poll(self):
+        # Adds the rows appended since the last poll, returns how many
+        segments = list_segments(self.folder_path)
+        bucket_segments = [] if segments else list_bucket_segments(self.folder_path)
+        csv_files = [] if segments or bucket_segments else sorted(
+            glob.glob(os.path.join(self.folder_path, '*_packet_traffic.csv')))
+        files = {}
+        for filepath in segments + bucket_segments + csv_files:
+            try:
+                files[filepath] = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+        if self.stale(files):
+            print("[INFO] Followed captures were replaced, reading them again.")
+            self.reset()
+
+        rows = self.accumulator.rows
+        for filepath, stat in files.items():
+            offset = self.offsets.get(filepath, [stat.st_ino, 0])[1]
+            if offset >= stat.st_size:
+                continue
+            if filepath in csv_files:
+                offset = self.read_csv(filepath, offset, stat.st_size)
+            elif filepath in segments:
+                self.accumulator.add(read_segment(filepath, SEGMENT_COLUMNS[:1])['timestamp'])
+                offset = stat.st_size
+            else:
+                segment = read_segment(filepath, [BUCKET_COLUMNS[0], ('packets', np.uint32)])
+                self.accumulator.add(segment['bucket'], segment['packets'].astype(np.float64))
+                offset = stat.st_size
+            self.offsets[filepath] = [stat.st_ino, offset]
+        self.save()
+        return self.accumulator.rows - rows
+
+    def read_csv(self, filepath, offset, size):
+        # Parses the complete rows between offset and size, returns the new offset
+        with open(filepath, 'rb') as f:
+            f.seek(offset)
+            while offset < size:
+                data = f.read(min(READ_CHUNK, size - offset))
+                end = data.rfind(b"\n") + 1
+                if end == 0:
+                    # A row still being written, wait for the rest of it
+                    break
+                data = data[:end]
+                if offset == 0:
+                    # Header row
+                    data = data[data.find(b"\n") + 1:]
+                if data:
+                    timestamps = pd.read_csv(io.BytesIO(data), header=None, usecols=[0])[0]
+                    self.accumulator.add(pd.to_datetime(timestamps, format="%Y-%m-%d %H:%M:%S.%f").values.astype(np.int64))
+                offset += end
+                f.seek(offset)
+        return offset
@@ -0,0 +1,114 @@
+import json
+import time
+
+# Latency histogram buckets are powers of two in nanoseconds (bucket i holds < 2**i ns)
+LATENCY_BUCKETS = 24
+
+
+def latency_bucket_label(index):
+    upper = 1 << index
+    if upper >= 1000000:
+        return f"<{upper / 1e6:g}ms"
+    if upper >= 1000:
+        return f"<{upper / 1e3:g}us"
+    return f"<{upper}ns"
+
+
+def histogram_percentile(histogram, fraction):
+    total = sum(histogram)
+    if total == 0:
+        return 0
+    target = fraction * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen >= target:
+            return 1 << index
+    return 1 << (len(histogram) - 1)
+
+
+class InterfaceStats:
+    # Counters of one captured interface, updated by the capture worker
+
+    def __init__(self, iface):
+        self.iface = iface
+        self.packets = 0
+        self.bytes = 0
+        # Frames passed by the BPF filter that the decoder rejected (truncated IPv4 headers);
+        # non-IPv4 frames are dropped by the filter in the kernel and never counted
+        self.undecoded = 0
+        self.written = 0
+        self.duplicates = 0
+        self.kernel_packets = 0
+        self.kernel_drops = 0
+        self.latency = [0] * LATENCY_BUCKETS
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.last_packets = 0
+        self.last_bytes = 0
+
+    def record(self, wire_len, outcome, latency_ns):
+        # outcome is one of 'written', 'undecoded' or 'duplicates'
+        self.packets += 1
+        self.bytes += wire_len
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        self.latency[min(latency_ns.bit_length(), LATENCY_BUCKETS - 1)] += 1
+
+    def record_kernel(self, packets, drops):
+        self.kernel_packets += packets
+        self.kernel_drops += drops
+
+    def snapshot(self):
+        now = time.time()
+        interval = max(now - self.last_time, 1e-9)
+        elapsed = max(now - self.start_time, 1e-9)
+        snapshot = {
+            'iface': self.iface,
+            'time': now,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'undecoded': self.undecoded,
+            'written': self.written,
+            'duplicates': self.duplicates,
+            'kernel_packets': self.kernel_packets,
+            'kernel_drops': self.kernel_drops,
+            'packets_per_sec': (self.packets - self.last_packets) / interval,
+            'bytes_per_sec': (self.bytes - self.last_bytes) / interval,
+            'avg_packets_per_sec': self.packets / elapsed,
+            'avg_bytes_per_sec': self.bytes / elapsed,
+            'latency_p50_ns': histogram_percentile(self.latency, 0.5),
+            'latency_p99_ns': histogram_percentile(self.latency, 0.99),
+            'latency_histogram': {latency_bucket_label(i): count for i, count in enumerate(self.latency) if count},
+        }
+        self.last_time = now
+        self.last_packets = self.packets
+        self.last_bytes = self.bytes
+        return snapshot
+
+
+def summarize(snapshots):
+    # Totals across interfaces from the latest snapshot of each one
+    totals = {key: sum(s[key] for s in snapshots.values())
+              for key in ('packets', 'bytes', 'undecoded', 'written', 'duplicates', 'kernel_packets', 'kernel_drops',
+                          'packets_per_sec', 'bytes_per_sec')}
+    totals['interfaces'] = len(snapshots)
+    unique = totals['written']
+    totals['duplication_factor'] = (unique + totals['duplicates']) / unique if unique else 1.0
+    return {'totals': totals, 'interfaces': snapshots}
+
+
+def print_snapshot(elapsed, snapshots):
+    totals = summarize(snapshots)['totals']
+    print(f"[STATS] t={elapsed:.0f}s {totals['packets_per_sec']:.0f} pkt/s "
+          f"{totals['bytes_per_sec'] / 1e6:.2f} MB/s written={totals['written']} "
+          f"undecoded={totals['undecoded']} duplicates={totals['duplicates']} kernel_drops={totals['kernel_drops']}")
+
+
+def append_snapshot(filepath, elapsed, snapshots):
+    with open(filepath, 'a') as f:
+        f.write(json.dumps({'elapsed': elapsed, **summarize(snapshots)}) + "\n")
+
+
+def write_summary(filepath, snapshots):
+    with open(filepath, 'w') as f:
+        json.dump(summarize(snapshots), f, indent=2)
@@ -0,0 +1,158 @@
+import datetime
+import glob
+import time
+from os import makedirs, path, replace
+import numpy as np
+
+# Column layout of a capture segment (name, dtype)
+SEGMENT_COLUMNS = [
+    ('timestamp', np.int64),   # epoch nanoseconds
+    ('src_mac', np.uint64),
+    ('dst_mac', np.uint64),
+    ('src_port', np.uint16),   # 0 when the L4 protocol has no ports
+    ('dst_port', np.uint16),
+    ('length', np.uint32),
+    ('protocol', np.uint8),
+    ('ip_id', np.uint16),      # IPv4 identification, used to tell copies apart
+]
+
+# Protocol codes, same numbering used by prediction.py
+PROTOCOL_CODES = {'TCP': 0, 'UDP': 1, 'ICMP': 2, 'Other': 3}
+PROTOCOL_NAMES = {code: name for name, code in PROTOCOL_CODES.items()}
+
+SEGMENT_ROWS = 1 << 16
+# Buffered rows are written at least this often so prediction.py --follow sees them
+FLUSH_INTERVAL_S = 5
+SEGMENT_SUFFIX = ".npz"
+
+CSV_HEADER = "Timestamp,Elapsed time,Source MAC,Destination MAC,Source Port,Destination Port,Length,Protocol\n"
+
+
+def mac_to_int(mac):
+    return int(mac.replace(':', ''), 16)
+
+
+def int_to_mac(value):
+    raw = "%012x" % value
+    return ":".join(raw[i:i + 2] for i in range(0, 12, 2))
+
+
+def segment_path(captures_dir, iface, index):
+    return path.join(captures_dir, f"{iface}_packet_traffic.{index:05d}{SEGMENT_SUFFIX}")
+
+
+def list_segments(captures_dir, iface="*"):
+    return sorted(glob.glob(path.join(captures_dir, f"{iface}_packet_traffic.*{SEGMENT_SUFFIX}")))
+
+
+def write_segment(filepath, columns):
+    # Write to a temporary name first so readers never see partial segments
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **columns)
+    replace(tmp_path, filepath)
+
+
+class CaptureWriter:
+    # Buffers packets of one interface in typed columns and flushes them
+    # as numbered .npz segments once SEGMENT_ROWS packets are collected, or
+    # on the first tick after flush_interval_s.
+
+    def __init__(self, iface, captures_dir="captures", segment_rows=SEGMENT_ROWS, flush_interval_s=FLUSH_INTERVAL_S):
+        self.iface = iface
+        self.captures_dir = captures_dir
+        self.segment_rows = segment_rows
+        self.flush_interval_s = flush_interval_s
+        self.last_flush = time.monotonic()
+        self.segment_index = 0
+        self.rows = 0
+        self.written = 0
+        self.columns = {name: np.empty(segment_rows, dtype=dtype) for name, dtype in SEGMENT_COLUMNS}
+        # Bound arrays for the hot append path
+        self._timestamp = self.columns['timestamp']
+        self._src_mac = self.columns['src_mac']
+        self._dst_mac = self.columns['dst_mac']
+        self._src_port = self.columns['src_port']
+        self._dst_port = self.columns['dst_port']
+        self._length = self.columns['length']
+        self._protocol = self.columns['protocol']
+        self._ip_id = self.columns['ip_id']
+        if not path.exists(captures_dir):
+            makedirs(captures_dir)
+
+    def append(self, timestamp, src_mac, dst_mac, src_port, dst_port, length, protocol, ip_id=0):
+        i = self.rows
+        self._timestamp[i] = timestamp
+        self._src_mac[i] = src_mac
+        self._dst_mac[i] = dst_mac
+        self._src_port[i] = src_port
+        self._dst_port[i] = dst_port
+        self._length[i] = length
+        self._protocol[i] = protocol
+        self._ip_id[i] = ip_id
+        self.rows = i + 1
+        if self.rows == self.segment_rows:
+            self.flush()
+
+    def tick(self, now_ns=None):
+        # Called periodically by the capture loop, off the per-packet path
+        if self.rows and time.monotonic() - self.last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if self.rows == 0:
+            return None
+        filepath = segment_path(self.captures_dir, self.iface, self.segment_index)
+        write_segment(filepath, {name: column[:self.rows] for name, column in self.columns.items()})
+        self.written += self.rows
+        self.segment_index += 1
+        self.rows = 0
+        return filepath
+
+    def close(self):
+        return self.flush()
+
+
+def read_segment(filepath, columns=SEGMENT_COLUMNS):
+    with np.load(filepath) as segment:
+        rows = len(segment[columns[0][0]])
+        # Columns added after a segment was written are read as zeros
+        return {name: segment[name] if name in segment.files else np.zeros(rows, dtype=dtype)
+                for name, dtype in columns}
+
+
+def export_csv(captures_dir="captures", iface="*"):
+    # Optional export of the segments to the legacy per-interface CSV layout
+    exported = []
+    segments_by_iface = {}
+    for filepath in list_segments(captures_dir, iface):
+        name = path.basename(filepath).split("_packet_traffic.")[0]
+        segments_by_iface.setdefault(name, []).append(filepath)
+
+    start_ns = None
+    for filepaths in segments_by_iface.values():
+        first = read_segment(filepaths[0])['timestamp']
+        if len(first):
+            start_ns = first[0] if start_ns is None else min(start_ns, first[0])
+
+    for name, filepaths in segments_by_iface.items():
+        csv_filepath = path.join(captures_dir, f"{name}_packet_traffic.csv")
+        with open(csv_filepath, mode='w', newline='') as csv_file:
+            csv_file.write(CSV_HEADER)
+            for filepath in filepaths:
+                seg = read_segment(filepath)
+                for ts, src, dst, sport, dport, length, proto in zip(
+                        seg['timestamp'].tolist(), seg['src_mac'].tolist(), seg['dst_mac'].tolist(),
+                        seg['src_port'].tolist(), seg['dst_port'].tolist(), seg['length'].tolist(),
+                        seg['protocol'].tolist()):
+                    timestamp = datetime.datetime.fromtimestamp(ts / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+                    elapsed_time = (ts - start_ns) / 1e9
+                    protocol = PROTOCOL_NAMES[proto]
+                    if protocol in ('TCP', 'UDP'):
+                        ports = f"{sport},{dport}"
+                    else:
+                        ports = "-,-"
+                    csv_file.write(f"{timestamp},{elapsed_time},{int_to_mac(src)},{int_to_mac(dst)},{ports},{length},{protocol}\n")
+        exported.append(csv_filepath)
+    return exported
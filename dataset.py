@@ -0,0 +1,254 @@
+import glob
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from capture_writer import SEGMENT_COLUMNS, PROTOCOL_CODES, list_segments, read_segment
+from capture_aggregation import BUCKET_COLUMNS, list_bucket_segments
+from packet_dedup import DEFAULT_WINDOW_MS, duplicate_mask
+
+# Column names used by prediction.py
+COLUMN_NAMES = {
+    'timestamp': 'Timestamp',
+    'src_mac': 'Source MAC',
+    'dst_mac': 'Destination MAC',
+    'src_port': 'Source Port',
+    'dst_port': 'Destination Port',
+    'length': 'Length',
+    'protocol': 'Protocol',
+    'ip_id': 'IP ID',
+    'bucket': 'Timestamp',
+    'packets': 'Packets',
+    'bytes': 'Length',
+}
+
+
+def segment_interface(filepath):
+    return os.path.basename(filepath).split("_packet_traffic.")[0]
+
+
+def read_interface_segments(filepaths):
+    # Typed columns of one interface, segments are written in time order
+    segments = [read_segment(filepath) for filepath in filepaths]
+    return {name: np.concatenate([segment[name] for segment in segments]) for name, _ in SEGMENT_COLUMNS}
+
+
+# Hex digit value of every ASCII code, used to parse MAC strings in bulk
+HEX_VALUES = np.zeros(256, dtype=np.uint64)
+HEX_VALUES[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10, dtype=np.uint64)
+HEX_VALUES[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16, dtype=np.uint64)
+HEX_VALUES[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16, dtype=np.uint64)
+MAC_DIGITS = [0, 1, 3, 4, 6, 7, 9, 10, 12, 13, 15, 16]
+
+
+def parse_macs(values):
+    # 'aa:bb:cc:dd:ee:ff' strings to uint64 without a per-row Python call
+    chars = np.asarray(values, dtype='S17').view(np.uint8).reshape(-1, 17)[:, MAC_DIGITS]
+    digits = HEX_VALUES[chars]
+    result = np.zeros(len(digits), dtype=np.uint64)
+    for i in range(12):
+        result = (result << np.uint64(4)) | digits[:, i]
+    return result
+
+
+def read_interface_csv(filepath):
+    # Legacy csv capture of one interface read with explicit compact dtypes
+    df = pd.read_csv(filepath, dtype={'Elapsed time': np.float64, 'Source MAC': str, 'Destination MAC': str,
+                                      'Source Port': str, 'Destination Port': str, 'Length': np.uint32,
+                                      'Protocol': str})
+    timestamps = pd.to_datetime(df['Timestamp'], format="%Y-%m-%d %H:%M:%S.%f").values.astype(np.int64)
+    protocol = df['Protocol'].map(PROTOCOL_CODES).fillna(PROTOCOL_CODES['Other']).values.astype(np.uint8)
+    return {
+        'timestamp': timestamps,
+        'src_mac': parse_macs(df['Source MAC'].values),
+        'dst_mac': parse_macs(df['Destination MAC'].values),
+        'src_port': pd.to_numeric(df['Source Port'], errors='coerce').fillna(0).values.astype(np.uint16),
+        'dst_port': pd.to_numeric(df['Destination Port'], errors='coerce').fillna(0).values.astype(np.uint16),
+        'length': df['Length'].values,
+        'protocol': protocol,
+        'ip_id': np.zeros(len(df), dtype=np.uint16),
+    }
+
+
+def read_interface(source):
+    # Worker entry point: a csv path or the list of segment paths of one interface
+    if isinstance(source, str):
+        columns = read_interface_csv(source)
+    else:
+        columns = read_interface_segments(source)
+    # Interfaces are captured in time order, only reorder if that does not hold
+    timestamps = columns['timestamp']
+    if len(timestamps) > 1 and (np.diff(timestamps) < 0).any():
+        order = np.argsort(timestamps, kind='stable')
+        columns = {name: column[order] for name, column in columns.items()}
+    return columns
+
+
+def kway_merge(runs):
+    # Merges time-ordered runs of (timestamps, row indices) pairwise in a tree,
+    # each level is linear in the number of rows, so no global sort is needed
+    while len(runs) > 1:
+        merged = []
+        for i in range(0, len(runs) - 1, 2):
+            (ts_a, idx_a), (ts_b, idx_b) = runs[i], runs[i + 1]
+            # Positions of b in the output, ties keep a first
+            pos_b = np.searchsorted(ts_a, ts_b, side='right') + np.arange(len(ts_b))
+            from_b = np.zeros(len(ts_a) + len(ts_b), dtype=bool)
+            from_b[pos_b] = True
+            timestamps = np.empty(len(from_b), dtype=ts_a.dtype)
+            indices = np.empty(len(from_b), dtype=idx_a.dtype)
+            timestamps[pos_b], timestamps[~from_b] = ts_b, ts_a
+            indices[pos_b], indices[~from_b] = idx_b, idx_a
+            merged.append((timestamps, indices))
+        if len(runs) % 2:
+            merged.append(runs[-1])
+        runs = merged
+    return runs[0][1]
+
+
+def load_interfaces(sources, workers=None):
+    # Reads the interfaces in parallel processes and merges them by timestamp
+    ifaces = sorted(sources)
+    if workers == 1 or len(ifaces) == 1:
+        results = [read_interface(sources[iface]) for iface in ifaces]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(read_interface, [sources[iface] for iface in ifaces]))
+
+    runs = []
+    offset = 0
+    for columns in results:
+        rows = len(columns['timestamp'])
+        runs.append((columns['timestamp'], np.arange(offset, offset + rows, dtype=np.int64)))
+        offset += rows
+    order = kway_merge(runs)
+
+    df = pd.DataFrame({COLUMN_NAMES[name]: np.concatenate([columns[name] for columns in results])[order]
+                       for name, _ in SEGMENT_COLUMNS})
+    # Interface of every packet, stored as a categorical column
+    codes = np.concatenate([np.full(len(columns['timestamp']), i, dtype=np.int16) for i, columns in enumerate(results)])
+    df['Interface'] = pd.Categorical.from_codes(codes[order], categories=ifaces)
+    timestamps = df['Timestamp'].values
+    df['Timestamp'] = pd.to_datetime(timestamps, unit='ns')
+    df['Elapsed time'] = (timestamps - timestamps[0]) / 1e9 if len(timestamps) else 0.0
+    return df
+
+
+def load_segments(folder_path, workers=None):
+    sources = {}
+    for filepath in list_segments(folder_path):
+        sources.setdefault(segment_interface(filepath), []).append(filepath)
+    if not sources:
+        return None
+    return load_interfaces(sources, workers)
+
+
+def load_flow_buckets(folder_path):
+    # Pre-aggregated captures: one row per (interface, bucket, flow) with
+    # packet and byte counters, 'Length' holds the bytes of the flow bucket
+    frames = []
+    for filepath in list_bucket_segments(folder_path):
+        segment = read_segment(filepath, BUCKET_COLUMNS)
+        frame = pd.DataFrame({COLUMN_NAMES[name]: column for name, column in segment.items()})
+        frame['Interface'] = os.path.basename(filepath).split("_flow_buckets.")[0]
+        frames.append(frame)
+    if not frames:
+        return None
+    df = pd.concat(frames, ignore_index=True)
+
+    # Late packets can produce a second row for an already written bucket
+    keys = ['Interface', 'Timestamp', 'Source MAC', 'Destination MAC', 'Source Port', 'Destination Port', 'Protocol']
+    df = df.groupby(keys, as_index=False, sort=False)[['Packets', 'Length']].sum()
+    df = df.sort_values(by='Timestamp', kind='stable', ignore_index=True)
+
+    timestamps = df['Timestamp'].values
+    df['Timestamp'] = pd.to_datetime(timestamps, unit='ns')
+    df['Elapsed time'] = (timestamps - timestamps.min()) / 1e9
+    return df
+
+
+def load_csv_captures(folder_path, workers=None):
+    sources = {segment_interface(filepath): filepath
+               for filepath in glob.glob(os.path.join(folder_path, '*_packet_traffic.csv'))}
+    if not sources:
+        return None
+    return load_interfaces(sources, workers)
+
+
+def list_capture_files(folder_path):
+    # Every file load_captures may read
+    return (list_segments(folder_path) + list_bucket_segments(folder_path)
+            + glob.glob(os.path.join(folder_path, '*_packet_traffic.csv')))
+
+
+def load_captures(folder_path, workers=None):
+    # Packet segments are preferred, then flow buckets, csv captures are the legacy fallback.
+    # Packets come back sorted by timestamp.
+    df = load_segments(folder_path, workers)
+    if df is not None:
+        print(f"[INFO] Loaded {len(df)} packets from capture segments.")
+        return df
+    df = load_flow_buckets(folder_path)
+    if df is not None:
+        print(f"[INFO] Loaded {len(df)} flow buckets ({df['Packets'].sum()} packets) from aggregated captures.")
+        return df
+    df = load_csv_captures(folder_path, workers)
+    if df is None:
+        raise FileNotFoundError(f"No captures found in {folder_path}")
+    print(f"[INFO] Loaded {len(df)} packets from csv captures.")
+    return df
+
+
+# Approximate memory held per row while a block of captures is read and bucketed
+SEGMENT_ROW_BYTES = 64
+CSV_ROW_BYTES = 512
+
+
+def iter_capture_blocks(folder_path, memory_bytes):
+    # Timestamps (and packet counters of flow buckets) of the captures in
+    # blocks of bounded size, in the same preference order as load_captures.
+    # Blocks of different interfaces are not merged, only bucketed counts are
+    # meant to be built from them.
+    segments = list_segments(folder_path)
+    if segments:
+        rows = max(1, memory_bytes // SEGMENT_ROW_BYTES)
+        for filepath in segments:
+            timestamps = read_segment(filepath, SEGMENT_COLUMNS[:1])['timestamp']
+            for start in range(0, len(timestamps), rows):
+                yield timestamps[start:start + rows], None
+        return
+    bucket_segments = list_bucket_segments(folder_path)
+    if bucket_segments:
+        rows = max(1, memory_bytes // SEGMENT_ROW_BYTES)
+        for filepath in bucket_segments:
+            segment = read_segment(filepath, [BUCKET_COLUMNS[0], ('packets', np.uint32)])
+            for start in range(0, len(segment['bucket']), rows):
+                yield segment['bucket'][start:start + rows], segment['packets'][start:start + rows].astype(np.float64)
+        return
+    csv_files = sorted(glob.glob(os.path.join(folder_path, '*_packet_traffic.csv')))
+    if not csv_files:
+        raise FileNotFoundError(f"No captures found in {folder_path}")
+    rows = max(1, memory_bytes // CSV_ROW_BYTES)
+    for filepath in csv_files:
+        for chunk in pd.read_csv(filepath, usecols=['Timestamp'], chunksize=rows):
+            yield pd.to_datetime(chunk['Timestamp'], format="%Y-%m-%d %H:%M:%S.%f").values.astype(np.int64), None
+
+
+def deduplicate(df, window_ms=DEFAULT_WINDOW_MS):
+    # Drops the copies of packets sniffed on more than one interface, df must be sorted by timestamp
+    fingerprint = [df[column].values for column in
+                   ['Source MAC', 'Destination MAC', 'Source Port', 'Destination Port', 'Protocol', 'Length']]
+    if 'IP ID' in df.columns:
+        fingerprint.append(df['IP ID'].values)
+    mask, dedup = duplicate_mask(df['Interface'].values, df['Timestamp'].values.astype(np.int64), fingerprint, window_ms)
+    print(f"[INFO] Removed {dedup.duplicates} duplicated packets, duplication factor {dedup.duplication_factor():.2f}.")
+    return df[~mask]
+
+
+def write_united(df, output_file_path):
+    # Writes the merged dataset from a forked process, off the critical path;
+    # the child works on a copy-on-write snapshot of df
+    process = multiprocessing.Process(target=df.to_csv, args=(output_file_path,), kwargs={'index': False})
+    process.start()
+    return process
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = "./cache"
+DEFAULT_CACHE_MB = 1024
+HASH_CHUNK = 1 << 20
+
+
+class FeatureCache:
+    # Preprocessed DataFrames stored as one .npy file per column, keyed by the
+    # content hash of the input captures and the preprocessing version. Entries
+    # are memory-mapped on load and evicted least recently used first once the
+    # cache grows past max_bytes.
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_mb=DEFAULT_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hashes_path = os.path.join(cache_dir, "file_hashes.json")
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def file_digest(self, filepath, known):
+        # Content hash, reused while size and mtime are unchanged
+        stat = os.stat(filepath)
+        entry = known.get(filepath)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                digest.update(chunk)
+        known[filepath] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return known[filepath][2]
+
+    def key(self, filepaths, *params):
+        known = {}
+        if os.path.exists(self.hashes_path):
+            with open(self.hashes_path) as f:
+                known = json.load(f)
+        digest = hashlib.blake2b(digest_size=16)
+        for filepath in sorted(filepaths):
+            digest.update(os.path.basename(filepath).encode())
+            digest.update(self.file_digest(filepath, known).encode())
+        digest.update(json.dumps(params).encode())
+        with open(self.hashes_path, 'w') as f:
+            json.dump({path: entry for path, entry in known.items() if path in filepaths}, f)
+        return digest.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        entry_dir = self.entry_dir(key)
+        meta_path = os.path.join(entry_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        columns = {}
+        for i, column in enumerate(meta['columns']):
+            values = np.load(os.path.join(entry_dir, f"{i}.npy"), mmap_mode='r')
+            if column['kind'] == 'datetime':
+                values = values.view('datetime64[ns]')
+            elif column['kind'] == 'category':
+                values = pd.Categorical.from_codes(values, categories=column['categories'])
+            columns[column['name']] = values
+        # Touch the entry for the LRU order
+        os.utime(meta_path)
+        return pd.DataFrame(columns, copy=False)
+
+    def store(self, key, df):
+        entry_dir = self.entry_dir(key)
+        tmp_dir = entry_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        meta = {'rows': len(df), 'columns': []}
+        for i, name in enumerate(df.columns):
+            series = df[name]
+            column = {'name': name, 'kind': 'plain'}
+            # Object columns (strings) cannot be memory-mapped, they are stored as categories
+            if series.dtype == object:
+                series = series.astype('category')
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                column.update(kind='category', categories=[str(c) for c in series.cat.categories])
+                values = series.cat.codes.values
+            elif pd.api.types.is_datetime64_dtype(series.dtype):
+                column['kind'] = 'datetime'
+                values = series.values.view(np.int64)
+            else:
+                values = series.values
+            np.save(os.path.join(tmp_dir, f"{i}.npy"), np.ascontiguousarray(values))
+            meta['columns'].append(column)
+        with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        self.evict(keep=key)
+
+    def entries(self):
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, key, "meta.json")
+            if not os.path.exists(meta_path):
+                continue
+            entry_dir = self.entry_dir(key)
+            size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(meta_path), key, size))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            total -= size
+            print(f"Feature cache: evicted {key} ({size / 1e6:.1f} MB).")
+
+
+def cached_frame(cache, filepaths, params, build):
+    # Returns the cached DataFrame for these inputs, building and storing it on a miss
+    start = time.perf_counter()
+    key = cache.key(filepaths, *params)
+    df = cache.load(key)
+    if df is not None:
+        print(f"[INFO] Feature cache hit ({key[:12]}), loaded {len(df)} rows in {time.perf_counter() - start:.2f} s.")
+        return df
+    df = build()
+    cache.store(key, df)
+    print(f"[INFO] Feature cache miss ({key[:12]}), rebuilt {len(df)} rows in {time.perf_counter() - start:.2f} s.")
+    return df
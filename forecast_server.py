@@ -0,0 +1,204 @@
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from bucket_pyramid import interval_ns
+from model_store import load_models, DEFAULT_MODELS_DIR
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8050
+# Latencies of the latest requests kept for the percentiles
+LATENCY_WINDOW = 10000
+STATS_INTERVAL_S = 10
+MAX_STEPS = 1000
+# Latest epoch ns a next_time can take (datetime64[ns] range)
+MAX_TIME_NS = 2 ** 62
+
+
+def query_array(query, field, ndim=1, min_length=1):
+    # Finite float array of a query field, ValueError (HTTP 400) otherwise
+    try:
+        values = np.asarray(query[field], dtype=np.float64)
+    except KeyError:
+        raise ValueError(f"missing {field!r}")
+    except (TypeError, ValueError):
+        raise ValueError(f"{field!r} must only hold numbers")
+    if values.ndim != ndim or len(values) < min_length:
+        raise ValueError(f"{field!r} must be a {'list' if ndim == 1 else 'list of rows'} of at least {min_length} values")
+    if not np.all(np.isfinite(values)):
+        raise ValueError(f"{field!r} holds non-finite values")
+    return values
+
+
+def query_int(query, field, default=None, minimum=0, maximum=MAX_TIME_NS):
+    value = query.get(field, default)
+    if value is None:
+        raise ValueError(f"missing {field!r}")
+    if not isinstance(value, int) or isinstance(value, bool) or not minimum <= value <= maximum:
+        raise ValueError(f"{field!r} must be an integer from {minimum} to {maximum}")
+    return value
+
+
+class ForecastService:
+    # Models loaded once and shared by every request. A request is a batch of
+    # queries: {"model": name, "history": [counts...], "steps": n} for the
+    # bucketed models, the lag models also needing "next_time" (epoch ns of
+    # the first forecast bucket, on the clock of the captures: their calendar
+    # features are absolute) and "exog" when trained with the traffic features
+    # (those of the last bucket), or {"model": name, "rows": [[features...]]}
+    # for the per-packet model.
+
+    def __init__(self, models_dir=DEFAULT_MODELS_DIR):
+        self.models = load_models(models_dir)
+        if any(meta['kind'] == 'arima' for model, meta in self.models.values()):
+            # Imported before the first request, it takes a few hundred ms
+            import statsmodels.tsa.arima.model
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    def forecast(self, queries):
+        if not isinstance(queries, list) or not queries or not all(isinstance(query, dict) for query in queries):
+            raise ValueError("'queries' must be a non-empty list of objects")
+        results = [None] * len(queries)
+        # Queries of the same lag model and horizon are predicted as one batch
+        batches = {}
+        for i, query in enumerate(queries):
+            name = query.get('model')
+            if name not in self.models:
+                raise ValueError(f"unknown model {name!r}")
+            model, meta = self.models[name]
+            if meta['kind'] == 'packets':
+                rows = query_array(query, 'rows', ndim=2)
+                if rows.shape[1] != len(meta['features']):
+                    raise ValueError(f"'rows' must have {len(meta['features'])} columns: {', '.join(meta['features'])}")
+                results[i] = model.predict(pd.DataFrame(rows, columns=meta['features']))
+                continue
+            steps = query_int(query, 'steps', 1, 1, MAX_STEPS)
+            if meta['kind'] == 'arima':
+                results[i] = model.forecast(query_array(query, 'history', min_length=1 + model.order[1]), steps)
+                continue
+            query_array(query, 'history', min_length=max(model.lags))
+            query_int(query, 'next_time')
+            if model.exog_columns:
+                query_array(query, 'exog', min_length=len(model.exog_columns))
+            batches.setdefault((name, steps), []).append(i)
+        for (name, steps), indices in batches.items():
+            model, meta = self.models[name]
+            exog = [queries[i]['exog'] for i in indices] if model.exog_columns else None
+            forecasts = model.forecast([queries[i]['history'] for i in indices], [queries[i]['next_time'] for i in indices],
+                                       steps, interval_ns(meta['interval']), exog)
+            for i, forecast in zip(indices, forecasts):
+                results[i] = forecast
+        for query, forecast in zip(queries, results):
+            if not np.all(np.isfinite(forecast)):
+                raise ArithmeticError(f"model {query['model']!r} returned a non-finite forecast")
+        return [forecast.tolist() for forecast in results]
+
+    def record(self, latency_ns, queries):
+        with self.lock:
+            self.latencies.append(latency_ns)
+            self.requests += 1
+            self.queries += queries
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies, dtype=np.float64)
+            requests, queries = self.requests, self.queries
+        return {
+            'requests': requests,
+            'queries': queries,
+            'latency_p50_us': float(np.percentile(latencies, 50)) / 1e3 if len(latencies) else 0.0,
+            'latency_p99_us': float(np.percentile(latencies, 99)) / 1e3 if len(latencies) else 0.0,
+            'models': sorted(self.models),
+        }
+
+
+class ForecastHandler(BaseHTTPRequestHandler):
+    # POST /forecast {"queries": [...]}, GET /models, GET /stats
+
+    def reply(self, status, body):
+        data = json.dumps(body, allow_nan=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/models":
+            self.reply(200, {name: meta for name, (model, meta) in service.models.items()})
+        elif self.path == "/stats":
+            self.reply(200, service.stats())
+        else:
+            self.reply(404, {'error': f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/forecast":
+            self.reply(404, {'error': f"unknown path {self.path}"})
+            return
+        start = time.perf_counter_ns()
+        try:
+            queries = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))['queries']
+            forecasts = self.server.service.forecast(queries)
+        except (ValueError, KeyError, TypeError) as e:
+            self.reply(400, {'error': str(e)})
+            return
+        except Exception as e:
+            print(f"[WARNING] Forecast failed: {e!r}")
+            self.reply(500, {'error': f"forecast failed: {e}"})
+            return
+        latency_ns = time.perf_counter_ns() - start
+        self.server.service.record(latency_ns, len(queries))
+        self.reply(200, {'forecasts': forecasts, 'latency_us': latency_ns / 1e3})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def request_forecasts(queries, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=5):
+    # Client side, only needs the standard library (e.g. from the Ryu controller)
+    request = urllib.request.Request(f"http://{host}:{port}/forecast", data=json.dumps({'queries': queries}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())['forecasts']
+
+
+def print_stats(service, stop_event):
+    reported = 0
+    while not stop_event.wait(STATS_INTERVAL_S):
+        stats = service.stats()
+        if stats['requests'] != reported:
+            reported = stats['requests']
+            print(f"[STATS] {stats['requests']} requests ({stats['queries']} queries), "
+                  f"p50 {stats['latency_p50_us']:.0f} us, p99 {stats['latency_p99_us']:.0f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local forecast server answering from the models saved by prediction.py")
+    parser.add_argument("--models", default=DEFAULT_MODELS_DIR, help=f"Folder of the saved models (default {DEFAULT_MODELS_DIR})")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default {DEFAULT_PORT})")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), ForecastHandler)
+    server.service = ForecastService(args.models)
+    print(f"[INFO] Serving {len(server.service.models)} models on http://{args.host}:{args.port}.")
+    stop_event = threading.Event()
+    threading.Thread(target=print_stats, args=(server.service, stop_event), daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    stop_event.set()
+    server.server_close()
+    stats = server.service.stats()
+    print(f"[INFO] Served {stats['requests']} requests, p50 {stats['latency_p50_us']:.0f} us, "
+          f"p99 {stats['latency_p99_us']:.0f} us.")
@@ -0,0 +1,92 @@
+import json
+import os
+import time
+from collections import deque
+from capture_stats import LATENCY_BUCKETS, histogram_percentile
+
+# Proactive rules expire when idle, a packet_in reinstalls them from the precomputed table
+PROACTIVE_IDLE_TIMEOUT = 300
+STATS_INTERVAL_S = 10
+
+
+def write_topology(filepath, hosts, links):
+    # hosts: {mac: (dpid, port)}, links: [(dpid, port, dpid, port)] between switches
+    with open(filepath + ".tmp", 'w') as f:
+        json.dump({'hosts': {mac: list(attachment) for mac, attachment in hosts.items()},
+                   'links': [list(link) for link in links]}, f, indent=2)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def load_topology(filepath):
+    with open(filepath) as f:
+        topology = json.load(f)
+    return {mac: tuple(attachment) for mac, attachment in topology['hosts'].items()}, \
+        [tuple(link) for link in topology['links']]
+
+
+def forwarding_table(hosts, links):
+    # dpid -> {destination mac: output port}, along the shortest path (BFS tree
+    # rooted at the switch of each host, so the paths to a host never loop)
+    neighbors = {}
+    for dpid1, port1, dpid2, port2 in links:
+        # (neighbor, port of the neighbor on the link)
+        neighbors.setdefault(dpid1, []).append((dpid2, port2))
+        neighbors.setdefault(dpid2, []).append((dpid1, port1))
+    table = {}
+    for mac, (host_dpid, host_port) in hosts.items():
+        table.setdefault(host_dpid, {})[mac] = host_port
+        visited = {host_dpid}
+        queue = deque([host_dpid])
+        while queue:
+            dpid = queue.popleft()
+            for neighbor, neighbor_port in sorted(neighbors.get(dpid, [])):
+                if neighbor in visited:
+                    continue
+                # The neighbor reaches the host back through its port on this link
+                visited.add(neighbor)
+                table.setdefault(neighbor, {})[mac] = neighbor_port
+                queue.append(neighbor)
+    return table
+
+
+class ControllerStats:
+    # packet_in rate, handler latency (log2 histogram in ns) and flow entries
+    # installed per switch, to compare the reactive and proactive modes
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.packet_ins = 0
+        self.reported_packet_ins = 0
+        self.reported_at = self.started
+        self.latency = [0] * LATENCY_BUCKETS
+        self.flow_mods = 0
+        # dpid -> set of (priority, match) installed and not yet removed
+        self.flows = {}
+
+    def record_packet_in(self, latency_ns):
+        self.packet_ins += 1
+        self.latency[min(latency_ns.bit_length(), LATENCY_BUCKETS - 1)] += 1
+
+    def flow_added(self, dpid, priority, match):
+        self.flow_mods += 1
+        self.flows.setdefault(dpid, set()).add((priority, str(match)))
+
+    def flow_removed(self, dpid, priority, match):
+        self.flows.get(dpid, set()).discard((priority, str(match)))
+
+    def switch_removed(self, dpid):
+        self.flows.pop(dpid, None)
+
+    def snapshot(self):
+        now = time.monotonic()
+        rate = (self.packet_ins - self.reported_packet_ins) / max(now - self.reported_at, 1e-9)
+        self.reported_packet_ins, self.reported_at = self.packet_ins, now
+        return {
+            'elapsed_s': now - self.started,
+            'packet_ins': self.packet_ins,
+            'packet_in_rate': rate,
+            'handler_p50_us': histogram_percentile(self.latency, 0.5) / 1e3,
+            'handler_p99_us': histogram_percentile(self.latency, 0.99) / 1e3,
+            'flow_mods': self.flow_mods,
+            'flow_entries': {str(dpid): len(flows) for dpid, flows in sorted(self.flows.items())},
+        }
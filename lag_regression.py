@@ -0,0 +1,164 @@
+import time
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import SGDRegressor
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+DEFAULT_LAGS = tuple(range(1, 11))
+DEFAULT_WINDOWS = (3, 10, 30)
+REGRESSOR_NAMES = {'hgb': 'Gradient Boosting', 'rf': 'Random Forest', 'sgd': 'SGD Regression'}
+# Bytes held per bucket of a training block (features, scaled copy and target)
+FEATURE_ROW_BYTES = 512
+
+
+def lag_features(series, lags=DEFAULT_LAGS, windows=DEFAULT_WINDOWS, exog=None):
+    # One row per bucket: the previous counts, rolling means of the previous
+    # buckets and the position of the bucket in the second, minute and hour,
+    # plus the exogenous traffic features of the previous bucket if given.
+    # Only values known before the bucket starts are used.
+    previous = series.shift(1)
+    features = {f'lag_{lag}': series.shift(lag) for lag in lags}
+    for window in windows:
+        features[f'mean_{window}'] = previous.rolling(window, min_periods=1).mean()
+    frame = pd.DataFrame(features, index=series.index)
+    frame[['subsecond', 'second', 'minute', 'hour']] = calendar_features(series.index)
+    if exog is not None:
+        previous_exog = exog.reindex(series.index).shift(1)
+        frame[[f'prev_{column}' for column in exog.columns]] = previous_exog.values
+    return frame
+
+
+def calendar_features(times):
+    times = pd.DatetimeIndex(times)
+    return np.column_stack([times.microsecond // 100000, times.second, times.minute, times.hour])
+
+
+class LagModel:
+    # A trained lag regressor with what it needs to forecast from raw counts:
+    # the lags and windows of its features and, for SGD, the scalers
+
+    def __init__(self, regressor, lags=DEFAULT_LAGS, windows=DEFAULT_WINDOWS, scaler=None, target_scaler=None,
+                 exog_columns=()):
+        self.regressor = regressor
+        self.lags = tuple(lags)
+        self.windows = tuple(windows)
+        self.scaler = scaler
+        self.target_scaler = target_scaler
+        self.exog_columns = list(exog_columns)
+
+    @property
+    def features(self):
+        return ([f'lag_{lag}' for lag in self.lags] + [f'mean_{window}' for window in self.windows]
+                + ['subsecond', 'second', 'minute', 'hour'] + [f'prev_{column}' for column in self.exog_columns])
+
+    def predict(self, features):
+        if self.scaler is None:
+            return np.clip(self.regressor.predict(features), 0, None)
+        predicted = self.regressor.predict(self.scaler.transform(features))
+        return np.clip(self.target_scaler.inverse_transform(predicted.reshape(-1, 1)).ravel(), 0, None)
+
+    def forecast(self, histories, next_times, steps, width_ns, exog=None):
+        # Recursive forecast of `steps` buckets for a batch of series: histories
+        # are the latest counts of each series, at least max(lags) of them, and
+        # next_times the start of the first forecast bucket of each series.
+        # Histories are right-aligned in a NaN-padded array of the feature context.
+        # Models with exogenous features also need the (series x exog_columns)
+        # traffic features of the last bucket, held for every step.
+        if self.exog_columns:
+            if exog is None:
+                raise ValueError(f"the traffic features {', '.join(self.exog_columns)} of the last bucket are needed")
+            exog = np.array(exog, dtype=np.float64).reshape(len(histories), len(self.exog_columns))
+        context = max(max(self.lags), max(self.windows))
+        padded = np.full((len(histories), context), np.nan)
+        for i, history in enumerate(histories):
+            history = np.asarray(history, dtype=np.float64)[-context:]
+            if len(history) < max(self.lags):
+                raise ValueError(f"a history of at least {max(self.lags)} buckets is needed")
+            padded[i, context - len(history):] = history
+        histories = padded
+        times = np.asarray(next_times).astype('datetime64[ns]')
+        forecasts = np.empty((len(histories), steps))
+        for step in range(steps):
+            columns = [histories[:, -lag] for lag in self.lags]
+            columns += [np.nanmean(histories[:, -window:], axis=1) for window in self.windows]
+            features = np.column_stack(columns + [calendar_features(times)] + ([exog] if self.exog_columns else []))
+            forecasts[:, step] = self.predict(pd.DataFrame(features, columns=self.features))
+            histories = np.column_stack([histories[:, 1:], forecasts[:, step]])
+            times = times + np.timedelta64(width_ns, 'ns')
+        return forecasts
+
+
+def make_regressor(kind='hgb', workers=None):
+    # Both ensembles use every core: HistGradientBoosting through OpenMP, the
+    # forest through joblib
+    if kind == 'rf':
+        return RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=workers or -1)
+    return HistGradientBoostingRegressor(max_iter=200, random_state=42)
+
+
+def forecast_buckets(series, split_time, kind='hgb', workers=None, lags=DEFAULT_LAGS, windows=DEFAULT_WINDOWS, report=True,
+                     exog=None):
+    # Trains on the buckets before split_time and predicts every later bucket
+    # one step ahead. Cost depends on the number of buckets, not of packets.
+    start = time.perf_counter()
+    features = lag_features(series, lags, windows, exog)
+    # Buckets without a full lag history are not trained on
+    known = features[f'lag_{max(lags)}'].notna().values
+    train = known & (series.index < split_time)
+    test = series.index >= split_time
+    model = LagModel(make_regressor(kind, workers), lags, windows, exog_columns=() if exog is None else exog.columns)
+    with threadpool_limits(limits=workers):
+        model.regressor.fit(features[train], series[train])
+        predicted = pd.Series(model.predict(features[test]), index=series.index[test], name=f'Predicted {series.name}')
+    if report:
+        print(f"{REGRESSOR_NAMES[kind]} on {train.sum()} buckets of {series.index.freqstr}: "
+              f"trained in {time.perf_counter() - start:.2f} s.")
+    return predicted, model
+
+
+def feature_blocks(series, start, stop, rows, lags=DEFAULT_LAGS, windows=DEFAULT_WINDOWS):
+    # Lag features of the buckets [start, stop) in blocks of `rows`, each
+    # computed with just enough previous buckets to be exact
+    context = max(max(lags), max(windows))
+    for block_start in range(start, stop, rows):
+        block_stop = min(block_start + rows, stop)
+        low = max(0, block_start - context)
+        features = lag_features(series.iloc[low:block_stop], lags, windows).iloc[block_start - low:]
+        yield features, series.iloc[block_start:block_stop]
+
+
+def forecast_buckets_incremental(series, split_time, memory_bytes, epochs=10, lags=DEFAULT_LAGS,
+                                 windows=DEFAULT_WINDOWS):
+    # Same forecast as forecast_buckets, but the training matrix is never built
+    # whole: the scaler and an SGD regressor learn from bounded blocks through
+    # partial_fit, and the predictions are made block by block too
+    start = time.perf_counter()
+    rows = max(1, memory_bytes // FEATURE_ROW_BYTES)
+    split = int(np.searchsorted(series.index.values, np.datetime64(split_time)))
+    lag = f'lag_{max(lags)}'
+    # Features and target are standardized, SGD converges poorly on raw counts
+    scaler = StandardScaler()
+    target_scaler = StandardScaler()
+    regressor = SGDRegressor(random_state=42)
+    for features, target in feature_blocks(series, 0, split, rows, lags, windows):
+        known = features[lag].notna().values
+        if known.any():
+            scaler.partial_fit(features[known])
+            target_scaler.partial_fit(target.values[known].reshape(-1, 1))
+    trained = 0
+    for epoch in range(epochs):
+        for features, target in feature_blocks(series, 0, split, rows, lags, windows):
+            known = features[lag].notna().values
+            if known.any():
+                regressor.partial_fit(scaler.transform(features[known]),
+                                      target_scaler.transform(target.values[known].reshape(-1, 1)).ravel())
+                trained += known.sum() if epoch == 0 else 0
+    model = LagModel(regressor, lags, windows, scaler, target_scaler)
+    predicted = [model.predict(features) for features, target in feature_blocks(series, split, len(series), rows, lags, windows)]
+    predicted = pd.Series(np.concatenate(predicted) if predicted else np.zeros(0), index=series.index[split:],
+                          name=f'Predicted {series.name}')
+    print(f"{REGRESSOR_NAMES['sgd']} on {trained} buckets of {series.index.freqstr}: "
+          f"trained in {time.perf_counter() - start:.2f} s ({rows} buckets per block).")
+    return predicted, model
\ No newline at end of file
@@ -0,0 +1,110 @@
+import datetime
+import glob
+import json
+import os
+import pickle
+import threading
+import numpy as np
+
+DEFAULT_MODELS_DIR = "./models"
+# Bump when the layout of the saved models changes, older files are skipped on load
+MODEL_FORMAT = 1
+# Filtered series kept by every ARIMA model, so a history continuing one of them only filters its new observations
+ARIMA_FILTER_CACHE = 32
+
+
+def continuation(filtered, history):
+    # Observations of history after the end of filtered when history starts
+    # inside filtered and matches it up to its end, None otherwise
+    offset = max(len(filtered) - len(history), 0)
+    for start in np.flatnonzero(filtered[offset:] == history[0]) + offset:
+        overlap = len(filtered) - start
+        if np.array_equal(filtered[start:], history[:overlap]):
+            return history[overlap:]
+    return None
+
+
+class ArimaModel:
+    # ARIMA order and fitted parameters, enough to filter a new history and
+    # forecast from it without keeping the statsmodels results object
+
+    def __init__(self, order, params, param_names):
+        self.order = tuple(order)
+        self.params = np.asarray(params, dtype=np.float64)
+        self.param_names = list(param_names)
+        self.__setstate__(self.__getstate__())
+
+    def __getstate__(self):
+        # The filtered series are not saved, they belong to the process serving the model
+        return {'order': self.order, 'params': self.params, 'param_names': self.param_names}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # (history, statsmodels results filtered up to its end), most recent first
+        self.filtered = []
+        self.lock = threading.Lock()
+
+    @property
+    def features(self):
+        return self.param_names
+
+    def forecast(self, history, steps):
+        history = np.asarray(history, dtype=np.float64)
+        with self.lock:
+            for i, (filtered, results) in enumerate(self.filtered):
+                new = continuation(filtered, history)
+                if new is not None:
+                    # Kalman filter resumed from the cached state on the new observations only
+                    if len(new):
+                        results = results.extend(new)
+                    del self.filtered[i]
+                    break
+            else:
+                from statsmodels.tsa.arima.model import ARIMA
+                results = ARIMA(history, order=self.order).filter(self.params)
+            self.filtered.insert(0, (history, results))
+            del self.filtered[ARIMA_FILTER_CACHE:]
+            return np.clip(results.forecast(steps=steps), 0, None)
+
+
+def model_paths(models_dir, name):
+    return os.path.join(models_dir, f"{name}.pkl"), os.path.join(models_dir, f"{name}.json")
+
+
+def save_model(models_dir, name, model, kind, interval=None, features=None, train_start=None, train_end=None):
+    # Pickled model next to its metadata; both are written to temporary names first
+    if not os.path.exists(models_dir):
+        os.makedirs(models_dir)
+    model_path, meta_path = model_paths(models_dir, name)
+    meta = {
+        'format': MODEL_FORMAT,
+        'name': name,
+        'kind': kind,
+        'interval': interval,
+        'features': list(features) if features is not None else None,
+        'train_start': None if train_start is None else str(train_start),
+        'train_end': None if train_end is None else str(train_end),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(model_path + ".tmp", 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(meta_path + ".tmp", 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(model_path + ".tmp", model_path)
+    os.replace(meta_path + ".tmp", meta_path)
+    return meta
+
+
+def load_models(models_dir=DEFAULT_MODELS_DIR):
+    # name -> (model, metadata) of every saved model of the current format
+    models = {}
+    for meta_path in sorted(glob.glob(os.path.join(models_dir, "*.json"))):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('format') != MODEL_FORMAT:
+            print(f"[WARNING] Skipping {meta_path}: model format {meta.get('format')}, expected {MODEL_FORMAT}.")
+            continue
+        model_path = model_paths(models_dir, meta['name'])[0]
+        with open(model_path, 'rb') as f:
+            models[meta['name']] = (pickle.load(f), meta)
+    return models
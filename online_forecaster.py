@@ -0,0 +1,124 @@
+import time
+from collections import deque
+import numpy as np
+import pandas as pd
+from capture_stats import LATENCY_BUCKETS, histogram_percentile
+
+DEFAULT_ORDER = 8
+DEFAULT_FORGETTING = 0.995
+DEFAULT_ALPHA = 0.3
+DEFAULT_ERROR_WINDOW = 100
+
+
+class RLSForecaster:
+    # AR(order) model with an intercept, updated by recursive least squares
+    # with exponential forgetting. Every update costs O(order^2) whatever the
+    # length of the series, and returns the forecast of the next bucket.
+
+    def __init__(self, order=DEFAULT_ORDER, forgetting=DEFAULT_FORGETTING, delta=1000.0):
+        self.name = f'RLS AR({order})'
+        self.order = order
+        self.forgetting = forgetting
+        self.weights = np.zeros(order + 1)
+        self.covariance = np.eye(order + 1) * delta
+        # Regressors of the next bucket: 1 and the last `order` values, newest first
+        self.regressors = np.zeros(order + 1)
+        self.regressors[0] = 1.0
+        self.forecast = 0.0
+
+    def update(self, value):
+        x = self.regressors
+        error = value - self.weights @ x
+        px = self.covariance @ x
+        gain = px / (self.forgetting + x @ px)
+        self.weights += gain * error
+        self.covariance = (self.covariance - np.outer(gain, px)) / self.forgetting
+        x[2:] = x[1:-1]
+        x[1] = value
+        self.forecast = max(self.weights @ x, 0.0)
+        return self.forecast
+
+
+class EWMAForecaster:
+    # Exponentially weighted level with a trend (Holt), O(1) per update
+
+    def __init__(self, alpha=DEFAULT_ALPHA, beta=0.05):
+        self.name = f'EWMA (alpha {alpha})'
+        self.alpha = alpha
+        self.beta = beta
+        self.level = None
+        self.trend = 0.0
+        self.forecast = 0.0
+
+    def update(self, value):
+        if self.level is None:
+            self.level = value
+        else:
+            previous = self.level
+            self.level = self.alpha * value + (1 - self.alpha) * (previous + self.trend)
+            self.trend = self.beta * (self.level - previous) + (1 - self.beta) * self.trend
+        self.forecast = max(self.level + self.trend, 0.0)
+        return self.forecast
+
+
+def make_forecaster(kind='rls'):
+    return EWMAForecaster() if kind == 'ewma' else RLSForecaster()
+
+
+class OnlineTracker:
+    # Feeds closed buckets to a forecaster and keeps the update latency
+    # histogram and the errors of the last `window` forecasts
+
+    def __init__(self, forecaster, window=DEFAULT_ERROR_WINDOW):
+        self.forecaster = forecaster
+        self.latency = [0] * LATENCY_BUCKETS
+        self.errors = deque(maxlen=window)
+        self.squared_sum = 0.0
+        self.absolute_sum = 0.0
+        self.updates = 0
+
+    def update(self, value):
+        # Error of the forecast made for this bucket, then the forecast of the next one
+        error = value - self.forecaster.forecast
+        if len(self.errors) == self.errors.maxlen:
+            oldest = self.errors[0]
+            self.squared_sum -= oldest * oldest
+            self.absolute_sum -= abs(oldest)
+        self.errors.append(error)
+        self.squared_sum += error * error
+        self.absolute_sum += abs(error)
+        start = time.perf_counter_ns()
+        forecast = self.forecaster.update(value)
+        self.latency[min((time.perf_counter_ns() - start).bit_length(), LATENCY_BUCKETS - 1)] += 1
+        self.updates += 1
+        return forecast
+
+    def rolling_rmse(self):
+        return np.sqrt(max(self.squared_sum, 0.0) / len(self.errors)) if self.errors else 0.0
+
+    def rolling_mae(self):
+        return max(self.absolute_sum, 0.0) / len(self.errors) if self.errors else 0.0
+
+    def report(self, label):
+        print(f"Online {self.forecaster.name} {label}: {self.updates} updates, "
+              f"p50 {histogram_percentile(self.latency, 0.5) / 1e3:g} us, "
+              f"p99 {histogram_percentile(self.latency, 0.99) / 1e3:g} us per update (upper bounds), "
+              f"rolling RMSE {self.rolling_rmse():.2f}, MAE {self.rolling_mae():.2f} "
+              f"over the last {len(self.errors)} buckets.")
+
+
+def forecast_online(series, split_time, kind='rls', window=DEFAULT_ERROR_WINDOW):
+    # Warms the forecaster up on the buckets before split_time, then replays
+    # the following buckets one at a time as they would close live, keeping
+    # the forecast made before each one
+    tracker = OnlineTracker(make_forecaster(kind), window)
+    values = series.values.astype(np.float64)
+    split = int(np.searchsorted(series.index.values, np.datetime64(split_time)))
+    for value in values[:split]:
+        tracker.forecaster.update(value)
+    forecasts = np.empty(len(values) - split)
+    for i, value in enumerate(values[split:]):
+        forecasts[i] = tracker.forecaster.forecast
+        tracker.update(value)
+    tracker.report(series.index.freqstr)
+    return pd.Series(forecasts, index=series.index[split:], name=f'Online {series.name}'), tracker
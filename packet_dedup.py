@@ -0,0 +1,64 @@
+from collections import deque
+import numpy as np
+
+# Longest time a packet needs to cross the captured interfaces of a path
+# (two 5 ms host links, up to three 20 ms switch links plus queueing)
+DEFAULT_WINDOW_MS = 100
+
+
+class PacketDeduplicator:
+    # Streaming detection of the same packet sniffed on several interfaces.
+    # Packets are fingerprinted by their header fields (MACs, ports, protocol,
+    # length and IP identification); a packet is a copy of an earlier one when
+    # the fingerprint matches within the tolerance window and the earlier
+    # packet has not been seen on this interface yet. Timestamps are expected
+    # in (roughly) increasing order.
+
+    def __init__(self, window_ms=DEFAULT_WINDOW_MS):
+        self.window_ns = int(window_ms * 1000000)
+        # fingerprint -> [[first timestamp, interfaces seen], ...] oldest first
+        self.recent = {}
+        self.expiry = deque()
+        self.seen = 0
+        self.duplicates = 0
+
+    def expire(self, timestamp):
+        horizon = timestamp - self.window_ns
+        while self.expiry and self.expiry[0][0] < horizon:
+            _, fingerprint = self.expiry.popleft()
+            entries = self.recent[fingerprint]
+            entries.pop(0)
+            if not entries:
+                del self.recent[fingerprint]
+
+    def is_duplicate(self, iface, timestamp, fingerprint):
+        self.seen += 1
+        self.expire(timestamp)
+        entries = self.recent.get(fingerprint)
+        if entries is None:
+            entries = self.recent[fingerprint] = []
+        else:
+            for entry in entries:
+                if iface not in entry[1]:
+                    entry[1].add(iface)
+                    self.duplicates += 1
+                    return True
+        entries.append([timestamp, {iface}])
+        self.expiry.append((timestamp, fingerprint))
+        return False
+
+    def duplication_factor(self):
+        unique = self.seen - self.duplicates
+        return self.seen / unique if unique else 1.0
+
+
+def duplicate_mask(ifaces, timestamps, fingerprint_columns, window_ms=DEFAULT_WINDOW_MS):
+    # Runs the streaming deduplicator over columns sorted by timestamp,
+    # returns a boolean mask of the duplicates and the deduplicator
+    dedup = PacketDeduplicator(window_ms)
+    mask = np.zeros(len(timestamps), dtype=bool)
+    fingerprints = zip(*[column.tolist() for column in fingerprint_columns])
+    for i, (iface, timestamp, fingerprint) in enumerate(zip(ifaces.tolist(), timestamps.tolist(), fingerprints)):
+        if dedup.is_duplicate(iface, timestamp, fingerprint):
+            mask[i] = True
+    return mask, dedup
@@ -0,0 +1,126 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Points kept per line, a figure is 18 inches wide at 100 dpi so more are not visible
+DEFAULT_MAX_POINTS = 2000
+DECIMATION_METHODS = ('minmax', 'lttb', 'none')
+
+
+def minmax_indices(y, max_points):
+    # Envelope decimation: the lowest and the highest point of every block,
+    # so the spikes of the traffic survive whatever the zoom
+    n = len(y)
+    if n <= max_points or max_points < 4:
+        return np.arange(n)
+    size = -(-n // (max_points // 2))
+    full = n // size * size
+    blocks = y[:full].reshape(-1, size)
+    offsets = np.arange(0, full, size)
+    selected = [[0, n - 1], blocks.argmin(axis=1) + offsets, blocks.argmax(axis=1) + offsets]
+    if full < n:
+        selected.append([full + y[full:].argmin(), full + y[full:].argmax()])
+    return np.unique(np.concatenate(selected))
+
+
+def lttb_indices(x, y, max_points):
+    # Largest-Triangle-Three-Buckets: from every bucket the point forming the
+    # largest triangle with the previously kept point and the mean of the next bucket
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        selected[i + 1] = previous
+    return selected
+
+
+def decimate(x, y, max_points=DEFAULT_MAX_POINTS, method='minmax'):
+    # At most about max_points of the line (x, y), x may be datetimes
+    x, y = np.asarray(x), np.asarray(y, dtype=np.float64)
+    if method == 'none' or len(y) <= max_points:
+        return x, y
+    if method == 'lttb':
+        numeric_x = x.astype('datetime64[ns]').view(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x
+        indices = lttb_indices(numeric_x.astype(np.float64), y, max_points)
+    else:
+        indices = minmax_indices(y, max_points)
+    return x[indices], y[indices]
+
+
+def render_figure(spec):
+    # Draws one figure off-screen. A spec is {'path', 'figsize', 'panels'}, each
+    # panel a dict of 'lines' (x, y, label and plot keywords), 'vlines', labels,
+    # title, or 'acf'/'pacf' (series, lags) for the correlograms
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    start = time.perf_counter()
+    fig, axes = plt.subplots(len(spec['panels']), 1, figsize=spec['figsize'], squeeze=False)
+    for ax, panel in zip(axes[:, 0], spec['panels']):
+        if 'acf' in panel or 'pacf' in panel:
+            from statsmodels.graphics.tsaplots import plot_acf, plot_pacf
+            series, lags = panel['acf'] if 'acf' in panel else panel['pacf']
+            (plot_acf if 'acf' in panel else plot_pacf)(series, lags=lags, ax=ax)
+            continue
+        for line in panel.get('lines', []):
+            ax.plot(line['x'], line['y'], label=line['label'], **line.get('style', {}))
+        for x, style in panel.get('vlines', []):
+            ax.axvline(x=x, **style)
+        ax.set_xlabel(panel.get('xlabel', ''))
+        ax.set_ylabel(panel.get('ylabel', ''))
+        ax.set_title(panel.get('title', ''))
+        ax.legend()
+        ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(spec['path'])
+    plt.close(fig)
+    return time.perf_counter() - start
+
+
+class FigureRenderer:
+    # Figures are submitted as soon as their data is ready and drawn by worker
+    # processes while the next models train; close() waits for all of them
+
+    def __init__(self, max_points=DEFAULT_MAX_POINTS, method='minmax', workers=None, enabled=True):
+        self.max_points = max_points
+        self.method = method
+        self.workers = workers
+        self.enabled = enabled
+        self.executor = None
+        self.pending = []
+
+    def line(self, x, y, label, **style):
+        x, y = decimate(x, y, self.max_points, self.method)
+        return {'x': x, 'y': y, 'label': label, 'style': style}
+
+    def submit(self, spec, message):
+        if not self.enabled:
+            return
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending.append((spec['path'], message, self.executor.submit(render_figure, spec)))
+
+    def close(self):
+        # Rendering seconds of every figure by path
+        seconds = {}
+        if self.executor is None:
+            return seconds
+        for path, message, future in self.pending:
+            seconds[path] = future.result()
+            print(f"{message} in {seconds[path]:.2f} s.")
+        self.executor.shutdown()
+        self.executor = None
+        self.pending = []
+        return seconds
@@ -1,11 +1,105 @@
+import argparse
 import warnings
 import os
+import sys
+import time
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from sklearn.ensemble import RandomForestRegressor
-from statsmodels.tsa.arima.model import ARIMA
 from statsmodels.tsa.stattools import adfuller
-from statsmodels.graphics.tsaplots import plot_acf, plot_pacf
+from capture_follower import CaptureFollower
+from dataset import load_captures, deduplicate, write_united, list_capture_files, iter_capture_blocks
+from feature_cache import FeatureCache, cached_frame, DEFAULT_CACHE_MB
+from bucket_pyramid import BucketPyramid, BucketAccumulator, interval_ns
+from arima_fitting import fit_intervals
+from arima_order import select_orders
+from online_forecaster import forecast_online
+from batched_ar import bucket_matrix, evaluate_series
+from capture_writer import int_to_mac
+from backtest import PACKET_FEATURES, run_backtest, summarize_backtest
+from traffic_features import capture_features
+from plot_rendering import FigureRenderer, DEFAULT_MAX_POINTS, DECIMATION_METHODS
+from stage_profiler import StageProfiler, DEFAULT_REPORT_DIR
+from model_store import ArimaModel, save_model
+from lag_regression import forecast_buckets, forecast_buckets_incremental, REGRESSOR_NAMES
+
+parser = argparse.ArgumentParser(description="Traffic prediction: train models on the captures and plot their forecasts")
+parser.add_argument("--dedup", type=float, default=0, help="Drop packets already captured on another interface within this many milliseconds (default 0, disabled)")
+parser.add_argument("--united", action="store_true", help="Also save the merged dataset in captures/united_traffic.csv")
+parser.add_argument("--load-workers", type=int, default=None, help="Number of processes reading the captures (default one per CPU)")
+parser.add_argument("--no-cache", action="store_true", help="Always rebuild the preprocessed features instead of using ./cache")
+parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_MB, help=f"Size limit of the feature cache in MB (default {DEFAULT_CACHE_MB})")
+parser.add_argument("--arima-budget", type=float, default=0, help="Time budget in seconds of every ARIMA fit (default 0, unlimited)")
+parser.add_argument("--arima-workers", type=int, default=None, help="Number of processes fitting ARIMA (default one per sampling interval)")
+parser.add_argument("--arima-order", default="auto", help="ARIMA order as p,d,q, or 'auto' to search it for every sampling interval (default auto)")
+parser.add_argument("--arima-criterion", choices=["aic", "bic"], default="aic", help="Criterion of the ARIMA order search (default aic)")
+parser.add_argument("--forecaster", choices=["lags", "packets"], default="lags", help="'lags' trains on the bucketed counts with lag, rolling-mean and calendar features, 'packets' is the per-packet Random Forest (default lags)")
+parser.add_argument("--regressor", choices=["hgb", "rf"], default="hgb", help="Ensemble of the lag forecaster: histogram gradient boosting or random forest (default hgb)")
+parser.add_argument("--regression-workers", type=int, default=None, help="Number of threads of the regression ensembles (default all cores)")
+parser.add_argument("--stream", action="store_true", help="Read the captures in bounded blocks and train incrementally, for captures larger than memory")
+parser.add_argument("--memory-mb", type=int, default=256, help="Memory budget in MB of the blocks read and trained on with --stream (default 256)")
+parser.add_argument("--online", choices=["rls", "ewma", "none"], default="rls", help="Online forecaster replayed on the test buckets: recursive least squares AR, EWMA or none (default rls)")
+parser.add_argument("--follow", action="store_true", help="Follow the captures while they are written, reading only what was appended since the previous run")
+parser.add_argument("--refresh", type=float, default=0, help="With --follow, run again every this many seconds (default 0, run once)")
+parser.add_argument("--models-dir", default="./models", help="Folder where the trained models are saved for forecast_server.py, empty to not save them (default ./models)")
+parser.add_argument("--series-ar-order", type=int, default=8, help="Order of the batched AR fitted on every link and source/destination pair, 0 to skip it (default 8)")
+parser.add_argument("--backtest-folds", type=int, default=5, help="Folds of the rolling-origin backtest of ARIMA and of the lag forecaster, or with --forecaster packets of the per-packet Random Forest (flow bucket captures only), 0 to skip it (default 5)")
+parser.add_argument("--traffic-features", action="store_true", help="Also train the lag forecaster on the rates, inter-arrival statistics, protocol mix and active flows of the previous bucket")
+parser.add_argument("--no-plots", action="store_true", help="Do not render the figures, e.g. for benchmark runs")
+parser.add_argument("--plot-points", type=int, default=DEFAULT_MAX_POINTS, help=f"Points drawn per line, longer series are decimated (default {DEFAULT_MAX_POINTS})")
+parser.add_argument("--plot-decimation", choices=DECIMATION_METHODS, default="minmax", help="Decimation of the plotted lines: min/max envelope, largest-triangle-three-buckets or none (default minmax)")
+parser.add_argument("--plot-workers", type=int, default=None, help="Number of processes rendering the figures (default one per CPU)")
+parser.add_argument("--report-dir", default=DEFAULT_REPORT_DIR, help=f"Folder of the per-stage time and memory reports, empty to not write them (default {DEFAULT_REPORT_DIR})")
+parser.add_argument("--profile-stage", default=None, help="Also run this stage (e.g. load, preprocess, 'lags 100L', 'arima fit') under cProfile and save its profile in the report folder")
+args = parser.parse_args()
+if args.stream and args.forecaster == "packets":
+    parser.error("--stream trains on the bucketed counts, it does not support --forecaster packets")
+if args.stream and args.dedup:
+    parser.error("--stream does not merge the interfaces, it does not support --dedup")
+if args.traffic_features and (args.stream or args.follow):
+    parser.error("--traffic-features needs the captured packets, it does not support --stream nor --follow")
+if args.follow and (args.forecaster == "packets" or args.dedup):
+    parser.error("--follow only keeps the bucketed counts, it does not support --forecaster packets nor --dedup")
+
+#Arguments
+DEDUP_WINDOW_MS = args.dedup
+SAVE_UNITED = args.united
+LOAD_WORKERS = args.load_workers
+USE_CACHE = not args.no_cache
+CACHE_MB = args.cache_size
+ARIMA_BUDGET_S = args.arima_budget or None
+ARIMA_WORKERS = args.arima_workers
+ARIMA_ORDER = None if args.arima_order == "auto" else tuple(int(x) for x in args.arima_order.split(","))
+ARIMA_CRITERION = args.arima_criterion
+FORECASTER = args.forecaster
+REGRESSOR = args.regressor
+REGRESSION_WORKERS = args.regression_workers
+STREAM = args.stream
+MEMORY_BYTES = args.memory_mb * 1024 * 1024
+ONLINE = args.online
+FOLLOW = args.follow
+REFRESH_S = args.refresh
+MODELS_DIR = args.models_dir
+SERIES_AR_ORDER = args.series_ar_order
+BACKTEST_FOLDS = args.backtest_folds
+TRAFFIC_FEATURES = args.traffic_features
+PLOTS = not args.no_plots
+PLOT_POINTS = args.plot_points
+PLOT_DECIMATION = args.plot_decimation
+PLOT_WORKERS = args.plot_workers
+REPORT_DIR = args.report_dir
+PROFILE_STAGE = args.profile_stage
+# Buckets needed before the models are trained in follow mode
+MIN_FOLLOW_BUCKETS = 50
+
+# Wall and CPU time, peak memory and counts of every stage of the run
+profiler = StageProfiler(PROFILE_STAGE, REPORT_DIR)
+
+def report():
+    json_path = profiler.report()
+    print(profiler.summary())
+    if json_path:
+        print(f"[INFO] Stage report saved in {json_path}.")
 
 # Remove previous plots
 os.system("rm -rf ./plots/*.png")
@@ -21,211 +115,387 @@ if not os.path.exists(plots_dir):
 
 print("[INFO] Created plot folder.")
 
+# Figures are decimated and rendered off-screen in worker processes while the models train
+renderer = FigureRenderer(PLOT_POINTS, PLOT_DECIMATION, PLOT_WORKERS, PLOTS)
+if not PLOTS:
+    print("[INFO] Plots disabled.")
+
 # DATASET UNION
 folder_path = './captures'
 
-df_list = []
-for filename in os.listdir(folder_path):
-    if filename.endswith('.csv'):
-        filepath = os.path.join(folder_path, filename)
-        df = pd.read_csv(filepath)
-        df_list.append(df)
-
-# File union
-df = pd.concat(df_list, ignore_index=True)
-
-# DataFrame saving in a unique CSV file
-output_file_path = './captures/united_traffic.csv'
-df.to_csv(output_file_path, index=False)
+# Bump when the preprocessing below changes, it invalidates the feature cache
+PREPROCESS_VERSION = 2
 
-df = pd.read_csv(output_file_path)
+def build_features():
+    # Capture segments (or legacy csv files) read in parallel with typed columns and merged by timestamp
+    profiler.begin('load')
+    df = load_captures(folder_path, LOAD_WORKERS)
+    profiler.count(rows=len(df))
 
-# DATASET PROCESSING
+    # Flow buckets written by the capture aggregation mode carry a 'Packets' counter
+    aggregated = 'Packets' in df.columns
 
-# Convert the 'Timestamp' column to datetime format
-df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    # Packets sniffed on several interfaces of their path are kept once
+    if DEDUP_WINDOW_MS and not aggregated:
+        profiler.begin('union', rows_in=len(df))
+        df = deduplicate(df, DEDUP_WINDOW_MS)
+        profiler.count(rows=len(df))
 
-# Multiply the traffic by duplicating rows
-df = pd.concat([df] * 1, ignore_index=True)
+    # DATASET PROCESSING
+    profiler.begin('preprocess', rows=len(df))
 
-# Dataframe sorting based on Timestamps
-df = df.sort_values(by='Timestamp')
+    # Multiply the traffic by duplicating rows
+    df = pd.concat([df] * 1, ignore_index=True)
 
-# MAC and port columns in numerical values
-df['Source MAC'] = df['Source MAC'].apply(lambda x: int(x.replace(':', ''), 16) if isinstance(x, str) else x)
-df['Destination MAC'] = df['Destination MAC'].apply(lambda x: int(x.replace(':', ''), 16) if isinstance(x, str) else x)
+    # Replace non-numeric and missing values with 0 (or an appropriate value)
+    df[['Source Port', 'Destination Port', 'Elapsed time', 'Protocol']] = df[['Source Port', 'Destination Port', 'Elapsed time', 'Protocol']].apply(pd.to_numeric, errors='coerce').fillna(0)
+    df['Length'] = pd.to_numeric(df['Length'], errors='coerce').fillna(0)
 
-# Protocol column in numerical values
-protocol_mapping = {'TCP': 0, 'UDP': 1, 'ICMP': 2, 'Other': 3}
-df['Protocol'] = df['Protocol'].map(protocol_mapping)
-
-# Replace non-numeric and missing values with 0 (or an appropriate value)
-df[['Source Port', 'Destination Port', 'Elapsed time', 'Protocol']] = df[['Source Port', 'Destination Port', 'Elapsed time', 'Protocol']].apply(pd.to_numeric, errors='coerce').fillna(0)
-df['Length'] = pd.to_numeric(df['Length'], errors='coerce').fillna(0)
-
-# Calculate the packet counts
-df['Packet Count'] = df.groupby('Timestamp').cumcount() + 1
-
-# Calculation of the index corresponding to the last 20% of the time
-time_range = df['Timestamp'].max() - df['Timestamp'].min()
-time_20_percent = df['Timestamp'].min() + 0.8 * time_range
-
-# Selection of the data before the last 20% of the time for training
-train_df = df[df['Timestamp'] < time_20_percent].copy()
-
-# Feature and target selection for the training phase
-X_train = train_df[['Source MAC', 'Destination MAC', 'Source Port', 'Destination Port', 'Elapsed time', 'Protocol']]
-y_train = train_df['Packet Count']
+    # Calculate the packet counts (per millisecond, the resolution of the csv captures)
+    if aggregated:
+        df['Packet Count'] = df['Packets']
+    else:
+        df['Packet Count'] = df.groupby(df['Timestamp'].dt.floor('ms')).cumcount() + 1
+    return df
 
 # Definition of the desired sampling intervals (0.1s, 0.3s, 0.5s)
 sampling_intervals = ['100L', '300L', '500L']
 
-# RANDOM FOREST
-
-print("[INFO] Training with Random Forest.")
-
-# Training of Random Forest on the first 80% temporal data
-regressor = RandomForestRegressor(n_estimators=100, random_state=42)
-regressor.fit(X_train, y_train)
+def refresh():
+    # Follow mode: run again once the captures grew, resuming from the persisted offsets
+    time.sleep(REFRESH_S)
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+if FOLLOW:
+    # Captures followed while they are still written, only the rows appended since the
+    # previous run are read and added to the persisted bucketed counts
+    profiler.begin('follow')
+    follower = CaptureFollower(folder_path)
+    new_rows = follower.poll()
+    accumulator = follower.accumulator
+    profiler.count(rows=new_rows, buckets=accumulator.length)
+    print(f"[INFO] Followed {new_rows} new capture rows, {accumulator.rows} rows in {accumulator.length} buckets.")
+    if accumulator.length < MIN_FOLLOW_BUCKETS:
+        print(f"[INFO] Waiting for at least {MIN_FOLLOW_BUCKETS} buckets of captures.")
+        report()
+        if REFRESH_S:
+            refresh()
+        sys.exit(0)
+elif STREAM:
+    # Out-of-core path: the captures are read in bounded blocks and only their bucketed
+    # counts are kept, the packets never are in memory at once
+    profiler.begin('stream')
+    accumulator = BucketAccumulator()
+    for timestamps, packets in iter_capture_blocks(folder_path, MEMORY_BYTES // 2):
+        accumulator.add(timestamps, packets)
+    profiler.count(rows=accumulator.rows, buckets=accumulator.length)
+    print(f"[INFO] Streamed {accumulator.rows} capture rows into {accumulator.length} buckets.")
+
+if FOLLOW or STREAM:
+    packet_counts = accumulator.pyramid()
+    first_timestamp = pd.Timestamp(accumulator.min_timestamp)
+    last_timestamp = pd.Timestamp(accumulator.max_timestamp)
+else:
+    # Preprocessed features are reused while the captures and the preprocessing are unchanged
+    if USE_CACHE:
+        profiler.begin('cache')
+        cache = FeatureCache(max_mb=CACHE_MB)
+        df = cached_frame(cache, list_capture_files(folder_path), (PREPROCESS_VERSION, DEDUP_WINDOW_MS), build_features)
+    else:
+        df = build_features()
+
+    AGGREGATED = 'Packets' in df.columns
+    profiler.begin('bucketing', rows=len(df))
+
+    # DataFrame saving in a unique CSV file, written in the background
+    if SAVE_UNITED:
+        output_file_path = './captures/united_traffic.csv'
+        write_united(df, output_file_path)
+
+    # Packet counts bucketed once at 100 ms, every sampling interval is derived from them and
+    # shared by the plots and ARIMA (packet rows are counted, flow buckets are summed)
+    packet_counts = BucketPyramid(df['Timestamp'].values, df['Packets'].values if AGGREGATED else None)
+    first_timestamp = df['Timestamp'].min()
+    last_timestamp = df['Timestamp'].max()
+    profiler.count(buckets=len(packet_counts.series(sampling_intervals[0])))
 
-# Predictions on the last 20% temporal data
-test_df = df[df['Timestamp'] >= time_20_percent].copy()
-X_test = test_df[['Source MAC', 'Destination MAC', 'Source Port', 'Destination Port', 'Elapsed time', 'Protocol']]
-y_test = test_df['Packet Count']
-y_pred_last_20_percent = regressor.predict(X_test)
-
-# Adding predictions to the test DataFrame
-test_df.loc[:, 'Predicted Packet Count'] = y_pred_last_20_percent
-
-# Plot Random Forest
-fig, axss = plt.subplots(3, 1, figsize=(18, 6))
-for i, interval in enumerate(sampling_intervals):
-    # Sampled Dataframe generation for train and test phases
-    train_df_sampled = train_df.set_index('Timestamp').resample(interval).count().reset_index()
-    test_df_sampled = test_df.set_index('Timestamp').resample(interval).count().reset_index()
-
-    # Plot of real train data and predicted test data
-    axss[i].plot(train_df_sampled['Timestamp'], train_df_sampled['Packet Count'], label='Actual Packet Count', color='blue')
-    axss[i].plot(test_df_sampled['Timestamp'], test_df_sampled['Predicted Packet Count'], label='Predicted Packet Count', color='orange')
-    axss[i].axvline(x=time_20_percent, linestyle='--', color='red', label='80%-20% Split')
-
-    axss[i].set_xlabel('Timestamp')
-    axss[i].set_ylabel('Packet Count')
-    axss[i].set_title(f'Random Forest: Predictions vs Actual Packet Count (Sampled every {interval})')
-    axss[i].legend()
-    axss[i].grid(True)
-
-plt.tight_layout()
-# plt.show()
-plt.savefig('./plots/random-forest.png')
-print("Random Forest plot saved.")
+# Calculation of the index corresponding to the last 20% of the time
+time_range = last_timestamp - first_timestamp
+time_20_percent = first_timestamp + 0.8 * time_range
+
+if FORECASTER == 'lags':
+    # LAG REGRESSION
+
+    regression_name = REGRESSOR_NAMES['sgd' if STREAM else REGRESSOR]
+    print(f"[INFO] Training with {regression_name} on lag features.")
+
+    # One model per sampling interval, trained on the bucketed series before the split
+    # and predicting every following bucket one step ahead
+    predicted_series = {}
+    for interval in sampling_intervals:
+        counts = packet_counts.series(interval)
+        profiler.begin(f'lags {interval}', buckets=len(counts))
+        if STREAM:
+            # Trained block by block through partial_fit within the memory budget
+            predicted_series[interval], lag_model = forecast_buckets_incremental(counts, time_20_percent, MEMORY_BYTES // 2)
+        else:
+            # Rates, inter-arrival statistics, protocol mix, active flows and flow rates of the previous bucket
+            exog = capture_features(df, interval) if TRAFFIC_FEATURES else None
+            predicted_series[interval], lag_model = forecast_buckets(counts, time_20_percent, REGRESSOR, REGRESSION_WORKERS,
+                                                                     exog=exog)
+        if MODELS_DIR:
+            save_model(MODELS_DIR, f'lags-{interval}', lag_model, 'lags', interval, lag_model.features,
+                       counts.index[0], time_20_percent)
+else:
+    # RANDOM FOREST
+
+    regression_name = 'Random Forest'
+    print("[INFO] Training with Random Forest.")
+
+    # Selection of the data before the last 20% of the time for training
+    train_df = df[df['Timestamp'] < time_20_percent].copy()
+
+    # Feature and target selection for the training phase
+    X_train = train_df[PACKET_FEATURES]
+    y_train = train_df['Packet Count']
+
+    # Training of Random Forest on the first 80% temporal data
+    profiler.begin('random forest fit', rows=len(train_df))
+    regressor = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=REGRESSION_WORKERS or -1)
+    regressor.fit(X_train, y_train)
+    if MODELS_DIR:
+        save_model(MODELS_DIR, 'random-forest', regressor, 'packets', features=X_train.columns,
+                   train_start=train_df['Timestamp'].min(), train_end=time_20_percent)
+
+    # Predictions on the last 20% temporal data
+    profiler.begin('random forest predict')
+    test_df = df[df['Timestamp'] >= time_20_percent].copy()
+    X_test = test_df[PACKET_FEATURES]
+    y_test = test_df['Packet Count']
+    y_pred_last_20_percent = regressor.predict(X_test)
+    profiler.count(rows=len(X_test))
+
+    # Adding predictions to the test DataFrame
+    test_df.loc[:, 'Predicted Packet Count'] = y_pred_last_20_percent
+
+    predicted_counts = BucketPyramid(test_df['Timestamp'].values, y_pred_last_20_percent if AGGREGATED else None,
+                                     name='Predicted Packet Count')
+    predicted_series = {interval: predicted_counts.series(interval) for interval in sampling_intervals}
+
+# Plot Random Forest (or lag regression)
+if PLOTS:
+    profiler.begin('plot regression')
+    panels = []
+    for interval in sampling_intervals:
+        # Sampled series for train and test phases
+        counts = packet_counts.series(interval)
+        train_sampled = counts[counts.index < time_20_percent]
+        test_sampled = predicted_series[interval]
+
+        # Plot of real train data and predicted test data
+        panels.append({
+            'lines': [renderer.line(train_sampled.index, train_sampled.values, 'Actual Packet Count', color='blue'),
+                      renderer.line(test_sampled.index, test_sampled.values, 'Predicted Packet Count', color='orange')],
+            'vlines': [(time_20_percent, {'linestyle': '--', 'color': 'red', 'label': '80%-20% Split'})],
+            'xlabel': 'Timestamp',
+            'ylabel': 'Packet Count',
+            'title': f'{regression_name}: Predictions vs Actual Packet Count (Sampled every {interval})',
+        })
+    renderer.submit({'path': './plots/random-forest.png' if FORECASTER == 'packets' else './plots/lag-regression.png',
+                     'figsize': (18, 6), 'panels': panels}, f"{regression_name} plot saved")
+
+# ONLINE
+
+# Test buckets replayed one at a time through an online forecaster warmed up on the training
+# buckets, as they would close during a live capture
+if ONLINE != 'none':
+    print("[INFO] Forecasting online.")
+    profiler.begin('online')
+    online_forecasts = {interval: forecast_online(packet_counts.series(interval), time_20_percent, ONLINE)[0]
+                        for interval in sampling_intervals}
+
+# PER-SERIES AR
+
+# Every link (captured interface) and every source/destination pair forecast at once by a
+# batched least-squares AR, the captured packets are needed to split the series
+if SERIES_AR_ORDER and not (FOLLOW or STREAM):
+    print("[INFO] Forecasting every link and source/destination pair with a batched AR.")
+    profiler.begin('series ar', rows=len(df))
+    weights = df['Packets'].values.astype(np.float64) if AGGREGATED else None
+    pairs = np.column_stack([df['Source MAC'].values.astype(np.uint64), df['Destination MAC'].values.astype(np.uint64)])
+    for interval in sampling_intervals:
+        width_ns = interval_ns(interval)
+        links, index, matrix = bucket_matrix(df['Interface'].astype(str).values, df['Timestamp'].values, width_ns, weights)
+        evaluate_series(f'links {interval}', links, index, matrix, time_20_percent, SERIES_AR_ORDER)
+        pair_keys, index, matrix = bucket_matrix(pairs, df['Timestamp'].values, width_ns, weights)
+        pair_names = [f"{int_to_mac(src)}>{int_to_mac(dst)}" for src, dst in pair_keys]
+        evaluate_series(f'pairs {interval}', pair_names, index, matrix, time_20_percent, SERIES_AR_ORDER)
 
 # ARIMA
 
 print("[INFO] Training with ARIMA.")
 
-df_arima = df[['Timestamp', 'Packet Count']].copy()
 results_arima = {}
 
-# Perform Dickey-Fuller test on a sample of the data
-sample_size = 10000
-df_sample = df_arima['Packet Count'].sample(n=sample_size, random_state=42)
-
-print(f"Statistics on a subset of size {sample_size}:")
-
-# stationariety test (Dickey-Fuller)
-result = adfuller(df_sample)
-print('ADF Statistic:', result[0])
-print('p-value:', result[1])
-for key, value in result[4].items():
-    print('Critial Values:')
-    print(f'   {key}, {value}')
+# Perform Dickey-Fuller test on the bucketed series ARIMA fits: the training part of every
+# interval, at most its last 10000 buckets
+profiler.begin('adf')
+adf_samples = {}
+for interval in sampling_intervals:
+    counts = packet_counts.series(interval)
+    df_sample = adf_samples[interval] = counts[:int(len(counts) * 0.8)].dropna()[-10000:]
+
+    print(f"Statistics on the last {len(df_sample)} training buckets of {interval}:")
+
+    # stationariety test (Dickey-Fuller), undefined on a constant series
+    if df_sample.min() == df_sample.max():
+        print('Constant series, Dickey-Fuller test skipped.')
+        continue
+    try:
+        result = adfuller(df_sample)
+    except ValueError as e:
+        print(f'Dickey-Fuller test skipped: {e}')
+        continue
+    print('ADF Statistic:', result[0])
+    print('p-value:', result[1])
+    for key, value in result[4].items():
+        print('Critial Values:')
+        print(f'   {key}, {value}')
+
+profiler.count(buckets=sum(len(sample) for sample in adf_samples.values()))
 
 # Tracciare i grafici ACF e PACF
-fig, ax = plt.subplots(2, 1, figsize=(12, 8))
+df_sample = adf_samples[sampling_intervals[0]]
+if PLOTS and df_sample.min() != df_sample.max():
+    profiler.begin('acf pacf')
+    renderer.submit({'path': './plots/p-acf.png', 'figsize': (12, 8),
+                     'panels': [{'acf': (df_sample, 40)}, {'pacf': (df_sample, 40)}]}, "ACF and PACF plot saved")
 
-plot_acf(df_sample, lags=40, ax=ax[0])
-plot_pacf(df_sample, lags=40, ax=ax[1])
-plt.tight_layout()
-plt.savefig('./plots/p-acf.png')
-print("ACF and PACF plot saved.")
-
-fig, axs = plt.subplots(3, 1, figsize=(18, 6))
 warnings.filterwarnings("ignore", category=UserWarning)
 
-for i, interval in enumerate(sampling_intervals):
-    # Data sampling for ARIMA
-    df_sampled = df_arima.set_index('Timestamp').resample(interval).count().reset_index()
-    
-    # Regular temporal series generation for ARIMA
-    y = df_sampled['Packet Count'].values
-    index_regolare = pd.date_range(start=df_sampled['Timestamp'].min(), periods=len(y), freq=interval)
-    ts_regolare = pd.Series(y, index=index_regolare)
+# ARIMA order of every sampling interval: d from the Dickey-Fuller test on its training
+# series, (p, q) searched in parallel among the candidates that survive cheap pre-fits
+if ARIMA_ORDER is None:
+    profiler.begin('arima order')
+    train_series = {}
+    for interval in sampling_intervals:
+        counts = packet_counts.series(interval)
+        train_series[interval] = counts[:int(len(counts) * 0.8)].dropna()
+    orders = select_orders(train_series, ARIMA_CRITERION, budget_s=ARIMA_BUDGET_S, workers=ARIMA_WORKERS)
+else:
+    orders = ARIMA_ORDER
+
+# Training of ARIMA on the first 80% temporal data, one process per sampling interval,
+# warm-started from the previous solutions of the same (or the nearest) interval
+profiler.begin('arima fit')
+arima_fits = fit_intervals({interval: packet_counts.series(interval) for interval in sampling_intervals}, orders,
+                           train_fraction=0.8, maxiter=800, budget_s=ARIMA_BUDGET_S, workers=ARIMA_WORKERS)
+# The intervals are fitted in parallel, each one's own time is kept as well
+profiler.count(**{f'seconds_{interval}': round(fit['seconds'], 3) for interval, fit in arima_fits.items()})
+if MODELS_DIR:
+    for interval, fit in arima_fits.items():
+        counts = packet_counts.series(interval)
+        model = ArimaModel(orders[interval] if isinstance(orders, dict) else orders, fit['params'], fit['param_names'])
+        save_model(MODELS_DIR, f'arima-{interval}', model, 'arima', interval, model.features,
+                   counts.index[0], counts.index[int(len(counts) * 0.8) - 1])
+
+profiler.begin('plot arima')
+panels = []
+for interval in sampling_intervals:
+    # Data sampling for ARIMA, the bucketed series already has a regular index
+    ts_regolare = packet_counts.series(interval)
 
-    # Training of ARIMA on the first 80% temporal data
     train_size = int(len(ts_regolare) * 0.8)
-    train_ts = ts_regolare[:train_size]
     test_ts = ts_regolare[train_size:]
 
-    # Check if train_ts and test_ts have no missing values
-    train_ts.dropna(inplace=True)
-    test_ts.dropna(inplace=True)
+    # Check if test_ts has no missing values
+    test_ts = test_ts.dropna()
 
-    order = (22, 0, 22)  # ARIMA order
-    model = ARIMA(train_ts, order=order)
-    model_fit = model.fit(method_kwargs={'maxiter':800})
-    forecast_steps = len(test_ts)
-    forecast = model_fit.forecast(steps=forecast_steps)
+    forecast = arima_fits[interval]['forecast']
 
     # Dataframe generation for test set and ARIMA forecastings
     test_df_arima = pd.DataFrame({'Timestamp': test_ts.index, 'Packet Count': test_ts.values, 'ARIMA Predicted Packet Count': forecast.values})
     results_arima[interval] = test_df_arima
 
     # Plot of real data and predicted data: ARIMA
-    axs[i].plot(df_sampled['Timestamp'], df_sampled['Packet Count'], label='Actual Packet Count', color='blue')
-    axs[i].plot(test_df_arima['Timestamp'], test_df_arima['ARIMA Predicted Packet Count'], label='ARIMA Predicted Packet Count', color='orange')
-    
-    split_point = df_sampled['Timestamp'].iloc[train_size]
-    axs[i].axvline(x=split_point, linestyle='--', color='red', label='80%-20% Split')
-
-    axs[i].set_xlabel('Timestamp')
-    axs[i].set_ylabel('Packet Count')
-    axs[i].set_title(f'ARIMA: Predictions vs Actual Packet Count (Sampled every {interval})')
-    axs[i].legend()
-    axs[i].grid(True)
-
-plt.tight_layout()
-# plt.show()
-plt.savefig('./plots/arima.png')
-print("ARIMA plot saved.")
-
-print("[INFO] Plotting comparison.")
+    if PLOTS:
+        split_point = ts_regolare.index[train_size]
+        panels.append({
+            'lines': [renderer.line(ts_regolare.index, ts_regolare.values, 'Actual Packet Count', color='blue'),
+                      renderer.line(test_df_arima['Timestamp'], test_df_arima['ARIMA Predicted Packet Count'],
+                                    'ARIMA Predicted Packet Count', color='orange')],
+            'vlines': [(split_point, {'linestyle': '--', 'color': 'red', 'label': '80%-20% Split'})],
+            'xlabel': 'Timestamp',
+            'ylabel': 'Packet Count',
+            'title': f'ARIMA: Predictions vs Actual Packet Count (Sampled every {interval})',
+        })
+
+renderer.submit({'path': './plots/arima.png', 'figsize': (18, 6), 'panels': panels}, "ARIMA plot saved")
+
 # Plot comparison between all the last 20% predicted data (RF + ARIMA)
-plt.figure(figsize=(18, 9))
-for i, interval in enumerate(sampling_intervals):
-    plt.subplot(3, 1, i + 1)
-    
-    # Random Forest
-    plt.plot(test_df.set_index('Timestamp').resample(interval).count().reset_index()['Timestamp'],
-             test_df.set_index('Timestamp').resample(interval).count().reset_index()['Packet Count'], label='Actual Packet Count', color='blue')
-    plt.plot(test_df.set_index('Timestamp').resample(interval).count().reset_index()['Timestamp'],
-             test_df.set_index('Timestamp').resample(interval).count().reset_index()['Predicted Packet Count'], label='Random Forest Predicted Packet Count', color='orange')
-    
-    # ARIMA
-    test_df_arima = results_arima[interval]
-    plt.plot(test_df_arima['Timestamp'], test_df_arima['ARIMA Predicted Packet Count'], label='ARIMA Predicted Packet Count', linestyle='--', color='green')
-    
-    plt.axvline(x=time_20_percent, linestyle='--', color='red', label='80%-20% Split')
-
-    plt.xlabel('Timestamp')
-    plt.ylabel('Packet Count')
-    plt.title(f'Random Forest vs ARIMA Predictions (Sampled every {sampling_intervals[i]})')
-    plt.legend()
-    plt.grid(True)
-
-plt.tight_layout()
-# plt.show()
-plt.savefig('./plots/comparison.png')
-print("Compared plots saved.")
-
-print("[INFO] Done.")
\ No newline at end of file
+if PLOTS:
+    print("[INFO] Plotting comparison.")
+    profiler.begin('plot comparison')
+    panels = []
+    for interval in sampling_intervals:
+        # Random Forest (or lag regression)
+        test_predicted = predicted_series[interval]
+        counts = packet_counts.series(interval)
+        test_actual = counts[counts.index >= test_predicted.index[0]]
+        lines = [renderer.line(test_actual.index, test_actual.values, 'Actual Packet Count', color='blue'),
+                 renderer.line(test_predicted.index, test_predicted.values, f'{regression_name} Predicted Packet Count', color='orange')]
+
+        # ARIMA
+        test_df_arima = results_arima[interval]
+        lines.append(renderer.line(test_df_arima['Timestamp'], test_df_arima['ARIMA Predicted Packet Count'],
+                                   'ARIMA Predicted Packet Count', linestyle='--', color='green'))
+
+        # Online forecaster
+        if ONLINE != 'none':
+            online = online_forecasts[interval]
+            lines.append(renderer.line(online.index, online.values, 'Online Predicted Packet Count', linestyle=':', color='purple'))
+
+        panels.append({
+            'lines': lines,
+            'vlines': [(time_20_percent, {'linestyle': '--', 'color': 'red', 'label': '80%-20% Split'})],
+            'xlabel': 'Timestamp',
+            'ylabel': 'Packet Count',
+            'title': f'{regression_name} vs ARIMA Predictions (Sampled every {interval})',
+        })
+    renderer.submit({'path': './plots/comparison.png', 'figsize': (18, 9), 'panels': panels}, "Compared plots saved")
+
+# BACKTEST
+
+# Rolling-origin backtest over the second half of every series: ARIMA is fitted once and its
+# state extended through each fold, the lag regressor (or the per-packet Random Forest on flow
+# buckets) is refitted per fold, all in parallel
+if BACKTEST_FOLDS:
+    print("[INFO] Backtesting.")
+    profiler.begin('backtest')
+    packets_frame = None
+    if FORECASTER == 'packets':
+        if AGGREGATED:
+            packets_frame = df[['Timestamp', *PACKET_FEATURES, 'Packet Count']]
+        else:
+            # Its bucketed series counts the test packets themselves, it is not a forecast of them
+            print("[INFO] The per-packet Random Forest is only backtested on flow bucket captures, backtesting ARIMA alone.")
+    backtest = run_backtest({interval: packet_counts.series(interval) for interval in sampling_intervals}, orders,
+                            REGRESSOR if FORECASTER == 'lags' else None, BACKTEST_FOLDS, {interval: fit['params'] for interval, fit in arima_fits.items()},
+                            budget_s=ARIMA_BUDGET_S, workers=ARIMA_WORKERS, packets_frame=packets_frame)
+    backtest.to_csv('./plots/backtest.csv', index=False)
+    profiler.count(folds=len(backtest))
+    print(backtest.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    print(summarize_backtest(backtest).to_string(float_format=lambda x: f"{x:.3f}"))
+    print("Backtest saved.")
+
+# Wait for the figures still being rendered
+profiler.begin('plots')
+render_seconds = renderer.close()
+profiler.end(figures=len(render_seconds), render_s=round(sum(render_seconds.values()), 3))
+
+report()
+print("[INFO] Done.")
+
+if FOLLOW and REFRESH_S:
+    refresh()
\ No newline at end of file
@@ -0,0 +1,94 @@
+import json
+import os
+import subprocess
+import time
+
+DEFAULT_READY_TIMEOUT_S = 120
+POLL_INTERVAL_S = 0.2
+# STP port states in which a port stays until the topology changes
+SETTLED_PORT_STATES = ('FORWARD', 'BLOCK', 'DISABLE')
+
+
+def write_controller_state(filepath, switches, ports=None):
+    # Written by the controller apps: connected dpids and, with STP, the state of every port
+    state = {'time': time.time(), 'switches': sorted(switches),
+             'ports': {str(dpid): {str(port): state for port, state in states.items()}
+                       for dpid, states in (ports or {}).items()}}
+    with open(filepath + ".tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def read_controller_state(filepath):
+    try:
+        with open(filepath) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ovs_connected_switches():
+    # Bridges whose controller connection is up, from the OVS database (one call for all bridges)
+    try:
+        output = subprocess.run(["ovs-vsctl", "--timeout=2", "--format=json", "--columns=name,controller", "list", "Bridge"],
+                                capture_output=True, text=True, timeout=5).stdout
+        bridges = json.loads(output)['data']
+        output = subprocess.run(["ovs-vsctl", "--timeout=2", "--format=json", "--columns=_uuid,is_connected", "list", "Controller"],
+                                capture_output=True, text=True, timeout=5).stdout
+        controllers = json.loads(output)['data']
+    except (OSError, ValueError, KeyError, subprocess.TimeoutExpired):
+        return set()
+    connected = {uuid for (kind, uuid), is_connected in controllers if is_connected is True}
+    names = set()
+    for name, controller in bridges:
+        # A single reference is ["uuid", id], several are ["set", [["uuid", id], ...]]
+        refs = controller[1] if controller[0] == 'set' else [controller]
+        if any(ref[1] in connected for ref in refs):
+            names.add(name)
+    return names
+
+
+def stp_pending(state, switch_ports):
+    # Switches whose ports are not all known and settled, or without any
+    # forwarding port yet (right after connecting every port is blocked)
+    pending = []
+    ports = (state or {}).get('ports', {})
+    for dpid, expected in switch_ports.items():
+        states = ports.get(str(dpid), {})
+        if (len(states) < expected or any(s not in SETTLED_PORT_STATES for s in states.values())
+                or 'FORWARD' not in states.values()):
+            pending.append(dpid)
+    return pending
+
+
+def wait_ready(switch_ports, names, state_path, stp=False, timeout_s=DEFAULT_READY_TIMEOUT_S, poll_s=POLL_INTERVAL_S):
+    # Waits for every switch to be connected (OVS side) and known by the
+    # controller, then with STP for all their ports to settle. switch_ports:
+    # {dpid: number of ports}, names: {dpid: bridge name}. Returns the
+    # seconds of every phase and what was still pending at the timeout.
+    def disconnected():
+        connected = ovs_connected_switches()
+        return [dpid for dpid in switch_ports if names[dpid] not in connected]
+
+    def unknown():
+        known = set((read_controller_state(state_path) or {}).get('switches', []))
+        return [dpid for dpid in switch_ports if dpid not in known]
+
+    def unsettled():
+        return stp_pending(read_controller_state(state_path), switch_ports)
+
+    phases = [('switches_connected', disconnected), ('controller_ready', unknown)]
+    if stp:
+        phases.append(('stp_converged', unsettled))
+    start = time.monotonic()
+    deadline = start + timeout_s
+    timings = {}
+    for phase, pending_of in phases:
+        pending = pending_of()
+        while pending and time.monotonic() < deadline:
+            time.sleep(poll_s)
+            pending = pending_of()
+        timings[phase] = time.monotonic() - start
+        if pending:
+            return timings, {'phase': phase, 'pending': pending}
+    return timings, None
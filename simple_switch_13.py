@@ -1,11 +1,17 @@
+import json
+import os
+import time
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
+from forwarding import ControllerStats, forwarding_table, load_topology, PROACTIVE_IDLE_TIMEOUT, STATS_INTERVAL_S
+from readiness import write_controller_state
 
 class SimpleSwitch13(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
@@ -13,6 +19,19 @@ class SimpleSwitch13(app_manager.RyuApp):
     def __init__(self, *args, **kwargs):
         super(SimpleSwitch13, self).__init__(*args, **kwargs)
         self.mac_to_port = {}
+        self.stats = ControllerStats()
+
+        # Proactive mode: forwarding precomputed from the topology written by
+        # topology.py, one rule per destination MAC on every switch
+        self.forwarding = None
+        topology_path = os.environ.get('PROACTIVE_TOPOLOGY')
+        if topology_path:
+            self.forwarding = forwarding_table(*load_topology(topology_path))
+        self.stats_path = os.environ.get('CONTROLLER_STATS')
+        # Connected switches, polled by topology.py to know when the network is ready
+        self.state_path = os.environ.get('CONTROLLER_STATE')
+        self.switches = set()
+        self.stats_thread = hub.spawn(self._report_stats)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
@@ -24,23 +43,76 @@ class SimpleSwitch13(app_manager.RyuApp):
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+        if self.forwarding is not None:
+            routes = self.forwarding.get(datapath.id, {})
+            for dst, out_port in routes.items():
+                self.add_flow(datapath, 1, parser.OFPMatch(eth_dst=dst),
+                              [parser.OFPActionOutput(out_port)],
+                              idle_timeout=PROACTIVE_IDLE_TIMEOUT)
+            self.logger.info("dpid=%s: %d proactive rules installed",
+                             datapath.id, len(routes))
+
+        self.switches.add(datapath.id)
+        if self.state_path:
+            write_controller_state(self.state_path, self.switches)
+
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None,
+                 idle_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
                                              actions)]
+        # Expiring rules report their removal, to keep the table size
+        flags = ofproto.OFPFF_SEND_FLOW_REM if idle_timeout else 0
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
                                     priority=priority, match=match,
+                                    idle_timeout=idle_timeout, flags=flags,
                                     instructions=inst)
         else:
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    match=match, instructions=inst)
+                                    match=match, idle_timeout=idle_timeout,
+                                    flags=flags, instructions=inst)
         datapath.send_msg(mod)
+        self.stats.flow_added(datapath.id, priority, match)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        self.stats.flow_removed(msg.datapath.id, msg.priority, msg.match)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def _state_change_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.stats.switch_removed(ev.datapath.id)
+            self.switches.discard(ev.datapath.id)
+            if self.state_path:
+                write_controller_state(self.state_path, self.switches)
+
+    def _report_stats(self):
+        # packet_in rate, handler latency and flow entries, logged and saved periodically
+        while True:
+            hub.sleep(STATS_INTERVAL_S)
+            snapshot = self.stats.snapshot()
+            self.logger.info("packet_in %.1f/s (%d total), handler p50 %gus p99 %gus, "
+                             "flow entries %s", snapshot['packet_in_rate'],
+                             snapshot['packet_ins'], snapshot['handler_p50_us'],
+                             snapshot['handler_p99_us'], snapshot['flow_entries'])
+            if self.stats_path:
+                with open(self.stats_path + ".tmp", 'w') as f:
+                    json.dump(snapshot, f, indent=2)
+                os.replace(self.stats_path + ".tmp", self.stats_path)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        start = time.perf_counter_ns()
+        try:
+            self._handle_packet_in(ev)
+        finally:
+            self.stats.record_packet_in(time.perf_counter_ns() - start)
+
+    def _handle_packet_in(self, ev):
         # If you hit this you might want to increase
         # the "miss_send_length" of your switch
         if ev.msg.msg_len < ev.msg.total_len:
@@ -61,16 +133,31 @@ class SimpleSwitch13(app_manager.RyuApp):
         dst = eth.dst
         src = eth.src
 
-        dpid = format(datapath.id, "d").zfill(16)
-        self.mac_to_port.setdefault(dpid, {})
+        dpid = datapath.id
+        routes = self.forwarding.get(dpid) if self.forwarding is not None else None
+
+        # logged at debug level, formatting every packet_in costs more than handling it
+        self.logger.debug("packet in %s %s %s %s", dpid, src, dst, in_port)
+
+        if routes is not None and dst in routes:
+            # Proactive rule expired: reinstall it, aggregated on the destination
+            out_port = routes[dst]
+            actions = [parser.OFPActionOutput(out_port)]
+            self.add_flow(datapath, 1, parser.OFPMatch(eth_dst=dst), actions,
+                          idle_timeout=PROACTIVE_IDLE_TIMEOUT)
+            out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
+                                      in_port=in_port, actions=actions,
+                                      data=msg.data if msg.buffer_id == ofproto.OFP_NO_BUFFER else None)
+            datapath.send_msg(out)
+            return
 
-        self.logger.info("packet in %s %s %s %s", dpid, src, dst, in_port)
+        mac_to_port = self.mac_to_port.setdefault(dpid, {})
 
         # learn a mac address to avoid FLOOD next time.
-        self.mac_to_port[dpid][src] = in_port
+        mac_to_port[src] = in_port
 
-        if dst in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][dst]
+        if dst in mac_to_port:
+            out_port = mac_to_port[dst]
         else:
             out_port = ofproto.OFPP_FLOOD
 
@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import os
+import time
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
@@ -23,6 +26,19 @@ from ryu.lib import stplib
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.app import simple_switch_13
+from readiness import write_controller_state
+
+# Cookie of the learned flows: the tag in the high half, the output port in
+# the low half, so they can be deleted all at once or by port
+FLOW_COOKIE_TAG = 0x57500000 << 32
+FLOW_COOKIE_TAG_MASK = 0xffffffff << 32
+FLOW_COOKIE_PORT_MASK = 0xffffffffffffffff
+TRANSITIONAL_STATES = (stplib.PORT_STATE_LISTEN, stplib.PORT_STATE_LEARN)
+PORT_STATE_NAMES = {stplib.PORT_STATE_DISABLE: 'DISABLE',
+                    stplib.PORT_STATE_BLOCK: 'BLOCK',
+                    stplib.PORT_STATE_LISTEN: 'LISTEN',
+                    stplib.PORT_STATE_LEARN: 'LEARN',
+                    stplib.PORT_STATE_FORWARD: 'FORWARD'}
 
 
 class SimpleSwitch13(simple_switch_13.SimpleSwitch13):
@@ -44,17 +60,70 @@ class SimpleSwitch13(simple_switch_13.SimpleSwitch13):
                   {'bridge': {'priority': 0xa000}}}
         self.stp.set_config(config)
 
-    def delete_flow(self, datapath):
+        # KEEP_FORWARDING_MACS=1: on a topology change only the MACs learned on
+        # ports that left the FORWARD state are forgotten
+        self.keep_forwarding = os.environ.get('KEEP_FORWARDING_MACS') == '1'
+        self.reconvergence_log = os.environ.get('RECONVERGENCE_LOG')
+        # Switches and port states, polled by topology.py to know when STP converged
+        self.state_path = os.environ.get('CONTROLLER_STATE')
+        # dpid -> {port_no: stp state}
+        self.port_states = {}
+        # dpid -> (topology change time, packet_in count since)
+        self.reconverging = {}
+
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+        # Same as the parent, with the learned flows tagged by cookie
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        cookie = 0
+        if priority and actions and isinstance(actions[0], parser.OFPActionOutput):
+            cookie = FLOW_COOKIE_TAG | actions[0].port
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                             actions)]
+        if buffer_id:
+            mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
+                                    cookie=cookie, priority=priority,
+                                    match=match, instructions=inst)
+        else:
+            mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                    priority=priority, match=match,
+                                    instructions=inst)
+        datapath.send_msg(mod)
+
+    def delete_flow(self, datapath, ports=None):
+        # One cookie-masked delete for all the learned flows of the switch, or
+        # one per port when only the flows towards some ports are flushed
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        for dst in self.mac_to_port[datapath.id].keys():
-            match = parser.OFPMatch(eth_dst=dst)
+        if ports is None:
+            cookies = [(FLOW_COOKIE_TAG, FLOW_COOKIE_TAG_MASK)]
+        else:
+            cookies = [(FLOW_COOKIE_TAG | port, FLOW_COOKIE_PORT_MASK) for port in ports]
+        for cookie, cookie_mask in cookies:
             mod = parser.OFPFlowMod(
-                datapath, command=ofproto.OFPFC_DELETE,
+                datapath, cookie=cookie, cookie_mask=cookie_mask,
+                table_id=ofproto.OFPTT_ALL, command=ofproto.OFPFC_DELETE,
                 out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
-                priority=1, match=match)
+                match=parser.OFPMatch())
             datapath.send_msg(mod)
+        return len(cookies)
+
+    def check_reconverged(self, dpid):
+        # Reconverged once no port of the switch is listening or learning
+        states = self.port_states.get(dpid, {})
+        if any(state in TRANSITIONAL_STATES for state in states.values()):
+            return
+        started, packet_ins = self.reconverging.pop(dpid)
+        event = {'dpid': dpid_lib.dpid_to_str(dpid), 'time': time.time(),
+                 'reconvergence_s': time.monotonic() - started,
+                 'packet_ins': packet_ins}
+        self.logger.info("[dpid=%s] reconverged in %.2f s, %d packet_in meanwhile",
+                         event['dpid'], event['reconvergence_s'], packet_ins)
+        if self.reconvergence_log:
+            with open(self.reconvergence_log, 'a') as f:
+                f.write(json.dumps(event) + "\n")
 
     @set_ev_cls(stplib.EventPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
@@ -73,7 +142,12 @@ class SimpleSwitch13(simple_switch_13.SimpleSwitch13):
         dpid = datapath.id
         self.mac_to_port.setdefault(dpid, {})
 
-        self.logger.info("packet in %s %s %s %s", dpid, src, dst, in_port)
+        self.logger.debug("packet in %s %s %s %s", dpid, src, dst, in_port)
+
+        if dpid in self.reconverging:
+            started, packet_ins = self.reconverging[dpid]
+            self.reconverging[dpid] = (started, packet_ins + 1)
+            self.check_reconverged(dpid)
 
         # learn a mac address to avoid FLOOD next time.
         self.mac_to_port[dpid][src] = in_port
@@ -105,17 +179,33 @@ class SimpleSwitch13(simple_switch_13.SimpleSwitch13):
         msg = 'Receive topology change event. Flush MAC table.'
         self.logger.debug("[dpid=%s] %s", dpid_str, msg)
 
+        self.reconverging[dp.id] = (time.monotonic(), 0)
         if dp.id in self.mac_to_port:
-            self.delete_flow(dp)
-            del self.mac_to_port[dp.id]
+            if self.keep_forwarding:
+                # Entries behind ports still forwarding stay, the others are flushed
+                states = self.port_states.get(dp.id, {})
+                mac_to_port = self.mac_to_port[dp.id]
+                stale = {port for port in mac_to_port.values()
+                         if states.get(port) != stplib.PORT_STATE_FORWARD}
+                flow_mods = self.delete_flow(dp, sorted(stale))
+                self.mac_to_port[dp.id] = {mac: port for mac, port in mac_to_port.items()
+                                           if port not in stale}
+            else:
+                flow_mods = self.delete_flow(dp)
+                del self.mac_to_port[dp.id]
+            self.logger.info("[dpid=%s] topology change: %d flow deletes, %d MACs kept",
+                             dpid_str, flow_mods, len(self.mac_to_port.get(dp.id, {})))
 
     @set_ev_cls(stplib.EventPortStateChange, MAIN_DISPATCHER)
     def _port_state_change_handler(self, ev):
         dpid_str = dpid_lib.dpid_to_str(ev.dp.id)
-        of_state = {stplib.PORT_STATE_DISABLE: 'DISABLE',
-                    stplib.PORT_STATE_BLOCK: 'BLOCK',
-                    stplib.PORT_STATE_LISTEN: 'LISTEN',
-                    stplib.PORT_STATE_LEARN: 'LEARN',
-                    stplib.PORT_STATE_FORWARD: 'FORWARD'}
         self.logger.debug("[dpid=%s][port=%d] state=%s",
-                          dpid_str, ev.port_no, of_state[ev.port_state])
+                          dpid_str, ev.port_no, PORT_STATE_NAMES[ev.port_state])
+
+        self.port_states.setdefault(ev.dp.id, {})[ev.port_no] = ev.port_state
+        if self.state_path:
+            write_controller_state(self.state_path, self.port_states,
+                                   {dpid: {port: PORT_STATE_NAMES[state] for port, state in states.items()}
+                                    for dpid, states in self.port_states.items()})
+        if ev.dp.id in self.reconverging:
+            self.check_reconverged(ev.dp.id)
@@ -0,0 +1,135 @@
+import cProfile
+import csv
+import datetime
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+
+DEFAULT_REPORT_DIR = "./reports"
+# Functions listed when a stage is profiled
+PROFILE_TOP = 20
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # High-water mark of the resident memory, ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def plain_counts(counts):
+    # numpy integers (lengths of arrays, sums) are stored as plain ints
+    return {key: int(value) if hasattr(value, '__index__') else value for key, value in counts.items()}
+
+
+def children_cpu_s():
+    # CPU time of the finished worker processes (process pools, plot rendering)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageProfiler:
+    # Wall and CPU time, peak RSS and row/bucket counts of the consecutive
+    # stages of a run: begin() closes the previous stage and opens the next
+    # one. The stage named profile_stage also runs under cProfile.
+
+    def __init__(self, profile_stage=None, report_dir=DEFAULT_REPORT_DIR):
+        self.profile_stage = profile_stage
+        self.report_dir = report_dir
+        self.started = datetime.datetime.now()
+        self.start_wall = time.perf_counter()
+        self.stages = []
+        self.current = None
+        self.profiler = None
+
+    def begin(self, name, **counts):
+        self.end()
+        self.current = {'stage': name, 'counts': plain_counts(counts), 'wall': time.perf_counter(), 'cpu': time.process_time(),
+                        'children_cpu': children_cpu_s(), 'rss': peak_rss_mb()}
+        if name == self.profile_stage:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def count(self, **counts):
+        # Rows, buckets... of the current stage
+        if self.current is not None:
+            self.current['counts'].update(plain_counts(counts))
+
+    def end(self, **counts):
+        if self.current is None:
+            return
+        if self.profiler is not None:
+            self.profiler.disable()
+        current, self.current = self.current, None
+        rss = peak_rss_mb()
+        self.stages.append({
+            'stage': current['stage'],
+            'wall_s': time.perf_counter() - current['wall'],
+            'cpu_s': time.process_time() - current['cpu'],
+            'children_cpu_s': children_cpu_s() - current['children_cpu'],
+            'peak_rss_mb': rss,
+            'rss_growth_mb': rss - current['rss'],
+            **current['counts'],
+            **plain_counts(counts),
+        })
+        if self.profiler is not None:
+            self.dump_profile(current['stage'])
+
+    def dump_profile(self, stage):
+        profiler, self.profiler = self.profiler, None
+        path = os.path.join(self.report_dir or '.', f"profile-{stage.replace(' ', '-')}.prof")
+        if self.report_dir and not os.path.exists(self.report_dir):
+            os.makedirs(self.report_dir)
+        profiler.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        print(f"[INFO] Profile of stage {stage} saved in {path}.")
+        print(text.getvalue())
+
+    def summary(self):
+        lines = [f"{'stage':<24}{'wall s':>9}{'cpu s':>9}{'workers s':>11}{'peak MB':>10}  counts"]
+        for stage in self.stages:
+            counts = ', '.join(f"{key} {value}" for key, value in stage.items()
+                               if key not in ('stage', 'wall_s', 'cpu_s', 'children_cpu_s', 'peak_rss_mb', 'rss_growth_mb'))
+            lines.append(f"{stage['stage']:<24}{stage['wall_s']:>9.2f}{stage['cpu_s']:>9.2f}"
+                         f"{stage['children_cpu_s']:>11.2f}{stage['peak_rss_mb']:>10.0f}  {counts}")
+        return '\n'.join(lines)
+
+    def report(self, argv=None):
+        # JSON of this run, and one CSV row per stage appended to stages.csv so
+        # the runs can be compared. Returns the JSON path.
+        self.end()
+        if not self.report_dir:
+            return None
+        if not os.path.exists(self.report_dir):
+            os.makedirs(self.report_dir)
+        run = self.started.isoformat(timespec='seconds')
+        report = {
+            'run': run,
+            'argv': list(sys.argv if argv is None else argv),
+            'wall_s': time.perf_counter() - self.start_wall,
+            'peak_rss_mb': peak_rss_mb(),
+            'children_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'stages': self.stages,
+        }
+        json_path = os.path.join(self.report_dir, f"run-{self.started.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(json_path + ".tmp", 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        os.replace(json_path + ".tmp", json_path)
+
+        csv_path = os.path.join(self.report_dir, "stages.csv")
+        fields = ['run', 'stage', 'wall_s', 'cpu_s', 'children_cpu_s', 'peak_rss_mb', 'rss_growth_mb', 'counts']
+        new_file = not os.path.exists(csv_path)
+        with open(csv_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            if new_file:
+                writer.writeheader()
+            for stage in self.stages:
+                row = {key: stage[key] for key in fields[1:-1]}
+                # Counts differ by stage, they are kept together as JSON
+                row['counts'] = json.dumps({key: value for key, value in stage.items() if key not in fields}, default=str)
+                writer.writerow({'run': run, **row})
+        return json_path
@@ -0,0 +1,331 @@
+import glob
+import time
+from os import makedirs, path
+from types import SimpleNamespace
+import numpy as np
+from capture_aggregation import BUCKET_COLUMNS, DEFAULT_BUCKET_MS, bucket_segment_path, list_bucket_segments
+from capture_writer import FLUSH_INTERVAL_S, PROTOCOL_CODES, SEGMENT_SUFFIX, mac_to_int, write_segment
+
+# Column layout of a port statistics segment (name, dtype), one row per port and interval
+PORT_COLUMNS = [
+    ('bucket', np.int64),      # interval start, epoch nanoseconds
+    ('rx_packets', np.uint64),
+    ('tx_packets', np.uint64),
+    ('rx_bytes', np.uint64),
+    ('tx_bytes', np.uint64),
+    ('rx_dropped', np.uint64),
+    ('tx_dropped', np.uint64),
+    ('rx_errors', np.uint64),
+    ('tx_errors', np.uint64),
+]
+PORT_COUNTERS = [name for name, dtype in PORT_COLUMNS[1:]]
+
+TELEMETRY_ROWS = 1 << 14
+# Reserved OpenFlow port numbers (LOCAL, CONTROLLER...) start here
+OFPP_MAX = 0xffffff00
+# Flow entries only match on L2 fields, the transport protocol is unknown
+FLOW_PROTOCOL = PROTOCOL_CODES['Other']
+
+
+def port_segment_path(captures_dir, iface, index):
+    return path.join(captures_dir, f"{iface}_port_stats.{index:05d}{SEGMENT_SUFFIX}")
+
+
+def list_port_segments(captures_dir, iface="*"):
+    return sorted(glob.glob(path.join(captures_dir, f"{iface}_port_stats.*{SEGMENT_SUFFIX}")))
+
+
+def port_interface(dpid, port_no):
+    # Same names as the Mininet interfaces sniffed by topology.py
+    return f"s{dpid}-eth{port_no}"
+
+
+class CounterDeltas:
+    # Turns snapshots of cumulative counters into per-interval deltas. A key
+    # whose counters went backwards (switch reconnected, flow reinstalled)
+    # restarts from zero, keys missing from a snapshot are forgotten.
+
+    def __init__(self):
+        self.last = {}
+
+    def update(self, snapshot, window=None):
+        # snapshot: key -> (age, counters), age being a duration that only
+        # grows while the counters keep accumulating (0 when unknown), and
+        # window the time since the previous sample (None for the first one)
+        deltas = {}
+        last = self.last
+        for key, (age, counters) in snapshot.items():
+            previous = last.get(key)
+            if previous is None:
+                # A key that appeared since the previous sample (flow installed
+                # or reinstalled after expiring) counted everything within this
+                # interval; an older one (first sample of the switch) covers an unknown period
+                if window is not None and age <= window:
+                    deltas[key] = counters
+                continue
+            previous_age, previous_counters = previous
+            if age < previous_age or any(c < p for c, p in zip(counters, previous_counters)):
+                deltas[key] = counters
+            else:
+                deltas[key] = tuple(c - p for c, p in zip(counters, previous_counters))
+        self.last = dict(snapshot)
+        return deltas
+
+
+class SegmentBuffer:
+    # Rows of one interface, written as numbered segments after the existing ones
+
+    def __init__(self, captures_dir, iface, columns, segment_path, existing):
+        self.captures_dir = captures_dir
+        self.iface = iface
+        self.columns = columns
+        self.segment_path = segment_path
+        self.segment_index = len(existing)
+        self.rows = []
+        self.written = 0
+
+    def flush(self):
+        if not self.rows:
+            return None
+        rows = list(zip(*self.rows))
+        columns = {name: np.array(rows[i], dtype=dtype) for i, (name, dtype) in enumerate(self.columns)}
+        filepath = self.segment_path(self.captures_dir, self.iface, self.segment_index)
+        write_segment(filepath, columns)
+        self.written += len(self.rows)
+        self.segment_index += 1
+        self.rows = []
+        return filepath
+
+
+class TelemetryCollector:
+    # Polls the port and flow counters of every switch, one request of each
+    # per switch and interval whatever the packet rate, and writes their
+    # deltas: flow entries as flow buckets ({in port}_flow_buckets segments,
+    # read by prediction.py like the aggregated captures), ports as
+    # {port}_port_stats segments. Ryu independent: it only needs
+    # datapath.id, send_msg and ofproto_parser, so a stub can drive it.
+
+    def __init__(self, captures_dir="captures", interval_ns=DEFAULT_BUCKET_MS * 1000000, segment_rows=TELEMETRY_ROWS,
+                 flush_interval_s=FLUSH_INTERVAL_S):
+        self.captures_dir = captures_dir
+        self.interval_ns = interval_ns
+        self.segment_rows = segment_rows
+        self.flush_interval_s = flush_interval_s
+        # (dpid, kind) -> counter deltas of the switch
+        self.deltas = {}
+        # dpid -> request time of the pending sample and, by kind, of the previous one
+        self.sample_times = {}
+        # (dpid, kind) -> stats of the multipart reply received so far
+        self.partial = {}
+        self.buffers = {}
+        self.last_flush = time.monotonic()
+        self.requests = 0
+        self.replies = 0
+        if not path.exists(captures_dir):
+            makedirs(captures_dir)
+
+    def request_stats(self, datapath, now_ns=None):
+        # One port and one flow statistics request, both stamped with the time they were sent
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        self.sample_times.setdefault(datapath.id, {})['pending'] = now_ns
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        datapath.send_msg(parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY))
+        datapath.send_msg(parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                                     ofproto.OFPG_ANY, 0, 0, parser.OFPMatch()))
+        self.requests += 1
+
+    def collect(self, dpid, kind, body, more):
+        # Multipart replies are gathered until their last part
+        parts = self.partial.setdefault((dpid, kind), [])
+        parts.extend(body)
+        if more:
+            return None
+        return self.partial.pop((dpid, kind))
+
+    def interval_start(self, dpid, kind, now_ns=None):
+        # Deltas cover [previous sample, this sample): their bucket is the one of
+        # the previous request, returned with the time elapsed since that request
+        times = self.sample_times.get(dpid)
+        if times is None or 'pending' not in times:
+            return None, None
+        previous = times.get(kind)
+        times[kind] = times['pending']
+        if previous is None:
+            return None, None
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        return previous - previous % self.interval_ns, max(now_ns, times['pending']) - previous
+
+    def update(self, dpid, kind, snapshot, window=None):
+        deltas = self.deltas.get((dpid, kind))
+        if deltas is None:
+            deltas = self.deltas[(dpid, kind)] = CounterDeltas()
+        return deltas.update(snapshot, window)
+
+    def port_stats_reply(self, dpid, body, more=False, now_ns=None):
+        stats = self.collect(dpid, 'port', body, more)
+        if stats is None:
+            return 0
+        bucket, window = self.interval_start(dpid, 'port', now_ns)
+        snapshot = {}
+        for stat in stats:
+            if stat.port_no >= OFPP_MAX:
+                continue
+            age = stat.duration_sec * 1000000000 + stat.duration_nsec
+            snapshot[stat.port_no] = (age, tuple(getattr(stat, name) for name in PORT_COUNTERS))
+        deltas = self.update(dpid, 'port', snapshot, window)
+        rows = 0
+        if bucket is not None:
+            for port_no, counters in deltas.items():
+                self.buffer(port_interface(dpid, port_no), 'port').rows.append((bucket, *counters))
+                rows += 1
+        self.replies += 1
+        self.maybe_flush()
+        return rows
+
+    def flow_stats_reply(self, dpid, body, more=False, now_ns=None):
+        stats = self.collect(dpid, 'flow', body, more)
+        if stats is None:
+            return 0
+        bucket, window = self.interval_start(dpid, 'flow', now_ns)
+        snapshot = {}
+        flows = {}
+        for stat in stats:
+            match = stat.match
+            key = (stat.table_id, stat.priority, stat.cookie,
+                   match.get('in_port'), match.get('eth_src'), match.get('eth_dst'))
+            age = stat.duration_sec * 1000000000 + stat.duration_nsec
+            snapshot[key] = (age, (stat.packet_count, stat.byte_count))
+            flows[key] = match
+        deltas = self.update(dpid, 'flow', snapshot, window)
+        rows = 0
+        if bucket is not None:
+            for key, (packets, nbytes) in deltas.items():
+                if not packets:
+                    continue
+                match = flows[key]
+                in_port = match.get('in_port')
+                # Table-miss and other entries without an input port are accounted to the switch
+                iface = port_interface(dpid, in_port) if in_port is not None else f"s{dpid}"
+                src = match.get('eth_src')
+                dst = match.get('eth_dst')
+                self.buffer(iface, 'flow').rows.append((bucket, mac_to_int(src) if src else 0, mac_to_int(dst) if dst else 0,
+                                                        0, 0, FLOW_PROTOCOL, packets, nbytes))
+                rows += 1
+        self.replies += 1
+        self.maybe_flush()
+        return rows
+
+    def buffer(self, iface, kind):
+        buffer = self.buffers.get((iface, kind))
+        if buffer is None:
+            if kind == 'flow':
+                buffer = SegmentBuffer(self.captures_dir, iface, BUCKET_COLUMNS, bucket_segment_path,
+                                       list_bucket_segments(self.captures_dir, iface))
+            else:
+                buffer = SegmentBuffer(self.captures_dir, iface, PORT_COLUMNS, port_segment_path,
+                                       list_port_segments(self.captures_dir, iface))
+            self.buffers[(iface, kind)] = buffer
+        return buffer
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.flush_interval_s:
+            self.flush()
+            return
+        for buffer in self.buffers.values():
+            if len(buffer.rows) >= self.segment_rows:
+                buffer.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        return [filepath for filepath in (buffer.flush() for buffer in self.buffers.values()) if filepath]
+
+    def remove_datapath(self, dpid):
+        # A disconnected switch starts over: its next counters are a first sample
+        self.sample_times.pop(dpid, None)
+        self.deltas = {key: value for key, value in self.deltas.items() if key[0] != dpid}
+        self.partial = {key: value for key, value in self.partial.items() if key[0] != dpid}
+
+    def close(self):
+        return self.flush()
+
+
+class StubDatapath:
+    # Stand-in for a Ryu datapath: records the requests and answers them with
+    # canned stats replies, each reply being {'port': [...], 'flow': [...]}
+    # (lists of port_stat/flow_stat entries, or lists of such lists to
+    # replay a multipart reply)
+
+    ofproto = SimpleNamespace(OFPP_ANY=0xffffffff, OFPTT_ALL=0xff, OFPG_ANY=0xffffffff)
+    ofproto_parser = SimpleNamespace(
+        OFPMatch=lambda **fields: dict(fields),
+        OFPPortStatsRequest=lambda datapath, flags, port_no: ('port', datapath.id),
+        OFPFlowStatsRequest=lambda datapath, flags, table_id, out_port, out_group, cookie, cookie_mask, match:
+            ('flow', datapath.id),
+    )
+
+    def __init__(self, dpid, replies):
+        self.id = dpid
+        self.replies = list(replies)
+        self.sent = []
+
+    def send_msg(self, msg):
+        self.sent.append(msg)
+
+    def replay(self, collector, now_ns):
+        # One polling round: request, then deliver the next canned replies
+        collector.request_stats(self, now_ns)
+        reply = self.replies.pop(0)
+        rows = 0
+        for kind, handler in (('port', collector.port_stats_reply), ('flow', collector.flow_stats_reply)):
+            parts = reply.get(kind, [])
+            if parts and isinstance(parts[0], list):
+                for part in parts[:-1]:
+                    handler(self.id, part, more=True, now_ns=now_ns)
+                rows += handler(self.id, parts[-1], now_ns=now_ns)
+            else:
+                rows += handler(self.id, parts, now_ns=now_ns)
+        return rows
+
+
+def port_stat(port_no, rx_packets=0, tx_packets=0, rx_bytes=0, tx_bytes=0, duration_sec=0, duration_nsec=0,
+              rx_dropped=0, tx_dropped=0, rx_errors=0, tx_errors=0):
+    return SimpleNamespace(port_no=port_no, rx_packets=rx_packets, tx_packets=tx_packets, rx_bytes=rx_bytes,
+                           tx_bytes=tx_bytes, rx_dropped=rx_dropped, tx_dropped=tx_dropped, rx_errors=rx_errors,
+                           tx_errors=tx_errors, duration_sec=duration_sec, duration_nsec=duration_nsec)
+
+
+def flow_stat(match, packet_count, byte_count, duration_sec=0, duration_nsec=0, priority=1, cookie=0, table_id=0):
+    return SimpleNamespace(match=dict(match), packet_count=packet_count, byte_count=byte_count,
+                           duration_sec=duration_sec, duration_nsec=duration_nsec, priority=priority,
+                           cookie=cookie, table_id=table_id)
+
+
+if __name__ == "__main__":
+    # Replays canned stats through a stub switch polled every 100 ms and checks the flow bucket deltas
+    import tempfile
+    interval = 100000000
+    start = 1700000000 * 1000000000
+    old = {'in_port': 1, 'eth_src': '00:00:00:00:00:01', 'eth_dst': '00:00:00:00:00:02'}
+    new = {'in_port': 2, 'eth_src': '00:00:00:00:00:02', 'eth_dst': '00:00:00:00:00:01'}
+    datapath = StubDatapath(1, [
+        # First poll: the counters of the existing flow cover an unknown period
+        {'flow': [flow_stat(old, 50, 5000, duration_sec=30)]},
+        {'flow': [flow_stat(old, 60, 6000, duration_sec=30, duration_nsec=100000000)]},
+        # A flow installed 40 ms ago, between the two polls, and one unseen but older than the previous poll
+        {'flow': [flow_stat(old, 65, 6500, duration_sec=30, duration_nsec=200000000),
+                  flow_stat(new, 7, 700, duration_nsec=40000000),
+                  flow_stat(dict(new, in_port=3), 9, 900, duration_sec=5)]},
+        # The new flow expired and was reinstalled within the interval
+        {'flow': [flow_stat(old, 65, 6500, duration_sec=30, duration_nsec=300000000),
+                  flow_stat(new, 3, 300, duration_nsec=20000000)]},
+    ])
+    with tempfile.TemporaryDirectory() as captures_dir:
+        collector = TelemetryCollector(captures_dir, interval)
+        for i in range(len(datapath.replies)):
+            datapath.replay(collector, start + i * interval)
+        rows = {(iface, row[0], row[6]) for (iface, kind), buffer in collector.buffers.items() for row in buffer.rows}
+        expected = {('s1-eth1', start, 10), ('s1-eth1', start + interval, 5), ('s1-eth2', start + interval, 7),
+                    ('s1-eth2', start + 2 * interval, 3)}
+        assert rows == expected, rows
+        print(f"[INFO] Telemetry replay: {len(rows)} flow bucket deltas as expected.")
@@ -0,0 +1,58 @@
+import os
+import time
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3
+from capture_aggregation import DEFAULT_BUCKET_MS
+from telemetry import TelemetryCollector
+
+
+class StatsTelemetry(app_manager.RyuApp):
+    # Runs next to a switch app (ryu-manager simple_switch_13.py telemetry_app.py)
+    # and polls the port and flow counters of every connected switch once per
+    # interval. TELEMETRY_INTERVAL_MS and TELEMETRY_DIR set the interval and
+    # the folder of the segments.
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(StatsTelemetry, self).__init__(*args, **kwargs)
+        self.interval_s = int(os.environ.get('TELEMETRY_INTERVAL_MS', DEFAULT_BUCKET_MS)) / 1000
+        self.collector = TelemetryCollector(os.environ.get('TELEMETRY_DIR', 'captures'), int(self.interval_s * 1e9))
+        self.datapaths = {}
+        self.monitor_thread = hub.spawn(self._monitor)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        datapath = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER and datapath.id in self.datapaths:
+            del self.datapaths[datapath.id]
+            self.collector.remove_datapath(datapath.id)
+
+    def _monitor(self):
+        while True:
+            for datapath in list(self.datapaths.values()):
+                self.collector.request_stats(datapath)
+            # Requests aligned on the interval boundaries, so each one opens a bucket
+            hub.sleep(self.interval_s - time.time() % self.interval_s)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        msg = ev.msg
+        self.collector.port_stats_reply(msg.datapath.id, msg.body, msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        msg = ev.msg
+        self.collector.flow_stats_reply(msg.datapath.id, msg.body, msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE)
+
+    def stop(self):
+        hub.kill(self.monitor_thread)
+        written = self.collector.close()
+        self.logger.info("telemetry: %d requests, %d replies, %d segments written at stop",
+                         self.collector.requests, self.collector.replies, len(written))
+        super(StatsTelemetry, self).stop()
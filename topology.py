@@ -1,11 +1,13 @@
 import argparse
 from traffic_generation import generate_traffic
-import csv
-import datetime
+from capture_writer import export_csv
+from capture_engine import CaptureEngine
+from capture_stats import print_snapshot, append_snapshot, write_summary
+from forwarding import write_topology
+from readiness import wait_ready, DEFAULT_READY_TIMEOUT_S
+import json
 from os import makedirs, path, system, listdir
 import time
-from scapy.all import AsyncSniffer
-from scapy.layers.inet import IP, TCP, UDP
 
 from mininet.net import Mininet
 from mininet.topo import Topo
@@ -17,11 +19,31 @@ from mininet.link import TCLink
 parser = argparse.ArgumentParser(description="Network Testing: provide topology and test time")
 parser.add_argument("--topo", type=int, default=0, help="Select 0 for simple topology, 1 for complex topology (default 0)")
 parser.add_argument("--time", type=int, default=30, help="Duration of the test in seconds (default 30)")
+parser.add_argument("--csv", action="store_true", help="Also export the captures as per-interface csv files")
+parser.add_argument("--workers", type=int, default=None, help="Number of capture processes (default one per CPU)")
+parser.add_argument("--edge-only", action="store_true", help="Capture only the host-facing switch interfaces")
+parser.add_argument("--dedup", type=float, default=0, help="Drop packets already captured on another interface within this many milliseconds (default 0, disabled); captures with a single process")
+parser.add_argument("--aggregate", type=int, default=0, help="Write per-flow counters in buckets of this many milliseconds instead of packets (default 0, disabled)")
+parser.add_argument("--telemetry", type=int, default=0, help="Poll the switch port and flow counters every this many milliseconds from the controller instead of sniffing packets (default 0, disabled)")
+parser.add_argument("--proactive", action="store_true", help="Install destination-based forwarding rules from the known topology when the switches connect instead of learning them from packet_in (simple topology)")
+parser.add_argument("--stp-keep-macs", action="store_true", help="On STP topology changes keep the learned MACs and flows of ports still forwarding (complex topology)")
+parser.add_argument("--ready-timeout", type=float, default=DEFAULT_READY_TIMEOUT_S, help=f"Seconds to wait for the switches to connect and STP to converge before starting anyway (default {DEFAULT_READY_TIMEOUT_S:g})")
 args = parser.parse_args()
+if args.proactive and args.topo:
+    parser.error("--proactive runs simple_switch_13.py, the complex topology needs the STP controller")
 
 #Arguments
 TOPOLOGY = args.topo
 TEST_TIME = args.time
+EXPORT_CSV = args.csv
+CAPTURE_WORKERS = args.workers
+AGGREGATE_MS = args.aggregate
+EDGE_ONLY = args.edge_only
+DEDUP_WINDOW_MS = args.dedup
+TELEMETRY_MS = args.telemetry
+PROACTIVE = args.proactive
+STP_KEEP_MACS = args.stp_keep_macs
+READY_TIMEOUT_S = args.ready_timeout
 
 class SimpleTopology(Topo):
     
@@ -124,41 +146,26 @@ def print_network_configuration(net, file_path):
             node1, node2 = intf1.node, intf2.node
             file.write(f"  {node1.name}:{intf1.name} <--> {node2.name}:{intf2.name}\n")
             
-start_time = None
-def process_packet(packet, csv_file):
-    global start_time
-    if packet.haslayer("Ethernet") and packet.haslayer("IP"):
-        ip_layer = packet.getlayer(IP)
-        protocol = ip_layer.payload.name  # Layer 4 protocol name
-        
-        if start_time is None:
-            start_time = packet.time
-        elapsed_time = packet.time - start_time
-
-        timestamp = datetime.datetime.fromtimestamp(packet.time).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        src_mac = packet.src
-        dst_mac = packet.dst
-        src_port, dst_port = "-", "-"
-
-        if protocol == 'TCP':
-            tcp_layer = packet.getlayer(TCP)
-            src_port = tcp_layer.sport
-            dst_port = tcp_layer.dport
-        elif protocol == 'UDP':
-            udp_layer = packet.getlayer(UDP)
-            src_port = udp_layer.sport
-            dst_port = udp_layer.dport
-
-        packet_length = len(packet)
-        csv_file.write(f"{timestamp},{elapsed_time},{src_mac},{dst_mac},{src_port},{dst_port},{packet_length},{protocol}\n")
-
-def create_csv_files():
-    csv_files = {}
+def edge_interfaces(net):
+    # Switch interfaces linked to a host, every packet crosses at most two of them
+    hosts = set(net.hosts)
+    edges = set()
+    for link in net.links:
+        intf1, intf2 = link.intf1, link.intf2
+        if intf1.node in hosts and intf2.node not in hosts:
+            edges.add(intf2.name)
+        elif intf2.node in hosts and intf1.node not in hosts:
+            edges.add(intf1.name)
+    return edges
+
+def list_capture_interfaces(net):
+    ifaces = []
+    edges = edge_interfaces(net) if EDGE_ONLY else None
     captures_dir = "captures"
     if not path.exists(captures_dir):
         makedirs(captures_dir)
         
-    print("[INFO] Building csv files.")
+    print("[INFO] Listing capture interfaces.")
     for iface in listdir("/sys/class/net"):
         operstate_file = path.join("/sys/class/net", iface, "operstate")
         if not path.isfile(operstate_file):
@@ -167,53 +174,101 @@ def create_csv_files():
             operstate = f.read().strip()
         if operstate != "up" or iface.startswith("lo") or iface.startswith("enp"):
             continue
+        if edges is not None and iface not in edges:
+            continue
 
-        csv_filepath = f"{captures_dir}/{iface}_packet_traffic.csv"
-        csv_file = open(csv_filepath, mode='w', newline='')
-        fieldnames = ['Timestamp', 'Elapsed time', 'Source MAC', 'Destination MAC', 'Source Port', 'Destination Port', 'Length', 'Protocol']
-        csv_writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        csv_writer.writeheader()
-
-        # Associating csv files with interfaces
-        csv_files[iface] = csv_file
+        ifaces.append(iface)
         
         print(".", end="", flush=True)
     print()
 
-    return csv_files 
+    return sorted(ifaces)
 
-def start_capture(csv_files):
-    # Start packet sniffer threads for each host
-    sniffer_tasks = []
+def start_capture(ifaces):
+    # Start capture processes, interfaces are sharded across them
     print("[INFO] Starting capture.")
-    for iface, csv_file in csv_files.items():
-        sniffer_task = AsyncSniffer(iface=iface, prn=lambda pkt, csvf=csv_file: process_packet(pkt, csvf))
-        sniffer_tasks.append(sniffer_task)
-
-    for sniffer in sniffer_tasks:
-        sniffer.start()
-
-    return sniffer_tasks
-
-def stop_capture(sniffer_tasks, csv_files):
+    engine = CaptureEngine(ifaces, "captures", workers=CAPTURE_WORKERS, aggregate_ns=AGGREGATE_MS * 1000000 or None,
+                           dedup_window_ms=DEDUP_WINDOW_MS or None)
+    engine.start()
+    print(f"Capturing {len(ifaces)} interfaces with {len(engine.processes)} processes.")
+
+    return engine
+
+def capture_stats_tick(engine):
+    # Periodic capture statistics snapshot during traffic generation
+    def on_tick(elapsed):
+        engine.poll_stats()
+        if engine.stats:
+            print_snapshot(elapsed, engine.stats)
+            append_snapshot("captures/capture_stats.jsonl", elapsed, engine.stats)
+    return on_tick
+
+def stop_capture(engine):
     print("[INFO] Stopping capture.")
-    print("Stopping sniffers:")
-    for sniffer in sniffer_tasks:
-        sniffer.stop()
-        print(".", end="", flush=True)
-    print()
-    print("Closing csv files:")
-    for csv_file in csv_files.values():
-        csv_file.close()
-        print(".", end="", flush=True)
-    print()
+    print("Stopping capture processes and flushing segments.")
+    stats = engine.stop()
+    write_summary("captures/capture_stats.json", stats)
+    print("Capture statistics saved in captures/capture_stats.json")
+    if EXPORT_CSV and not AGGREGATE_MS:
+        print("Exporting csv files.")
+        export_csv("captures")
     return
 
+def write_controller_topology(net, file_path):
+    # Host attachments and switch links with their OpenFlow port numbers, for the proactive controller
+    switches = set(net.switches)
+    hosts = {}
+    links = []
+    for link in net.links:
+        intf1, intf2 = link.intf1, link.intf2
+        node1, node2 = intf1.node, intf2.node
+        if node1 in switches and node2 in switches:
+            links.append((int(node1.dpid, 16), node1.ports[intf1], int(node2.dpid, 16), node2.ports[intf2]))
+        elif node2 in switches:
+            hosts[intf1.MAC()] = (int(node2.dpid, 16), node2.ports[intf2])
+        elif node1 in switches:
+            hosts[intf2.MAC()] = (int(node1.dpid, 16), node1.ports[intf1])
+    write_topology(file_path, hosts, links)
+
+def controller_command(app):
+    # Configuration of the controller apps goes through the environment. With telemetry
+    # the stats collector runs in the same controller as the switch app
+    env = ("CONTROLLER_STATS=captures/controller_stats.json RECONVERGENCE_LOG=captures/stp_reconvergence.jsonl "
+           "CONTROLLER_STATE=captures/controller_state.json")
+    if STP_KEEP_MACS:
+        env += " KEEP_FORWARDING_MACS=1"
+    if PROACTIVE:
+        env += " PROACTIVE_TOPOLOGY=controller_topology.json"
+    if TELEMETRY_MS:
+        return f"{env} TELEMETRY_INTERVAL_MS={TELEMETRY_MS} TELEMETRY_DIR=captures ryu-manager {app} telemetry_app.py"
+    return f"{env} ryu-manager {app}"
+
+def stop_telemetry():
+    # The controller writes its last counters when it is interrupted
+    print("[INFO] Stopping controller telemetry.")
+    system("pkill -INT -f telemetry_app.py")
+    time.sleep(1)
+    print("Switch counters saved in captures/*_flow_buckets.*.npz and captures/*_port_stats.*.npz")
+
+def wait_network_ready(net, stp):
+    # Polls until the switches are connected and known by the controller (and STP converged)
+    switch_ports = {int(switch.dpid, 16): len([intf for intf in switch.intfList() if intf.name != 'lo'])
+                    for switch in net.switches}
+    names = {int(switch.dpid, 16): switch.name for switch in net.switches}
+    phases, pending = wait_ready(switch_ports, names, 'captures/controller_state.json', stp, READY_TIMEOUT_S)
+    for phase, seconds in phases.items():
+        print(f"  {phase}: {seconds:.1f} s after the controller start")
+    if pending:
+        print(f"[WARNING] Network not ready after {READY_TIMEOUT_S:g} s: {pending['phase']} still pending "
+              f"for switches {', '.join(names[dpid] for dpid in pending['pending'])}, starting anyway.")
+    return phases, pending is None
+
 def run_topology():
 
     print("[INFO] Cleaning previous network instances.\n")
     system("sudo mn -c > /dev/null 2>&1 ")
-    system("rm -rf ./captures/*.csv")
+    system("rm -rf ./captures/*.csv ./captures/*.npz ./captures/*.tmp ./captures/capture_stats.json* ./captures/controller_stats.json ./captures/stp_reconvergence.jsonl ./captures/controller_state.json*")
+    makedirs("captures", exist_ok=True)
 
     controller = RemoteController("c1", ip="127.0.0.1", port=6633)
     topo = ComplexTopology() if TOPOLOGY else SimpleTopology()
@@ -226,38 +281,54 @@ def run_topology():
         autoStaticArp=True,
         link=TCLink,
     )
+    start = time.monotonic()
+    timings = {}
     net.build()
     net.start()
-    time.sleep(1)
+    timings['network_start'] = time.monotonic() - start
     print("\n[INFO] Network started.")
+    if PROACTIVE:
+        write_controller_topology(net, 'controller_topology.json')
+        print("Topology for the proactive controller saved in controller_topology.json")
     
+    controller_start = time.monotonic()
     if TOPOLOGY:
-        print("[INFO] Starting controller, waiting 40 seconds.")
-        system("ryu-manager simple_switch_stp_13.py > /dev/null 2>&1 &")
+        print("[INFO] Starting controller, waiting for the switches and STP convergence.")
+        system(f"{controller_command('simple_switch_stp_13.py')} > /dev/null 2>&1 &")
         print("Running: SimpleSwitch 1.3 STP controller.")
-        time.sleep(40)
     else:
-        print("[INFO] Starting controller, waiting 3 seconds.")
-        system("ryu-manager simple_switch_13.py > /dev/null 2>&1 &")
+        print("[INFO] Starting controller, waiting for the switches.")
+        system(f"{controller_command('simple_switch_13.py')} > /dev/null 2>&1 &")
         print("Running: SimpleSwitch 1.3 controller.")
-        time.sleep(3)
+    phases, timings['ready'] = wait_network_ready(net, TOPOLOGY)
+    timings.update({phase: seconds + controller_start - start for phase, seconds in phases.items()})
     
     print("[INFO] Controller started.")
 
     print("[INFO] Testing ping connectivity.")
-    net.pingAll()
-    time.sleep(1)
+    timings['ping_loss_percent'] = net.pingAll()
+    timings['ping_done'] = time.monotonic() - start
+    # Startup phases in seconds since the network build
+    with open("captures/startup_timings.json", 'w') as f:
+        json.dump(timings, f, indent=2)
+    print(f"Network ready for traffic after {timings['ping_done']:.1f} s, timings saved in captures/startup_timings.json")
     print_network_configuration(net, 'network_configuration.txt')
     print("Printed network configuration in network_configuration.txt")
-    csv_files = create_csv_files()
+    if TELEMETRY_MS:
+        # Counters polled by the controller, nothing is sniffed
+        print(f"[INFO] Starting traffic, switch counters polled every {TELEMETRY_MS} ms.")
+        generate_traffic(net, TEST_TIME, report_path="captures/traffic_ticks.csv")
+        stop_telemetry()
+    else:
+        ifaces = list_capture_interfaces(net)
 
-    sniffer_tasks = start_capture(csv_files)
+        engine = start_capture(ifaces)
 
-    print("[INFO] Starting traffic.")
-    generate_traffic(net, TEST_TIME)
+        print("[INFO] Starting traffic.")
+        generate_traffic(net, TEST_TIME, on_tick=capture_stats_tick(engine), report_path="captures/traffic_ticks.csv")
 
-    stop_capture(sniffer_tasks, csv_files)
-    print("[INFO] Capture stopped.")
+        stop_capture(engine)
+        print("[INFO] Capture stopped.")
     
     # CLI to inspect the network
     # CLI(net)
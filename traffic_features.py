@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+from capture_writer import PROTOCOL_CODES
+from bucket_pyramid import interval_ns
+
+EWMA_ALPHAS = (0.5, 0.1)
+PROTOCOL_COLUMNS = [f'{name.lower()}_share' for name in PROTOCOL_CODES]
+
+
+def flow_ids(src_mac, dst_mac, src_port, dst_port, protocol):
+    # Dense id of the 5-tuple of every packet, hashed (no sort) so it stays linear
+    keys = pd.DataFrame({'src_mac': src_mac, 'dst_mac': dst_mac, 'src_port': src_port,
+                         'dst_port': dst_port, 'protocol': protocol})
+    return keys.groupby(list(keys.columns), sort=False).ngroup().values
+
+
+def bucket_features(timestamps, lengths, protocols, flows, width_ns, packets=None):
+    # Per-bucket traffic features from time-sorted packet arrays in one pass of
+    # bincounts: rates, EWMA rates, mean packet size, inter-arrival statistics,
+    # protocol mix and active flows. With flow buckets (packets holds their
+    # counters) inter-arrival times are unknown and left out.
+    timestamps = np.asarray(timestamps).astype('datetime64[ns]').view(np.int64)
+    first = timestamps[0] // width_ns
+    buckets = timestamps // width_ns - first
+    size = int(buckets[-1]) + 1
+    weights = None if packets is None else np.asarray(packets, dtype=np.float64)
+    counts = np.bincount(buckets, weights=weights, minlength=size).astype(np.float64)
+    volume = np.bincount(buckets, weights=np.asarray(lengths, dtype=np.float64), minlength=size)
+    seconds = width_ns / 1e9
+    features = {
+        'packets': counts,
+        'bytes': volume,
+        'packets_per_s': counts / seconds,
+        'bytes_per_s': volume / seconds,
+        'mean_size': np.divide(volume, counts, out=np.zeros(size), where=counts > 0),
+    }
+    for alpha in EWMA_ALPHAS:
+        features[f'ewma_packets_per_s_{alpha}'] = pd.Series(features['packets_per_s']).ewm(alpha=alpha).mean().values
+        features[f'ewma_bytes_per_s_{alpha}'] = pd.Series(features['bytes_per_s']).ewm(alpha=alpha).mean().values
+
+    if packets is None:
+        # Gap to the previous packet, counted in the bucket of the later one
+        gaps = np.diff(timestamps).astype(np.float64) / 1e9
+        gap_buckets = buckets[1:]
+        gap_counts = np.bincount(gap_buckets, minlength=size)
+        gap_sums = np.bincount(gap_buckets, weights=gaps, minlength=size)
+        gap_squares = np.bincount(gap_buckets, weights=gaps * gaps, minlength=size)
+        mean = np.divide(gap_sums, gap_counts, out=np.zeros(size), where=gap_counts > 0)
+        features['iat_mean'] = mean
+        features['iat_std'] = np.sqrt(np.maximum(np.divide(gap_squares, gap_counts, out=np.zeros(size),
+                                                           where=gap_counts > 0) - mean * mean, 0))
+        # Buckets are sorted, so the maximum of each one is a reduceat over its slice
+        iat_max = np.zeros(size)
+        starts = np.flatnonzero(np.diff(gap_buckets, prepend=-1))
+        if len(starts):
+            iat_max[gap_buckets[starts]] = np.maximum.reduceat(gaps, starts)
+        features['iat_max'] = iat_max
+
+    protocols = np.asarray(protocols, dtype=np.int64)
+    mix = np.bincount(buckets * len(PROTOCOL_CODES) + protocols, weights=weights,
+                      minlength=size * len(PROTOCOL_CODES)).reshape(size, len(PROTOCOL_CODES))
+    for code, column in enumerate(PROTOCOL_COLUMNS):
+        features[column] = np.divide(mix[:, code], counts, out=np.zeros(size), where=counts > 0)
+
+    flows = np.asarray(flows, dtype=np.int64)
+    flow_count = int(flows.max()) + 1
+    active = pd.unique(buckets * flow_count + flows) // flow_count
+    features['active_flows'] = np.bincount(active, minlength=size).astype(np.float64)
+
+    index = pd.date_range(start=pd.Timestamp(first * width_ns), periods=size,
+                          freq=pd.Timedelta(width_ns, unit='ns'), name='Timestamp')
+    return pd.DataFrame(features, index=index)
+
+
+def flow_features(timestamps, lengths, flows, packets=None, width_ns=None):
+    # Per-flow totals, rates and inter-arrival statistics. The previous packet
+    # of the same flow comes from a grouped shift, which pandas computes with a
+    # counting sort, so this stays linear in the number of packets. With
+    # width_ns they are computed per (bucket, flow), rates over the bucket
+    # width and the gap to the previous packet of the flow counted in the
+    # bucket of the later one.
+    timestamps = np.asarray(timestamps).astype('datetime64[ns]').view(np.int64)
+    frame = pd.DataFrame({'flow': flows, 'timestamp': timestamps,
+                          'packets': 1.0 if packets is None else np.asarray(packets, dtype=np.float64),
+                          'bytes': np.asarray(lengths, dtype=np.float64)})
+    frame['iat'] = (frame['timestamp'] - frame.groupby('flow')['timestamp'].shift(1)) / 1e9
+    keys = ['flow']
+    if width_ns:
+        frame['bucket'] = frame['timestamp'] // width_ns
+        keys = ['bucket', 'flow']
+    flows = frame.groupby(keys).agg(packets=('packets', 'sum'), bytes=('bytes', 'sum'), first=('timestamp', 'min'),
+                                    last=('timestamp', 'max'), iat_mean=('iat', 'mean'), iat_std=('iat', 'std'),
+                                    iat_max=('iat', 'max'))
+    flows['duration'] = (flows['last'] - flows['first']) / 1e9
+    active = flows['duration'].where(flows['duration'] > 0) if not width_ns else width_ns / 1e9
+    flows['packets_per_s'] = (flows['packets'] / active).fillna(0)
+    flows['bytes_per_s'] = (flows['bytes'] / active).fillna(0)
+    flows['first'] = pd.to_datetime(flows['first'], unit='ns')
+    flows['last'] = pd.to_datetime(flows['last'], unit='ns')
+    return flows.fillna({'iat_mean': 0, 'iat_std': 0, 'iat_max': 0})
+
+
+def capture_features(df, interval):
+    # Bucket features of the prediction DataFrame (packets or flow buckets, sorted by time),
+    # with the per-bucket mean and maximum of the flow rates and the mean flow inter-arrival
+    packets = df['Packets'].values if 'Packets' in df.columns else None
+    flows = flow_ids(df['Source MAC'].values, df['Destination MAC'].values, df['Source Port'].values,
+                     df['Destination Port'].values, df['Protocol'].values)
+    width_ns = interval_ns(interval)
+    features = bucket_features(df['Timestamp'].values, df['Length'].values, df['Protocol'].values, flows,
+                               width_ns, packets)
+    by_bucket = flow_features(df['Timestamp'].values, df['Length'].values, flows, packets, width_ns).groupby(level='bucket')
+    per_bucket = pd.DataFrame({'flow_packets_per_s_mean': by_bucket['packets_per_s'].mean(),
+                               'flow_packets_per_s_max': by_bucket['packets_per_s'].max()})
+    if packets is None:
+        per_bucket['flow_iat_mean'] = by_bucket['iat_mean'].mean()
+    per_bucket.index = pd.DatetimeIndex(per_bucket.index.values * width_ns)
+    return features.join(per_bucket.reindex(features.index, fill_value=0))
@@ -1,78 +1,162 @@
+import json
+import os
 import random
+import subprocess
+import sys
 import time
 import math
 
-def linear_traffic(host1, host2, start_time, current_time, duration):
-    elapsed_time = current_time - start_time
-    bandwidth = 1 + elapsed_time / duration  # Linearly increasing 
-    host1.cmd(f"iperf -c {host2.IP()} -b {bandwidth}M -t 1 &")
-    host1.cmd(f"iperf -u -c {host2.IP()} -b {bandwidth}M -t 1 &")  # Adding UDP traffic
-
-def sinusoidal_traffic(host1, host2, start_time, current_time, duration):
-    elapsed_time = current_time - start_time
-    bandwidth = 1 + math.sin(2 * math.pi * elapsed_time / duration)  # Sinusoidal bandwidth
-    host1.cmd(f"iperf -c {host2.IP()} -b {bandwidth}M -t 1 &")
-    host1.cmd(f"iperf -u -c {host2.IP()} -b {bandwidth}M -t 1 &")  # Adding UDP traffic
-
-def sawtooth_traffic(host1, host2, start_time, current_time, duration):
-    elapsed_time = current_time - start_time
-    bandwidth = 1 + (elapsed_time % (duration / 10)) / (duration / 10)  # Sawtooth bandwidth
-    host1.cmd(f"iperf -c {host2.IP()} -b {bandwidth}M -t 1 &")
-    host1.cmd(f"iperf -u -c {host2.IP()} -b {bandwidth}M -t 1 &")  # Adding UDP traffic
-
-def square_traffic(host1, host2, start_time, current_time, duration):
-    elapsed_time = current_time - start_time
-    bandwidth = 1 if (elapsed_time % 2 < 1) else 10  # Square wave bandwidth
-    host1.cmd(f"iperf -c {host2.IP()} -b {bandwidth}M -t 1 &")
-    host1.cmd(f"iperf -u -c {host2.IP()} -b {bandwidth}M -t 1 &")  # Adding UDP traffic
+# Generators run in every host: one sink, and one sender pacing all the flows of the host
+SENDER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traffic_sender.py")
+TICK_S = 1
+BACKGROUND_MBPS = 1
+PROTOCOLS = ('tcp', 'udp')
+
+def linear_traffic(elapsed_time, duration):
+    return 1 + elapsed_time / duration  # Linearly increasing
+
+def sinusoidal_traffic(elapsed_time, duration):
+    return 1 + math.sin(2 * math.pi * elapsed_time / duration)  # Sinusoidal bandwidth
+
+def sawtooth_traffic(elapsed_time, duration):
+    return 1 + (elapsed_time % (duration / 10)) / (duration / 10)  # Sawtooth bandwidth
+
+def square_traffic(elapsed_time, duration):
+    return 1 if (elapsed_time % 2 < 1) else 10  # Square wave bandwidth
 
 def constant_traffic(net):
-    for host in net.hosts:
-        for other_host in net.hosts:
-            if other_host != host:
-                host.cmd(f"iperf -c {other_host.IP()} -b 1M -t 1 &")
-                host.cmd(f"iperf -u -c {other_host.IP()} -b 1M -t 1 &")  # Adding UDP traffic
+    # Background TCP and UDP flow between every pair of hosts
+    return {(host, other_host, protocol): BACKGROUND_MBPS
+            for host in net.hosts for other_host in net.hosts if other_host != host for protocol in PROTOCOLS}
+
+class TrafficEngine:
+    # Long-lived generators started once: the rate of a flow is changed in
+    # place by a JSON line written (non-blocking) to its host's sender, and
+    # only for hosts whose flows changed, so a tick costs the same whatever
+    # the number of hosts
+
+    def __init__(self, net):
+        self.net = net
+        self.sinks = {}
+        self.senders = {}
+        self.rates = {}
+        self.updates = 0
+        self.deferred = 0
+
+    def start(self):
+        for host in self.net.hosts:
+            self.sinks[host] = host.popen([sys.executable, SENDER_PATH, "--sink"],
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            sender = host.popen([sys.executable, SENDER_PATH], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            os.set_blocking(sender.stdin.fileno(), False)
+            self.senders[host] = sender
+            print(".", end="", flush=True)
+        print()
+
+    def set_rates(self, rates):
+        # rates: {(source host, destination host, protocol): Mbps}
+        flows = {}
+        for (host, other_host, protocol), mbps in rates.items():
+            flows.setdefault(host, []).append([other_host.IP(), protocol, mbps])
+        for host, host_flows in flows.items():
+            if self.rates.get(host) == host_flows:
+                continue
+            try:
+                # Lines are far below PIPE_BUF, so they are written whole or not at all
+                os.write(self.senders[host].stdin.fileno(), (json.dumps({'flows': host_flows}) + "\n").encode())
+            except BlockingIOError:
+                # Sender busy, the update is retried at the next tick
+                self.deferred += 1
+                continue
+            self.rates[host] = host_flows
+            self.updates += 1
+
+    def stop(self):
+        # Bytes sent by every host, reported by the senders when their input closes
+        sent = {}
+        for host, sender in self.senders.items():
+            sender.stdin.close()
+            try:
+                output = sender.stdout.read().decode().strip()
+                sender.wait(timeout=5)
+                sent[host.name] = sum(json.loads(output).values()) if output else 0
+            except (subprocess.TimeoutExpired, ValueError):
+                sender.kill()
+        for sink in self.sinks.values():
+            sink.terminate()
+            sink.wait()
+        return sent
 
 def cleanup(net):
     for host in net.hosts:
-        host.cmd("killall -9 iperf")
+        host.cmd(f"pkill -f {os.path.basename(SENDER_PATH)}")
     print("Cleanup complete.")
 
-def generate_traffic(net, duration:int):
+def generate_traffic(net, duration:int, on_tick=None, report_path=None):
     random.seed(time.time())
-    
-    # Starting iperf server on hosts
-    print("[INFO] Starting servers.")
-    for host in  net.hosts:
-        host.cmd("iperf -s &")
-        print(".", end="", flush=True)
-    print()
- 
+
+    # Starting the generators on hosts
+    print("[INFO] Starting generators.")
+    engine = TrafficEngine(net)
+    engine.start()
+
     # Periodic traffic routines
     traffic_routines = [linear_traffic, sinusoidal_traffic, sawtooth_traffic, square_traffic]
 
     # Sample two random hosts
     host1, host2 = random.sample(net.hosts, 2)
     routine = random.choice(traffic_routines)
-    
+
     print("Generic constant traffic running in the background.")
     print(f"Applying {routine.__name__} between {host1.name} and {host2.name}.")
-    
-    # Traffic generation loop
-    start_time = time.time()
-    while time.time() - start_time < duration:
-        current_time = time.time()
-        
-        # Generate constant background traffic
-        constant_traffic(net)
-        
-        # Generate periodic traffic
-        routine(host1, host2, start_time, current_time, duration)
-
-        time.sleep(1)
+
+    # Traffic generation loop, ticks scheduled on absolute times so their lag does not accumulate
+    background = constant_traffic(net)
+    ticks = []
+    skipped = 0
+    start_time = time.monotonic()
+    tick = 0
+    while tick * TICK_S < duration:
+        scheduled = start_time + tick * TICK_S
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        current_time = time.monotonic()
+
+        # Constant background traffic plus the periodic routine between the sampled hosts
+        rates = dict(background)
+        bandwidth = routine(current_time - start_time, duration)
+        for protocol in PROTOCOLS:
+            rates[(host1, host2, protocol)] += bandwidth
+        engine.set_rates(rates)
+        ticks.append((tick, current_time - scheduled, engine.updates))
+
+        # Periodic hook, e.g. capture statistics snapshots
+        if on_tick is not None:
+            on_tick(current_time - start_time)
+
+        # A tick later than a whole period is skipped, not replayed
+        next_tick = int((time.monotonic() - start_time) / TICK_S) + 1
+        skipped += next_tick - tick - 1
+        tick = next_tick
+
+    sent = engine.stop()
 
     # Cleanup
     cleanup(net)
 
+    lags = sorted(lag for _, lag, _ in ticks)
+    print(f"[STATS] {len(ticks)} ticks, scheduling lag mean {sum(lags) / len(lags) * 1e3:.1f} ms, "
+          f"p99 {lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1e3:.1f} ms, max {lags[-1] * 1e3:.1f} ms, "
+          f"{skipped} skipped; {engine.updates} rate updates ({engine.deferred} deferred), "
+          f"{sum(sent.values()) / 1e6:.1f} MB sent.")
+    if report_path:
+        with open(report_path, 'w') as f:
+            f.write("tick,lag_ms,rate_updates\n")
+            for tick, lag, updates in ticks:
+                f.write(f"{tick},{lag * 1e3:.3f},{updates}\n")
+        print(f"Per-tick scheduling lag saved in {report_path}")
+
     # Wait for the routine to finish
-    print("[INFO] Traffic generation completed.")
\ No newline at end of file
+    print("[INFO] Traffic generation completed.")
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import selectors
+import socket
+import sys
+import time
+
+DEFAULT_PORT = 5001
+PAYLOAD_BYTES = 1400
+# Tokens are capped to this much time at the flow rate, so a stalled flow does not burst afterwards
+BURST_S = 0.05
+SLICE_S = 0.001
+RETRY_S = 1.0
+
+
+class Flow:
+    # One paced TCP or UDP stream to a host, its rate changed in place
+
+    def __init__(self, ip, protocol, port):
+        self.address = (ip, port)
+        self.protocol = protocol
+        self.rate = 0.0
+        self.tokens = 0.0
+        self.sent = 0
+        self.sock = None
+        self.retry_at = 0.0
+
+    def connect(self, now):
+        # Non-blocking: until a TCP connection is established its sends would block and are skipped
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM if self.protocol == 'tcp' else socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+            self.sock.connect_ex(self.address)
+        except OSError:
+            self.close()
+            self.retry_at = now + RETRY_S
+
+    def pump(self, dt, now, payload):
+        if self.rate <= 0:
+            self.tokens = 0.0
+            return
+        if self.sock is None:
+            if now < self.retry_at:
+                return
+            self.connect(now)
+            if self.sock is None:
+                return
+        bytes_per_s = self.rate * 1e6 / 8
+        self.tokens = min(self.tokens + bytes_per_s * dt, bytes_per_s * BURST_S + len(payload))
+        while self.tokens >= len(payload):
+            try:
+                sent = self.sock.send(payload)
+            except BlockingIOError:
+                # Socket buffer full: this slice's share is dropped, not queued
+                self.tokens = 0.0
+                return
+            except OSError:
+                self.close()
+                self.retry_at = now + RETRY_S
+                return
+            self.tokens -= sent
+            self.sent += sent
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def send(port):
+    # Rate updates arrive on stdin as JSON lines {"flows": [[ip, "tcp"|"udp", mbps], ...]},
+    # the full set of flows of this host; at end of input the bytes sent are printed
+    selector = selectors.DefaultSelector()
+    stdin = sys.stdin.fileno()
+    os.set_blocking(stdin, False)
+    selector.register(stdin, selectors.EVENT_READ)
+    payload = bytes(PAYLOAD_BYTES)
+    flows = {}
+    pending = b''
+    last = time.monotonic()
+    while True:
+        for key, mask in selector.select(timeout=SLICE_S):
+            data = os.read(stdin, 65536)
+            if not data:
+                for flow in flows.values():
+                    flow.close()
+                print(json.dumps({f"{ip}/{protocol}": flow.sent for (ip, protocol), flow in flows.items()}), flush=True)
+                return
+            pending += data
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                rates = {(ip, protocol): mbps for ip, protocol, mbps in json.loads(line)['flows']}
+                for flow_key in set(rates) | set(flows):
+                    flow = flows.get(flow_key)
+                    if flow is None:
+                        flow = flows[flow_key] = Flow(flow_key[0], flow_key[1], port)
+                    flow.rate = rates.get(flow_key, 0.0)
+        now = time.monotonic()
+        dt, last = now - last, now
+        for flow in flows.values():
+            flow.pump(dt, now, payload)
+
+
+def sink(port):
+    # Receives and discards the TCP and UDP streams sent to this host
+    selector = selectors.DefaultSelector()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('0.0.0.0', port))
+    listener.listen(128)
+    listener.setblocking(False)
+    selector.register(listener, selectors.EVENT_READ, 'accept')
+    datagrams = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagrams.bind(('0.0.0.0', port))
+    datagrams.setblocking(False)
+    selector.register(datagrams, selectors.EVENT_READ, 'read')
+    while True:
+        for key, mask in selector.select():
+            if key.data == 'accept':
+                connection, address = listener.accept()
+                connection.setblocking(False)
+                selector.register(connection, selectors.EVENT_READ, 'read')
+                continue
+            try:
+                data = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            except ConnectionResetError:
+                data = b''
+            if not data and key.fileobj.type == socket.SOCK_STREAM:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Long-lived traffic generator run on every Mininet host by traffic_generation.py")
+    parser.add_argument("--sink", action="store_true", help="Receive and discard instead of sending")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port of the sinks (default {DEFAULT_PORT})")
+    args = parser.parse_args()
+    try:
+        if args.sink:
+            sink(args.port)
+        else:
+            send(args.port)
+    except KeyboardInterrupt:
+        pass